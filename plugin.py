@@ -22,12 +22,17 @@ else:
 
     # Publish Commands and EventListeners
     from .plugins.cmds import (
+        CancelBuildTags,
         CTagsAutoComplete,
+        CTagsHoverPreview,
+        FindReferences,
         NavigateToDefinition,
         RebuildTags,
         SearchForDefinition,
         ShowSymbols,
+        ShowSymbolsOfKind,
         TestCtags,
+        plugin_loaded,
     )
 
     from .plugins.edit import apply_edit
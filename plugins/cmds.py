@@ -1,13 +1,17 @@
 import functools
+import heapq
+import html
+import importlib
 import locale
 import os
-import pprint
 import re
 import string
 import subprocess
 import threading
+import time
+import traceback
 
-from collections import defaultdict
+from collections import Counter, defaultdict, OrderedDict
 from itertools import chain
 from operator import itemgetter as iget
 
@@ -15,14 +19,23 @@ import sublime
 import sublime_plugin
 from sublime import status_message, error_message
 
+from . import snapshot
 from .activity_indicator import ActivityIndicator
 
 from .ctags import (
     FILENAME,
     PATH_ORDER,
     SYMBOL,
+    BuildAborted,
+    BuildCancelled,
+    BuildJob,
     build_ctags,
+    build_priority_ctags,
+    get_generation,
+    get_partitions,
+    iter_tags,
     parse_tag_lines,
+    MultiTagFile,
     TagElements,
     TagFile,
 )
@@ -30,6 +43,7 @@ from .ctags import (
 from .edit import Edit
 from .ranking.parse import Parser
 from .ranking.rank import RankMgr
+from .snapshot import dump_tags, load_snapshot, restore_tags, save_snapshot
 from .utils import *
 
 #
@@ -48,12 +62,32 @@ RUBY_SPECIAL_ENDINGS = r"\?|!"
 
 ON_LOAD = sublime_plugin.all_callbacks["on_load"]
 
+# modules which are slow to import and only used by some commands, see
+# ``load_module``
+DEFERRED_MODULES = ("columns", "references", "tagdb", "verify")
+
 
 #
 # Functions
 #
 
 
+def load_module(name):
+    """
+    Import one of the ``DEFERRED_MODULES`` on first use.
+
+    They pull in NumPy, SQLite or process pools, so importing them when the
+    plugin is loaded would slow down startup for every user.
+
+    :param name: name of the module in this package
+
+    :returns: the module
+    """
+    if name not in DEFERRED_MODULES:
+        raise ValueError("Module '%s' is imported at the top of cmds.py." % name)
+    return importlib.import_module("." + name, __package__)
+
+
 def select(view, region):
     sel_set = view.sel()
     sel_set.clear()
@@ -200,6 +234,45 @@ def find_tags_relative_to(path, tag_file):
     return None
 
 
+def open_tag_file(path, column, ignore_case=False, build=True):
+    """
+    Create a model of a tag file, using the configured backend.
+
+    :param path: path to a tag file
+    :param column: column to search on
+    :param ignore_case: search symbols case-insensitively
+    :param build: build missing or outdated databases and sorted copies of
+        the tag file. If not set, the tag file itself is searched instead.
+
+    :returns: ``TagDatabase`` if the ``tag_backend`` setting is ``"sqlite"``,
+        else ``TagFile``
+    """
+    if setting("tag_backend") == "sqlite":
+        database = load_module("tagdb").TagDatabase(path, column, ignore_case, build)
+        if build or database.is_current():
+            return database
+    return TagFile(path, column, ignore_case, build)
+
+
+def open_tag_files(paths, column, ignore_case=False, build=True):
+    """
+    Create a model of one or more tag files, see ``open_tag_file``.
+
+    :param paths: list of paths to tag files
+    :param column: column to search on
+    :param ignore_case: search symbols case-insensitively
+    :param build: build missing or outdated databases and sorted copies
+
+    :returns: ``MultiTagFile`` if several paths are given, else the model of
+        the single tag file
+    """
+    if len(paths) == 1:
+        return open_tag_file(paths[0], column, ignore_case, build)
+    return MultiTagFile(
+        [open_tag_file(path, column, ignore_case, build) for path in paths]
+    )
+
+
 def read_opts(view):
     # the first one is useful to change opts only on a specific project
     # (by adding ctags.opts to a project settings file)
@@ -259,6 +332,59 @@ def get_alternate_tags_paths(view, tags_file):
     return ret
 
 
+def get_root_tags_paths(view, tags_file):
+    """
+    Get the tag files of all folders of a window, to be searched as one.
+
+    :param view: sublime text view
+    :param tags_file: path to the tag file of the view
+
+    :returns: list of paths of existing tag files, starting with ``tags_file``
+    """
+    paths = [tags_file]
+
+    if setting("merge_folder_tags"):
+        for folder in view.window().folders():
+            path = os.path.normpath(os.path.join(folder, setting("tag_file")))
+            if path not in paths and os.path.isfile(path):
+                paths.append(path)
+
+    return paths
+
+
+def get_language_groups(view, tags_paths):
+    """
+    Group tag files to search for the language of a view.
+
+    The partitions of the tag files holding the tags of the languages mapped
+    to the view's source by the ``language_partitions`` setting are searched
+    first. The whole tag files follow if the ``cross_language_fallback``
+    setting is enabled. Tag files without current partitions are searched
+    as a whole.
+
+    :param view: sublime text view
+    :param tags_paths: list of paths to tag files, to be searched as one
+
+    :returns: list of lists of paths to tag files, to be searched in order
+    """
+    languages = setting("language_partitions", {}).get(get_source(view))
+    if not languages:
+        return [tags_paths]
+
+    partitions = []
+    for path in tags_paths:
+        found = get_partitions(path, languages)
+        partitions.extend([path] if found is None else found)
+
+    if partitions == tags_paths:
+        return [tags_paths]
+
+    groups = [partitions] if partitions else []
+    if setting("cross_language_fallback"):
+        groups.append(tags_paths)
+    return groups
+
+
 def get_common_ancestor_folder(path, folders):
     """
     Get common ancestor for a file and a list of folders.
@@ -455,12 +581,12 @@ def get_current_file_suffix(path):
 # CTags commands
 
 
-def show_tag_panel(view, result, jump_directly):
+def show_tag_panel(view, result, jump_directly, on_jump=None):
     """
     Handle tag navigation command.
 
     Jump directly to a tag entry, or show a quick panel with a list of
-    matching tags
+    matching tags. ``on_jump`` is called with the tag jumped to, if any.
     """
     if result not in (True, False, None):
         args, display = result
@@ -473,6 +599,8 @@ def show_tag_panel(view, result, jump_directly):
                 # selecting an entry.
                 # See https://github.com/SublimeText/Issues/issues/39
                 view.window().run_command("hide_overlay")
+                if on_jump:
+                    on_jump(args[i])
                 scroll_to_tag(view, args[i])
 
         if jump_directly and len(args) == 1:
@@ -507,34 +635,142 @@ def ctags_goto_command(jump_directly=False):
 
 def check_if_building(self, **args):
     """
-    Check if ctags are currently being built.
+    Check if ctags are currently being built for the first time.
+
+    Rebuilt tag files are swapped in atomically, so lookups keep using the
+    previous tag file while a build is running. Only a build without any
+    previous tag file has to be waited for, until the tags of the open files
+    are published.
     """
-    if RebuildTags.build_ctags.func.running:
-        status_message("Tags not available until built")
-        return False
-    return True
+    if not RebuildTags.build_ctags.func.running or RebuildTags.priority_ready:
+        return True
+
+    if find_tags_relative_to(self.view.file_name(), setting("tag_file")):
+        return True
+
+    status_message("Tags not available until built")
+    return False
 
 
 # Goto definition under cursor commands
 
 
+# definitions jumped to, keyed by symbol, receiver and source file
+jump_history = OrderedDict()
+
+JUMP_HISTORY_SIZE = 512
+
+
+def remember_jump(key, generation, tag):
+    """
+    Remember the definition jumped to from a symbol.
+
+    :param key: tuple of the symbol, its receiver, the source file and if
+        the symbol was searched case-insensitively
+    :param generation: generations of the tag files the tag was found in
+    :param tag: the tag jumped to
+
+    :returns: None
+    """
+    jump_history[key] = (generation, tag)
+    jump_history.move_to_end(key)
+    while len(jump_history) > JUMP_HISTORY_SIZE:
+        jump_history.popitem(last=False)
+
+
+def is_same_definition(tag, other):
+    """
+    Check if two tags, e.g. of different builds, are the same definition.
+    """
+    return (tag.root_dir, tag.filename, tag.tag_path) == (
+        other.root_dir,
+        other.filename,
+        other.tag_path,
+    )
+
+
 class JumpToDefinition:
     """
     Provider for NavigateToDefinition and SearchForDefinition commands.
     """
 
     @staticmethod
-    def run(symbol, region, sym_line, mbrParts, view, tags_file):
-        # print('JumpToDefinition')
+    def search_groups(view, tags_file):
+        """
+        Get the groups of tag files to search for definitions, in order.
+
+        :returns: list of lists of tag files searched as one
+        """
+        roots = get_root_tags_paths(view, tags_file)
+        return [roots] + [
+            [path]
+            for path in get_alternate_tags_paths(view, tags_file)
+            if path not in roots
+        ]
+
+    @staticmethod
+    def find_tags(symbol, view, tags_file, ignore_case=False, build=True):
+        """
+        Find the unranked definitions of a symbol.
+
+        The tag files of all folders of the window are searched as one first,
+        followed by the other tag files of ``get_alternate_tags_paths`` in
+        order, until one of them contains the symbol. Each is searched in
+        the partitions of the view's language first, see
+        ``get_language_groups``.
+
+        :param build: build missing databases and sorted copies of the tag
+            files, see ``open_tag_file``
+
+        :returns: list of matching tags
+        """
+        groups = [
+            paths
+            for group in JumpToDefinition.search_groups(view, tags_file)
+            for paths in get_language_groups(view, group)
+        ]
 
         tags = {}
-        for tags_file in get_alternate_tags_paths(view, tags_file):
-            with TagFile(tags_file, SYMBOL) as tagfile:
+        for paths in groups:
+            with open_tag_files(paths, SYMBOL, ignore_case, build) as tagfile:
                 tags = tagfile.get_tags_dict(symbol, filters=compile_filters(view))
             if tags:
                 break
 
-        if not tags:
+        if ignore_case:  # symbols of matching tags differ in case
+            return list(chain(*tags.values()))
+        return tags.get(symbol, [])
+
+    @staticmethod
+    def run(symbol, region, sym_line, mbrParts, view, tags_file, ignore_case=False):
+        """
+        Jump to the definition of a symbol, or show its ranked definitions.
+
+        The definition chosen for the same symbol, receiver and source file
+        before is jumped to directly, as long as the tag files are unchanged.
+        Otherwise it is ranked first, if it is still found.
+        """
+        # print('JumpToDefinition')
+
+        # case-insensitive searches may find definitions of other symbols
+        key = (symbol, "".join(mbrParts).strip(), view.file_name(), ignore_case)
+        generation = tuple(
+            get_generation(path)
+            for group in JumpToDefinition.search_groups(view, tags_file)
+            for path in group
+        )
+
+        previous = None
+        if setting("jump_history") and key in jump_history:
+            jump_history.move_to_end(key)
+            previous_generation, previous = jump_history[key]
+            if previous_generation == generation:
+                scroll_to_tag(view, previous)
+                return
+
+        taglist = JumpToDefinition.find_tags(symbol, view, tags_file, ignore_case)
+
+        if not taglist:
             # append to allow jump back to work
             view.window().run_command("goto_definition")
             return status_message('Can\'t find "%s"' % symbol)
@@ -543,13 +779,18 @@ class JumpToDefinition:
 
         @prepare_for_quickpanel()
         def sorted_tags():
-            taglist = tags.get(symbol, [])
             p_tags = rankmgr.sort_tags(taglist)
             if not p_tags:
                 status_message('Can\'t find "%s"' % symbol)
+            elif previous is not None:
+                p_tags.sort(key=lambda tag: not is_same_definition(tag, previous))
             return p_tags
 
-        return sorted_tags
+        def on_jump(tag):
+            if setting("jump_history"):
+                remember_jump(key, generation, tag)
+
+        show_tag_panel(view, sorted_tags, True, on_jump)
 
 
 class NavigateToDefinition(sublime_plugin.TextCommand):
@@ -590,7 +831,13 @@ class NavigateToDefinition(sublime_plugin.TextCommand):
         source = get_source(view)
         arrMbrParts = Parser.extract_member_exp(line_to_symbol, source)
         return JumpToDefinition.run(
-            symbol, region, sym_line, arrMbrParts, view, tags_file
+            symbol,
+            region,
+            sym_line,
+            arrMbrParts,
+            view,
+            tags_file,
+            args.get("ignore_case", False),
         )
 
 
@@ -607,7 +854,8 @@ class SearchForDefinition(sublime_plugin.WindowCommand):
     def is_visible(self):
         return setting("show_context_menus")
 
-    def run(self):
+    def run(self, ignore_case=False):
+        self.ignore_case = ignore_case
         self.window.show_input_panel(
             "", "", self.on_done, self.on_change, self.on_cancel
         )
@@ -620,8 +868,7 @@ class SearchForDefinition(sublime_plugin.WindowCommand):
             status_message("Can't find any relevant tags file")
             return
 
-        result = JumpToDefinition.run(symbol, None, "", [], view, tags_file)
-        show_tag_panel(view, result, True)
+        JumpToDefinition.run(symbol, None, "", [], view, tags_file, self.ignore_case)
 
     def on_change(self, text):
         pass
@@ -634,6 +881,110 @@ class SearchForDefinition(sublime_plugin.WindowCommand):
 
 tags_cache = defaultdict(dict)
 
+# elements of tags shown by ``ShowSymbols``, ``tag_path`` is created on demand
+SYMBOL_FIELDS = ("symbol", "filename", "ex_command", "field_keys")
+
+
+def load_tags_cache(tag_file):
+    """
+    Load the cached symbols of a tag file from its snapshot.
+
+    :param tag_file: path to the tag file
+
+    :returns: dict of cached symbols, empty if there is no valid snapshot
+    """
+    cache = setting("snapshot_caches") and load_snapshot(tag_file, "symbols")
+    if not cache:
+        return {}
+
+    tag_class = TagFile(tag_file, FILENAME).tag_class()
+    return {
+        key: (filters, restore_tags(tags, tag_class))
+        for key, (filters, tags) in cache.items()
+    }
+
+
+def save_tags_cache(tag_file, cache, generation):
+    """
+    Save a snapshot of the cached symbols of a tag file in the background.
+
+    :param tag_file: path to the tag file
+    :param cache: dict of cached symbols of the tag file
+    :param generation: generation of the tag file the symbols were parsed from
+
+    :returns: None
+    """
+    if not setting("snapshot_caches"):
+        return
+
+    # cached entries are replaced rather than modified, so a copy is stable
+    cache = dict(cache)
+
+    def save():
+        data = {
+            key: (filters, dump_tags(tags)) for key, (filters, tags) in cache.items()
+        }
+        save_snapshot(tag_file, "symbols", data, generation)
+
+    threading.Thread(target=save, daemon=True).start()
+
+
+def update_tags_cache(cache, diff, tag_class):
+    """
+    Apply the changes of a rebuilt tag file to its cached symbols.
+
+    Only the tags of added, removed or changed source files are parsed or
+    dropped, so the cache stays warm across rebuilds.
+
+    :param cache: dict of cached symbols of a tag file, as filled by
+        ``ShowSymbols``
+    :param diff: ``TagsDiff`` of the rebuilt tag file
+    :param tag_class: class to wrap newly parsed tags in
+
+    :returns: None
+    """
+
+    def parse(names, filters):
+        lines = chain(*(diff.new_lines.get(name, []) for name in sorted(names)))
+        return iter_tags(
+            lines, tag_class=tag_class, filters=filters, fields=SYMBOL_FIELDS
+        )
+
+    for key, (filters, tags) in list(cache.items()):
+        symbol_type, name = key
+
+        if symbol_type == "multi":
+            # both lists are in order of tag_path, so merge them
+            kept = (tag for tag in tags if tag.filename not in diff.files)
+            tags = heapq.merge(kept, parse(diff.files, filters), key=iget("tag_path"))
+            cache[key] = (filters, list(tags))
+
+        elif symbol_type == "lang":
+            names = {n for n in diff.files if n.endswith(name)}
+            if not names:
+                continue
+
+            result = {}
+            for symbol, symbol_tags in tags.items():
+                kept = [tag for tag in symbol_tags if tag.filename not in names]
+                if kept:
+                    result[symbol] = kept
+            for tag in parse(names, filters):
+                result.setdefault(tag.symbol, []).append(tag)
+            cache[key] = (filters, result)
+
+        elif name in diff.new_lines:
+            tags = parse_tag_lines(
+                diff.new_lines[name],
+                tag_class=tag_class,
+                filters=filters,
+                fields=SYMBOL_FIELDS,
+            )
+            cache[key] = (filters, tags)
+
+        elif name in diff.removed:
+            del cache[key]
+
 
 class ShowSymbols(sublime_plugin.TextCommand):
     """
@@ -659,47 +1010,99 @@ class ShowSymbols(sublime_plugin.TextCommand):
         if lang:
             # filter and cache by file suffix
             suffix = get_current_file_suffix(view.file_name())
-            key = suffix
+            key = ("lang", suffix)
             files = []
         elif multi:
             # request all symbols of given tags file
-            key = "__all__"
+            key = ("multi", None)
             files = []
         else:
             # request symbols of current view's file
-            key = view.file_name()
-            if not key:
+            name = view.file_name()
+            if not name:
                 return
-            key = get_rel_path_to_source(key, tags_file)
-            key = key.replace("\\", "/")
-            files = [key]
-
-        tags_file = tags_file + "_sorted_by_file"
+            name = get_rel_path_to_source(name, tags_file)
+            name = name.replace("\\", "/")
+            key = ("file", name)
+            files = [name]
+
+        # symbols of all folders are listed from the tag files of all folders
+        roots = [tags_file]
+        if multi or lang:
+            roots = get_root_tags_paths(view, tags_file)
+
+        sorted_files = [tags_file + "_sorted_by_file"] + [
+            path + "_sorted_by_file"
+            for path in roots[1:]
+            if os.path.isfile(path + "_sorted_by_file")
+        ]
         base_path = get_common_ancestor_folder(
             view.file_name(), view.window().folders()
         )
 
+        # restore the symbols of previous sessions. Symbols of several tag
+        # files aren't cached, as rebuilds only update those of one tag file
+        generation = get_generation(tags_file)
+        if base_path not in tags_cache:
+            tags_cache[base_path] = load_tags_cache(tags_file)
+        cacheable = len(sorted_files) == 1
+        cached = cacheable and key in tags_cache[base_path]
+
+        filters = compile_filters(view)
+
         def get_tags():
-            with TagFile(tags_file, FILENAME) as tagfile:
+            with open_tag_files(sorted_files, FILENAME) as tagfile:
                 if lang:
                     return tagfile.get_tags_dict_by_suffix(
-                        suffix, filters=compile_filters(view)
+                        suffix, filters=filters, fields=SYMBOL_FIELDS
                     )
-                elif multi:
-                    return tagfile.get_tags_dict(filters=compile_filters(view))
                 else:
-                    return tagfile.get_tags_dict(*files, filters=compile_filters(view))
+                    return tagfile.get_tags_dict(
+                        *files, filters=filters, fields=SYMBOL_FIELDS
+                    )
+
+        def stream_tags():
+            # the files are stored in display order, so merge them as is
+            with open_tag_files(sorted_files, FILENAME) as tagfile:
+                yield from tagfile.iter_tags(filters=filters, fields=SYMBOL_FIELDS)
+
+        path_cols = (0,) if len(files) > 1 or multi else ()
+        formatting = functools.partial(
+            format_tag_for_quickopen, show_path=bool(path_cols)
+        )
 
-        if key in tags_cache[base_path]:
+        # cached tags are stored along with the filters applied to them, so
+        # they can be updated after rebuilds
+        if cached:
             print("loading symbols from cache")
-            tags = tags_cache[base_path][key]
+            _, tags = tags_cache[base_path][key]
+        elif multi:
+            tags = stream_tags()
         else:
             print("loading symbols from file")
             tags = get_tags()
-            tags_cache[base_path][key] = tags
+
+        if multi:
+
+            @prepare_for_quickpanel(formatting)
+            def sorted_tags():
+                return tags
+
+            # cache the list of parsed tags, which is in display order
+            tags = sorted_tags[0]
+
+        else:
+
+            @prepare_for_quickpanel(formatting)
+            def sorted_tags():
+                return sorted(chain(*(tags[k] for k in tags)), key=iget("tag_path"))
 
         print(("loaded [%d] symbols" % len(tags)))
 
+        if cacheable and not cached:
+            tags_cache[base_path][key] = (filters, tags)
+            save_tags_cache(tags_file, tags_cache[base_path], generation)
+
         if not tags:
             if multi:
                 sublime.status_message(
@@ -710,16 +1113,238 @@ class ShowSymbols(sublime_plugin.TextCommand):
                     "No symbols found **FOR CURRENT FILE**; Try Rebuild?"
                 )
 
-        path_cols = (0,) if len(files) > 1 or multi else ()
-        formatting = functools.partial(
-            format_tag_for_quickopen, show_path=bool(path_cols)
-        )
+        return sorted_tags
+
+
+def describe_kind(kind):
+    """
+    Describe a kind of tags, e.g. ``function`` for ``f``.
+    """
+    if len(kind) == 1 and kind in COMPLETION_KINDS:
+        return COMPLETION_KINDS[kind][1]
+    return kind or "unknown"
+
+
+def read_tags_of_kind(tag_files, kind, filters):
+    """
+    Read the tags of one kind from tag files, using their columnar indexes.
+
+    :param tag_files: paths to tag files
+    :param kind: kind of tags to read
+    :param filters: filters of tags to exclude
+
+    :returns: list of tags, sorted by ``tag_path``
+    """
+    get_column_index = load_module("columns").get_column_index
+
+    result = []
+
+    for tag_file in tag_files:
+        tag_class = TagFile(tag_file, FILENAME).tag_class()
+        tags = None
+
+        # the index is rebuilt once if the tag file changed meanwhile
+        for _ in range(2):
+            index = get_column_index(tag_file)
+            rows, remaining = index.select(kinds=[kind], filters=filters)
+            tags = index.read_tags(rows, tag_class, remaining, SYMBOL_FIELDS)
+            if tags is not None:
+                break
+
+        result.extend(tags or ())
+
+    result.sort(key=iget("tag_path"))
+    return result
+
+
+class ShowSymbolsOfKind(sublime_plugin.TextCommand):
+    """
+    Provider for the ``show_symbols_of_kind`` command.
+
+    Command shows the symbols of one kind, e.g. all classes, of the open
+    folder(s). The kind is picked from the kinds found in the tag files,
+    unless given by the ``kind`` argument.
+    """
+
+    is_enabled = check_if_building
+
+    def is_visible(self):
+        return setting("show_context_menus")
+
+    def run(self, edit, kind=None):
+        tags_file = find_tags_relative_to(self.view.file_name(), setting("tag_file"))
+        if not tags_file:
+            status_message("Can't find any relevant tags file")
+            return
+
+        tag_files = get_root_tags_paths(self.view, tags_file)
+        self.load(tag_files, kind, compile_filters(self.view))
+
+    @threaded(msg="Already loading symbols")
+    def load(self, tag_files, kind, filters):
+        """
+        Count the tags of each kind, or read the tags of ``kind``.
+        """
+        get_column_index = load_module("columns").get_column_index
+
+        try:
+            if kind is None:
+                counts = Counter()
+                for tag_file in tag_files:
+                    counts.update(get_column_index(tag_file).kind_counts())
+                in_main(self.show_kinds)(tag_files, counts, filters)
+            else:
+                tags = read_tags_of_kind(tag_files, kind, filters)
+                in_main(self.show_tags)(kind, tags)
+        except OSError as e:
+            in_main(error_message)("CTags: failed to read tags: %s" % e)
+
+    def show_kinds(self, tag_files, counts, filters):
+        """
+        Show a quick panel of the kinds of tags and their number.
+        """
+        kinds = sorted(counts, key=describe_kind)
+        if not kinds:
+            status_message("No symbols found **FOR CURRENT FOLDERS**; Try Rebuild?")
+            return
+
+        display = [
+            [describe_kind(kind), "%s, %d symbols" % (kind, counts[kind])]
+            for kind in kinds
+        ]
+
+        def on_select(i):
+            if i != -1:
+                self.load(tag_files, kinds[i], filters)
+
+        self.view.window().show_quick_panel(display, on_select)
+
+    def show_tags(self, kind, tags):
+        """
+        Show a quick panel of tags.
+        """
+        if not tags:
+            status_message("No symbols of kind %s found" % describe_kind(kind))
+            return
+
+        formatting = functools.partial(format_tag_for_quickopen, show_path=True)
 
         @prepare_for_quickpanel(formatting)
         def sorted_tags():
-            return sorted(chain(*(tags[k] for k in tags)), key=iget("tag_path"))
+            return tags
 
-        return sorted_tags
+        show_tag_panel(self.view, sorted_tags, False)
+
+
+# Find References commands
+
+
+def format_references(path, references):
+    """
+    Format the references of a source file like the results of Find in Files.
+
+    :param path: path to the source file
+    :param references: list of tuples of line number and line
+
+    :returns: formatted references
+    """
+    lines = ["%s:\n" % path]
+    lines.extend("%6d: %s\n" % reference for reference in references)
+    lines.append("\n")
+    return "".join(lines)
+
+
+def append_to_view(view, text):
+    """
+    Append text to the end of a view.
+    """
+    with Edit(view) as edit:
+        edit.insert(view.size(), text)
+
+
+class FindReferences(sublime_plugin.TextCommand):
+    """
+    Provider for the ``find_references`` command.
+
+    Command searches the source files of the tag files of the open folder(s)
+    for the symbol under the cursor, and lists the references found in a view
+    like the one of Find in Files.
+    """
+
+    is_enabled = check_if_building
+
+    def is_visible(self):
+        return setting("show_context_menus")
+
+    def run(self, edit, symbol=None):
+        tags_file = find_tags_relative_to(self.view.file_name(), setting("tag_file"))
+        if not tags_file:
+            status_message("Can't find any relevant tags file")
+            return
+
+        if not symbol:
+            region = self.view.sel()[0]
+            if region.empty():
+                region = self.view.word(region)
+            symbol = self.view.substr(region).strip()
+        if not symbol:
+            return
+
+        tag_files = get_root_tags_paths(self.view, tags_file)
+        self.search(tag_files, symbol, self.create_results_view(symbol))
+
+    def create_results_view(self, symbol):
+        """
+        Create a view listing references, which can be navigated like the
+        results of Find in Files.
+        """
+        view = self.view.window().new_file()
+        view.set_name('References of "%s"' % symbol)
+        view.set_scratch(True)
+        view.assign_syntax("Packages/Default/Find Results.hidden-tmLanguage")
+        view.settings().set("result_file_regex", r"^([^ \t].*):$")
+        view.settings().set("result_line_regex", r"^ +([0-9]+):")
+
+        append_to_view(view, 'Searching for references of "%s"\n\n' % symbol)
+        return view
+
+    @threaded(msg="Already finding references")
+    def search(self, tag_files, symbol, view):
+        """
+        Search references in the background, streaming them into ``view``.
+
+        :param tag_files: paths to the tag files whose source files to search
+        :param symbol: symbol to search for
+        :param view: view to list the references in
+
+        :returns: None
+        """
+        search_references = load_module("references").search_references
+
+        files = matches = 0
+
+        with ActivityIndicator("CTags: Finding references...") as progress:
+
+            def on_progress(done, total):
+                progress.set_label(
+                    "CTags: Finding references [%d/%d files]..." % (done, total)
+                )
+
+            try:
+                for path, references in search_references(
+                    tag_files, symbol, on_progress=on_progress
+                ):
+                    files += 1
+                    matches += len(references)
+                    in_main(append_to_view)(view, format_references(path, references))
+            except OSError as e:
+                progress.finish("Failed to find references!")
+                in_main(error_message)("CTags: failed to find references: %s" % e)
+                return
+
+            progress.finish("Finished finding references!")
+
+        in_main(append_to_view)(view, "%d matches across %d files\n" % (matches, files))
 
 
 # Rebuild CTags commands
@@ -733,6 +1358,12 @@ class RebuildTags(sublime_plugin.WindowCommand):
     relevant settings from the settings file.
     """
 
+    # set while a build is running and the open files have been indexed
+    priority_ready = False
+
+    # ``BuildJob`` of the running build
+    job = None
+
     def run(self, dirs=None, files=None):
         """Handler for ``rebuild_tags`` command"""
         view = self.window.active_view()
@@ -750,6 +1381,7 @@ class RebuildTags(sublime_plugin.WindowCommand):
                 tag_file=setting("tag_file"),
                 recursive=setting("recursive"),
                 opts=read_opts(view),
+                priority=self.get_priority_files(),
             )
 
         elif (
@@ -805,12 +1437,26 @@ class RebuildTags(sublime_plugin.WindowCommand):
                 tag_file = setting("tag_file")
                 opts = read_opts(view)
 
-                self.build_ctags(paths, command, tag_file, recursive, opts)
+                priority = self.get_priority_files()
+
+                self.build_ctags(paths, command, tag_file, recursive, opts, priority)
 
         view.window().show_quick_panel(display, on_select)
 
+    def get_priority_files(self):
+        """
+        Get the files to index ahead of a full build.
+
+        :returns: list of paths of the files open in the window, or None if
+            priority builds are disabled
+        """
+        if not setting("priority_build"):
+            return None
+
+        return [view.file_name() for view in self.window.views() if view.file_name()]
+
     @threaded(msg="Already running CTags!")
-    def build_ctags(self, paths, command, tag_file, recursive, opts):
+    def build_ctags(self, paths, command, tag_file, recursive, opts, priority=None):
         """
         Build tags for the open file or folder(s).
 
@@ -821,64 +1467,506 @@ class RebuildTags(sublime_plugin.WindowCommand):
             given by path. This overrides filename specified by ``path``
         :param opts: list of additional parameters to pass to the ``ctags``
             executable
+        :param priority: list of files, usually the open ones, whose
+            directories are indexed and published before building the full
+            tag files of recursive builds
 
         :returns: None
         """
-        with ActivityIndicator("CTags: Rebuilding tags...") as progress:
-            for i, path in enumerate(paths, start=1):
-                if len(paths) > 1:
-                    progress.update(
-                        "CTags: Rebuilding tags [%d/%d]..." % (i, len(paths))
+        RebuildTags.priority_ready = False
+        stage = "CTags: Rebuilding tags"
+
+        def on_progress(job):
+            progress.set_label("%s: %s" % (stage, format_progress(job)))
+
+        RebuildTags.job = job = BuildJob(
+            timeout=setting("build_timeout"),
+            low_priority=setting("low_priority"),
+            max_bytes=setting("max_indexed_bytes"),
+            on_progress=on_progress,
+        )
+
+        with ActivityIndicator(stage + "...") as progress:
+            try:
+                if priority and recursive:
+                    stage = "CTags: Indexing open files"
+                    progress.set_label(stage + "...")
+                    self.build_priority_ctags(
+                        paths, command, tag_file, opts, priority, job
                     )
 
-                try:
-                    result = build_ctags(
+                for i, path in enumerate(paths, start=1):
+                    job.check()
+
+                    stage = "CTags: Rebuilding tags"
+                    if len(paths) > 1:
+                        stage += " [%d/%d]" % (i, len(paths))
+                    progress.set_label(stage + "...")
+
+                    result, diff = build_ctags(
                         path=path,
                         tag_file=tag_file,
                         recursive=recursive,
                         opts=opts,
                         cmd=command,
+                        with_diff=True,
+                        incremental=setting("incremental_build"),
+                        hash_content=setting("incremental_build_hash"),
+                        exclude_patterns=setting("exclude_patterns"),
+                        use_gitignore=setting("use_gitignore"),
+                        job=job,
+                        output_format=setting("output_format"),
+                        partition=setting("partition_by_language"),
                     )
-                except IOError as e:
-                    error_message(e.strerror)
-                    return
-                except subprocess.CalledProcessError as e:
-                    if sublime.platform() == "windows":
-                        str_err = " ".join(e.output.decode("windows-1252").splitlines())
-                    else:
-                        str_err = e.output.decode(
-                            locale.getpreferredencoding()
-                        ).rstrip()
-
-                    error_message(str_err)
-                    return
-                except Exception as e:
-                    error_message(
-                        "An unknown error occured.\nCheck the console for info."
-                    )
-                    raise e
 
-                in_main(lambda: tags_cache[os.path.dirname(result)].clear())()
+                    self.update_database(result, diff)
+                    self.update_caches(result, diff)
+
+                    if setting("columnar_index"):
+                        load_module("columns").ColumnIndex.build(result).save()
+
+            except BuildCancelled as e:
+                progress.finish(str(e))
+                return
+            except BuildAborted as e:
+                error_message(str(e))
+                return
+            except IOError as e:
+                error_message(e.strerror)
+                return
+            except subprocess.CalledProcessError as e:
+                if sublime.platform() == "windows":
+                    str_err = " ".join(e.output.decode("windows-1252").splitlines())
+                else:
+                    str_err = e.output.decode(locale.getpreferredencoding()).rstrip()
+
+                error_message(str_err)
+                return
+            except Exception as e:
+                error_message("An unknown error occured.\nCheck the console for info.")
+                raise e
+            finally:
+                RebuildTags.priority_ready = False
+                RebuildTags.job = None
 
             progress.finish("Finished building tags!")
 
-        if tag_file in ctags_completions:
-            del ctags_completions[tag_file]  # clear the cached ctags list
+        print(format_build_stats(job))
+        with hover_lock:
+            hover_cache.clear()
+
+    def build_priority_ctags(self, paths, command, tag_file, opts, priority, job):
+        """
+        Index and publish the directories of the given files first.
+
+        Navigation is enabled again as soon as any tags were published.
+
+        :param paths: paths to build ctags for
+        :param command: ctags command
+        :param tag_file: filename to use for the tag file
+        :param opts: list of additional parameters to pass to the ``ctags``
+            executable
+        :param priority: list of files whose directories to index
+        :param job: ``BuildJob`` of the build
+
+        :returns: None
+        """
+        for path in paths:
+            if not os.path.isdir(path):
+                continue
+
+            result = build_priority_ctags(
+                path,
+                priority,
+                cmd=command,
+                tag_file=tag_file,
+                opts=opts,
+                exclude_patterns=setting("exclude_patterns"),
+                use_gitignore=setting("use_gitignore"),
+                job=job,
+                output_format=setting("output_format"),
+                partition=setting("partition_by_language"),
+            )
+
+            if result:
+                self.update_database(*result)
+                self.update_caches(*result)
+                RebuildTags.priority_ready = True
+
+    @staticmethod
+    def update_database(tag_file, diff):
+        """
+        Apply the changes of a rebuilt tag file to its database, if the
+        ``tag_backend`` setting is ``"sqlite"``.
+
+        This runs in the build thread, so the database needn't be rebuilt
+        when it is next opened.
+
+        :param tag_file: path to the rebuilt tag file
+        :param diff: ``TagsDiff`` of the rebuilt tag file
+
+        :returns: None
+        """
+        if setting("tag_backend") != "sqlite":
+            return
+
+        database = load_module("tagdb").TagDatabase(tag_file, SYMBOL)
+        try:
+            database.update(diff)
+        finally:
+            if database.connection:
+                database.close()
+
+    @staticmethod
+    def update_caches(tag_file, diff):
+        """
+        Apply the changes of a rebuilt tag file to cached symbols.
+
+        This runs in the build thread. Cached symbols are updated in a copy,
+        which is swapped in on the main thread. Cached completions are
+        updated in a copy as well, which is swapped in while holding
+        ``completions_lock``.
+
+        :param tag_file: path to the rebuilt tag file
+        :param diff: ``TagsDiff`` of the rebuilt tag file
+
+        :returns: None
+        """
+        if not diff:
+            return
+
+        generation = get_generation(tag_file)
+        base_path = os.path.dirname(tag_file)
+        cache = tags_cache.get(base_path)
+
+        if cache:
+            # cached entries are replaced rather than modified, so a copy can
+            # be updated while ``ShowSymbols`` uses the original
+            updated = dict(cache)
+            update_tags_cache(updated, diff, TagFile(tag_file, FILENAME).tag_class())
+
+            def swap():
+                if tags_cache.get(base_path) is cache:
+                    tags_cache[base_path] = updated
+                    save_tags_cache(tag_file, updated, generation)
+
+            in_main(swap)()
+
+        with completions_lock:
+            completions = ctags_completions.get(tag_file)
+
+        if completions is not None:
+            changes = diff_completions(diff)
+
+            # cached completions are replaced rather than modified, so they
+            # can be saved without holding ``completions_lock``
+            updated = defaultdict(Counter, completions)
+            for symbol in {symbol for symbol, _ in chain(*changes)}:
+                if symbol in completions:
+                    updated[symbol] = completions[symbol].copy()
+            update_completions(updated, changes)
+
+            with completions_lock:
+                if ctags_completions.get(tag_file) is completions:
+                    ctags_completions[tag_file] = updated
+            save_completions(tag_file, generation)
+
+
+def format_size(size):
+    """
+    Format a number of bytes for humans.
+    """
+    if size < 1024:
+        return "%d B" % size
+
+    for unit in ("KB", "MB", "GB"):
+        size /= 1024
+        if size < 1024:
+            break
+
+    return "%.1f %s" % (size, unit)
+
+
+def format_progress(job):
+    """
+    Format the progress of a running ``BuildJob`` for the status bar.
+    """
+    text = "%d/%d files, %.0f files/s, %s" % (
+        job.files_done,
+        job.files_total,
+        job.files_per_second,
+        format_size(job.bytes_done),
+    )
+
+    eta = job.eta
+    if eta is not None:
+        text += ", ETA %d:%02d" % divmod(int(eta), 60)
+
+    return text
+
+
+def format_build_stats(job):
+    """
+    Format the statistics of a finished ``BuildJob`` for the console.
+    """
+    return (
+        "CTags: build took %.2fs, indexed %d files (%s), emitted %d tags,"
+        " peak tag file size %s"
+        % (
+            job.elapsed,
+            job.files_done,
+            format_size(job.bytes_done),
+            job.tag_count,
+            format_size(job.peak_output),
+        )
+    )
+
+
+class CancelBuildTags(sublime_plugin.WindowCommand):
+    """
+    Provider for the ``cancel_build_tags`` command.
+
+    Command cancels a running ``rebuild_tags`` command, keeping the previous
+    tag files.
+    """
+
+    def run(self):
+        """Handler for ``cancel_build_tags`` command"""
+        if RebuildTags.job:
+            RebuildTags.job.cancel()
+
+    def is_enabled(self):
+        return RebuildTags.job is not None
 
 
 # Autocomplete commands
 
 
+# symbols of tag files, keyed by tag file
 ctags_completions = {}
 
+# guards ``ctags_completions`` against concurrent queries and updates
+completions_lock = threading.Lock()
+
+# elements of tags offered as completions
+COMPLETION_FIELDS = ("signature",)
+
+# kind and description of completions, keyed by the first letter of the kind
+COMPLETION_KINDS = {
+    "c": ("KIND_ID_TYPE", "class"),
+    "d": ("KIND_ID_KEYWORD", "macro"),
+    "e": ("KIND_ID_VARIABLE", "enumerator"),
+    "f": ("KIND_ID_FUNCTION", "function"),
+    "g": ("KIND_ID_TYPE", "enum"),
+    "i": ("KIND_ID_TYPE", "interface"),
+    "m": ("KIND_ID_FUNCTION", "member"),
+    "n": ("KIND_ID_NAMESPACE", "namespace"),
+    "p": ("KIND_ID_NAMESPACE", "package"),
+    "s": ("KIND_ID_TYPE", "struct"),
+    "t": ("KIND_ID_TYPE", "typedef"),
+    "u": ("KIND_ID_TYPE", "union"),
+    "v": ("KIND_ID_VARIABLE", "variable"),
+}
+
+
+def iter_completions(lines):
+    """
+    Parse the completions of tag lines.
+
+    :param lines: iterable of tag lines
+
+    :returns: generator of tuples of symbol and a tuple of filename, kind and
+        signature
+    """
+    for tag in iter_tags(lines, fields=COMPLETION_FIELDS):
+        yield tag["symbol"], (tag["filename"], tag["type"], tag.get("signature", ""))
+
+
+def load_completions(tag_file):
+    """
+    Load the completions of a tag file.
+
+    :param tag_file: path to the tag file
+
+    :returns: dict of ``Counter`` of the filename, kind and signature of the
+        definitions of each symbol
+    """
+    completions = defaultdict(Counter)
+
+    with open(tag_file, "r", encoding="utf-8", errors="replace") as fobj:
+        for symbol, definition in iter_completions(fobj):
+            completions[symbol][definition] += 1
+
+    return completions
+
+
+def load_cached_completions(tag_file):
+    """
+    Load the completions of a tag file from its snapshot or the tag file.
+
+    A new snapshot is saved if there was no valid one.
+
+    :param tag_file: path to the tag file
+
+    :returns: completions of the tag file, see ``load_completions``
+    """
+    if not setting("snapshot_caches"):
+        return load_completions(tag_file)
+
+    completions = load_snapshot(tag_file, "completions")
+    if completions is None:
+        generation = get_generation(tag_file)
+        completions = load_completions(tag_file)
+        save_snapshot(tag_file, "completions", completions, generation)
+
+    return completions
+
+
+def save_completions(tag_file, generation):
+    """
+    Save a snapshot of the cached completions of a tag file in the background.
+
+    :param tag_file: path to the tag file
+    :param generation: generation of the tag file the completions match
+
+    :returns: None
+    """
+    if not setting("snapshot_caches"):
+        return
+
+    def save():
+        # cached completions are replaced rather than modified, see
+        # ``RebuildTags.update_caches``, so they are pickled without the lock
+        with completions_lock:
+            data = ctags_completions.get(tag_file)
+        if data is not None:
+            save_snapshot(tag_file, "completions", data, generation)
+
+    threading.Thread(target=save, daemon=True).start()
+
+
+def diff_completions(diff):
+    """
+    Parse the completions of the changes of a rebuilt tag file.
+
+    :param diff: ``TagsDiff`` of the rebuilt tag file
+
+    :returns: tuple of lists of the removed and the added completions, see
+        ``iter_completions``
+    """
+    return (
+        list(iter_completions(chain(*diff.old_lines.values()))),
+        list(iter_completions(chain(*diff.new_lines.values()))),
+    )
+
+
+def update_completions(completions, changes):
+    """
+    Apply the changes of a rebuilt tag file to its cached completions.
+
+    :param completions: completions of a tag file, see ``load_completions``
+    :param changes: removed and added completions, see ``diff_completions``
+
+    :returns: None
+    """
+    removed, added = changes
+
+    for symbol, definition in removed:
+        definitions = completions.get(symbol)
+        if not definitions:
+            continue
+
+        definitions[definition] -= 1
+        if definitions[definition] <= 0:
+            del definitions[definition]
+        if not definitions:
+            del completions[symbol]
+
+    for symbol, definition in added:
+        completions[symbol][definition] += 1
+
+
+def rank_completions(indexes, prefix, limit=None):
+    """
+    Find and rank the completions of a prefix in one or more tag files.
+
+    Symbols defined in the given file come first, followed by symbols defined
+    in its directory and then all others, each in alphabetical order. Of
+    several definitions of a symbol, also in several tag files, the closest
+    one is returned.
+
+    :param indexes: list of tuples of the completions of a tag file, see
+        ``load_completions``, and the path of the file being edited relative
+        to the tag file, or None if it's not in the folder of the tag file
+    :param prefix: case insensitive prefix of the symbols to return
+    :param limit: maximum number of completions to return, or None for all
+
+    :returns: list of tuples of symbol, filename, kind and signature
+    """
+    prefix = prefix.lower()
+    candidates = {}
+
+    for completions, filename in indexes:
+        filename = os.path.normpath(filename) if filename else None
+        directory = os.path.dirname(filename) if filename else None
+
+        def proximity(definition):
+            path = os.path.normpath(definition[0])
+            if path == filename:
+                return 0
+            if os.path.dirname(path) == directory:
+                return 1
+            return 2
+
+        for symbol, definitions in completions.items():
+            if symbol.lower().startswith(prefix):
+                rank, definition = min((proximity(d), d) for d in definitions)
+                key = (rank, symbol.lower(), symbol)
+                if symbol not in candidates or key < candidates[symbol][0]:
+                    candidates[symbol] = (key, definition)
+
+    key = iget(0)
+    if limit:
+        candidates = heapq.nsmallest(limit, candidates.values(), key=key)
+    else:
+        candidates = sorted(candidates.values(), key=key)
+
+    return [(symbol,) + definition for (_, _, symbol), definition in candidates]
+
+
+def format_completion(symbol, filename, kind, signature):
+    """
+    Create a ``sublime.CompletionItem`` of a ranked completion.
+    """
+    kind_id, description = COMPLETION_KINDS.get(kind[:1], ("KIND_ID_AMBIGUOUS", ""))
+    if len(kind) > 1:
+        description = kind
+
+    return sublime.CompletionItem(
+        symbol,
+        annotation=signature,
+        completion=symbol,
+        kind=(getattr(sublime, kind_id), kind[:1], description),
+        details=html.escape(filename),
+    )
+
 
 class CTagsAutoComplete(sublime_plugin.EventListener):
+    """
+    Complete symbols of the tag file of a view.
+
+    Completions are ranked by the proximity of their definitions to the view
+    and capped by the ``autocomplete_max_results`` setting. On Sublime Text 4
+    they are computed in a background thread and shown with their kind and
+    signature.
+    """
+
+    query_id = 0
+
     def on_query_completions(self, view, prefix, locations):
         if not setting("autocomplete"):
             return None
 
-        prefix = prefix.lower()
-
         tags_path = find_tags_relative_to(view.file_name(), setting("tag_file"))
 
         if not tags_path:
@@ -890,94 +1978,415 @@ class CTagsAutoComplete(sublime_plugin.EventListener):
         if os.path.getsize(tags_path) > 100 * 1024 * 1024:
             return None
 
-        if tags_path not in ctags_completions:
-            tags = set()
+        # complete symbols of the tag files of all folders, ranked by their
+        # proximity to the file being edited in its own tag file
+        filename = os.path.relpath(view.file_name(), os.path.dirname(tags_path))
+        sources = [
+            (path, filename if path == tags_path else None)
+            for path in get_root_tags_paths(view, tags_path)
+            if os.path.getsize(path) <= 100 * 1024 * 1024
+        ]
 
-            with open(tags_path, "r", encoding="utf-8") as fobj:
-                for line in fobj:
-                    line = line.strip()
-                    if not line or line.startswith("!_TAG"):
-                        continue
-                    cols = line.split("\t", 1)
-                    tags.add(cols[0])
+        if not hasattr(sublime, "CompletionList"):  # Sublime Text 3
+            completions = self.query(sources, prefix)
+            return [
+                ["%s\t%s" % (symbol, kind), symbol]
+                for symbol, _, kind, _ in completions
+            ]
 
-            ctags_completions[tags_path] = tags
+        CTagsAutoComplete.query_id += 1
+        completion_list = sublime.CompletionList()
 
-        return [
-            tag
-            for tag in ctags_completions[tags_path]
-            if tag.lower().startswith(prefix)
-        ]
+        threading.Thread(
+            target=self.complete,
+            args=(completion_list, sources, prefix, self.query_id),
+            daemon=True,
+        ).start()
 
+        return completion_list
 
-# Test CTags commands
+    def complete(self, completion_list, sources, prefix, query_id):
+        completions = self.query(sources, prefix, query_id)
 
+        flags = 0
+        if len(completions) >= setting("autocomplete_max_results", 0) > 0:
+            # the list is incomplete, so query again when typing on
+            flags = getattr(sublime, "DYNAMIC_COMPLETIONS", 0)
 
-class TestCtags(sublime_plugin.TextCommand):
-    routine = None
+        completion_list.set_completions(
+            [format_completion(*completion) for completion in completions], flags
+        )
+
+    @staticmethod
+    def query(sources, prefix, query_id=None):
+        """
+        Rank the completions of a number of tag files.
+
+        :param sources: list of tuples of a tag file and the name of the
+            file being edited relative to it, or None
+        :param prefix: prefix of the symbols to complete
+        :param query_id: id of the query, if it may be superseded
+
+        :returns: list of ranked completions, see ``rank_completions``. No
+            completions are ranked for superseded queries.
+        """
+        with completions_lock:
+            # skip queries which were superseded while waiting for the lock
+            if query_id is not None and query_id != CTagsAutoComplete.query_id:
+                return []
+
+            indexes = []
+            for tags_path, filename in sources:
+                if tags_path not in ctags_completions:
+                    ctags_completions[tags_path] = load_cached_completions(tags_path)
+                indexes.append((ctags_completions[tags_path], filename))
+
+            return rank_completions(
+                indexes, prefix, setting("autocomplete_max_results", 0)
+            )
+
+
+# Definition preview
+
+
+# recently resolved symbols, keyed by tags file, its generation and the symbol
+hover_cache = OrderedDict()
+
+# guards ``hover_cache`` against concurrent lookups and rebuilds
+hover_lock = threading.Lock()
+
+HOVER_CACHE_SIZE = 256
+
+HOVER_POPUP_MAX_TAGS = 5
+
+
+def get_hover_tags(key, find_tags):
+    """
+    Get the definitions of a hovered symbol, from the cache if possible.
+
+    :param key: tuple of the tags file, the generations of the tag files and
+        the symbol
+    :param find_tags: function finding the definitions on a cache miss. It
+        runs without holding ``hover_lock``, so other lookups aren't blocked.
+
+    :returns: list of tags
+    """
+    with hover_lock:
+        taglist = hover_cache.get(key)
+        if taglist is not None:
+            hover_cache.move_to_end(key)
+            return taglist
+
+    taglist = find_tags()
+
+    with hover_lock:
+        hover_cache[key] = taglist
+        while len(hover_cache) > HOVER_CACHE_SIZE:
+            hover_cache.popitem(last=False)
+
+    return taglist
+
+
+class CTagsHoverPreview(sublime_plugin.EventListener):
+    """
+    Show a popup with the ranked definitions of the symbol under the mouse.
+
+    Lookups are debounced and run one at a time by a single worker thread.
+    Hovers while a lookup is running replace each other, so only the latest
+    one is looked up next. If a lookup misses the ``definition_popup_timeout``
+    latency budget or the mouse moved on in the meantime, it is skipped or
+    its result dropped instead of showing a stale popup.
+
+    Lookups only use the sorted copies and databases of tag files which are
+    up to date, and never build them, see ``open_tag_file``.
+    """
+
+    hover_id = 0
+
+    # the latest lookup waiting for the worker thread, see ``submit``
+    request = None
+    request_ready = threading.Condition()
+    worker = None
+
+    def on_hover(self, view, point, hover_zone):
+        if not setting("show_definition_popup"):
+            return
+        if hover_zone != sublime.HOVER_TEXT:
+            return
+
+        tags_file = find_tags_relative_to(view.file_name(), setting("tag_file"))
+        if not tags_file:
+            return
+
+        CTagsHoverPreview.hover_id += 1
+        hover_id = CTagsHoverPreview.hover_id
+
+        def lookup():
+            if hover_id == CTagsHoverPreview.hover_id:
+                timeout = setting("definition_popup_timeout", 200) / 1000.0
+                self.submit(
+                    functools.partial(
+                        self.lookup,
+                        view,
+                        point,
+                        tags_file,
+                        hover_id,
+                        time.time() + timeout,
+                    )
+                )
+
+        sublime.set_timeout(lookup, setting("definition_popup_delay", 250))
+
+    @classmethod
+    def submit(cls, lookup):
+        """
+        Run a lookup in the worker thread, starting it if required.
+
+        A lookup still waiting for the worker is replaced.
+
+        :param lookup: function to call without arguments
+
+        :returns: None
+        """
+        with cls.request_ready:
+            cls.request = lookup
+            if cls.worker is None:
+                cls.worker = threading.Thread(target=cls.work, daemon=True)
+                cls.worker.start()
+            cls.request_ready.notify()
+
+    @classmethod
+    def work(cls):
+        """
+        Run the lookups passed to ``submit``, one at a time.
+        """
+        while True:
+            with cls.request_ready:
+                while cls.request is None:
+                    cls.request_ready.wait()
+                lookup, cls.request = cls.request, None
+
+            try:
+                lookup()
+            except Exception:
+                traceback.print_exc()
+
+    def lookup(self, view, point, tags_file, hover_id, deadline):
+        # the worker may have been busy with a previous lookup
+        if not self.is_current(hover_id, deadline):
+            return
+
+        region = view.word(point)
+        symbol = view.substr(region)
+        if not symbol.strip() or not view.match_selector(point, "source"):
+            return
 
-    def run(self, edit, **args):
-        if self.routine is None:
-            self.routine = self.co_routine(self.view)
-            next(self.routine)
+        sym_line = view.substr(view.line(region))
+        (row, col) = view.rowcol(region.begin())
+        source = view.scope_name(point).split(" ", 1)[0]
+        mbrParts = Parser.extract_member_exp(sym_line[:col], source)
+
+        # the definitions depend on the tag files of all folders
+        roots = get_root_tags_paths(view, tags_file)
+        generation = tuple(get_generation(path) for path in roots)
+        if None in generation:
+            return
+
+        key = (tags_file, generation, symbol)
+
+        taglist = get_hover_tags(
+            key,
+            lambda: JumpToDefinition.find_tags(symbol, view, tags_file, build=False),
+        )
+        if not taglist:
+            return
+
+        rankmgr = RankMgr(region, mbrParts, view, symbol, sym_line)
+        taglist = rankmgr.sort_tags(taglist)[:HOVER_POPUP_MAX_TAGS]
+
+        # drop results which are late or belong to an outdated hover event
+        if not self.is_current(hover_id, deadline):
+            return
+
+        if taglist:
+            sublime.set_timeout(
+                functools.partial(self.show_popup, view, point, taglist, hover_id), 0
+            )
+
+    @staticmethod
+    def is_current(hover_id, deadline):
+        """
+        Check if the result of a lookup is still to be shown.
+
+        :param hover_id: id of the hover event the lookup was started by
+        :param deadline: time the result must be available by
+
+        :returns: True if the deadline wasn't missed and the mouse didn't
+            move on
+        """
+        return time.time() <= deadline and hover_id == CTagsHoverPreview.hover_id
+
+    def show_popup(self, view, point, taglist, hover_id):
+        if hover_id != CTagsHoverPreview.hover_id:
+            return
+
+        def on_navigate(href):
+            view.hide_popup()
+            scroll_to_tag(view, taglist[int(href)])
+
+        view.show_popup(
+            format_tags_for_popup(taglist),
+            sublime.HIDE_ON_MOUSE_MOVE_AWAY,
+            point,
+            max_width=800,
+            on_navigate=on_navigate,
+        )
+
+
+def format_tags_for_popup(taglist):
+    """
+    Format a list of tags for a definition preview popup.
+
+    :param taglist: list of ranked tags
+
+    :returns: minihtml string
+    """
+    rows = []
+
+    for i, tag in enumerate(taglist):
+        signature = tag.get("signature", "")
+        rows.append(
+            '<div><a href="%d">%s</a> <i>%s</i> %s</div>'
+            "<div><code>%s</code></div>"
+            % (
+                i,
+                html.escape(tag.symbol + signature),
+                html.escape(tag.type),
+                html.escape(tag.filename),
+                html.escape(tag.ex_command.strip()),
+            )
+        )
+
+    return "<body>%s</body>" % "".join(rows)
 
-    def __next__(self):
+
+# Warm-up
+
+
+def plugin_loaded():
+    """
+    Set up snapshots and warm up the tag files of all open folders in the
+    background.
+    """
+    snapshot.snapshot_dir = os.path.join(sublime.cache_path(), "CTags", "snapshots")
+
+    if not setting("warm_up"):
+        return
+
+    tag_files = set()
+    for window in sublime.windows():
+        for folder in window.folders():
+            tag_file = os.path.join(folder, setting("tag_file"))
+            if os.path.isfile(tag_file):
+                tag_files.add(tag_file)
+
+    threading.Thread(target=warm_up, args=(sorted(tag_files),), daemon=True).start()
+
+
+def warm_up(tag_files):
+    """
+    Load the indexes of tag files.
+
+    The tag files used for lookups and listing symbols are prefaulted (which
+    imports ``tagdb`` for the SQLite backend) and the completions loaded, if
+    enabled. So neither startup nor the first command pays for it.
+
+    :param tag_files: paths to tag files
+
+    :returns: None
+    """
+    for tag_file in tag_files:
         try:
-            next(self.routine)
-        except Exception as e:
-            print(e)
-            self.routine = None
+            with open_tag_file(tag_file, SYMBOL) as tagfile:
+                tagfile.prefault()
+
+            sorted_file = tag_file + "_sorted_by_file"
+            if os.path.isfile(sorted_file):
+                with TagFile(sorted_file, FILENAME) as tagfile:
+                    tagfile.prefault()
+
+            if setting("autocomplete"):
+                with completions_lock:
+                    loaded = tag_file in ctags_completions
+                # reading and saving snapshots doesn't block queries
+                if not loaded:
+                    completions = load_cached_completions(tag_file)
+                    with completions_lock:
+                        ctags_completions.setdefault(tag_file, completions)
+        except (OSError, ValueError) as e:
+            print("CTags: failed to warm up %s: %s" % (tag_file, e))
+
 
-    def co_routine(self, view):
-        tag_file = find_tags_relative_to(view.file_name(), setting("tag_file"))
+# Test CTags commands
 
-        with open(tag_file, encoding="utf-8") as tf:
-            tags = parse_tag_lines(tf, tag_class=TagElements)
 
-        print("Starting Test")
+class TestCtags(sublime_plugin.TextCommand):
+    """
+    Provider for the ``test_ctags`` command.
 
-        ex_failures = []
-        line_failures = []
+    Command verifies that all tags of the current tag file point to their
+    symbols, without opening any of the source files in the editor.
+    """
 
-        for symbol, tag_list in list(tags.items()):
-            for tag in tag_list:
-                tag.root_dir = os.path.dirname(tag_file)
+    def run(self, edit, output=None):
+        tag_file = find_tags_relative_to(self.view.file_name(), setting("tag_file"))
 
-                def hook(av):
-                    test_context = av.sel()[0]
+        if not tag_file:
+            status_message("Can't find any relevant tags file")
+            return
 
-                    if tag.ex_command.isdigit():
-                        test_string = tag.symbol
-                    else:
-                        test_string = tag.ex_command
-                        test_context = av.line(test_context)
+        self.verify(tag_file, output)
 
-                    if not av.substr(test_context).startswith(test_string):
-                        failure = "FAILURE %s" % pprint.pformat(tag)
-                        failure += av.file_name()
+    @threaded(msg="Already testing CTags!")
+    def verify(self, tag_file, output):
+        """
+        Verify tags in the background and report the results.
 
-                        if setting("debug"):
-                            if not sublime.ok_cancel_dialog("%s\n\n\n" % failure):
-                                self.routine = None
+        :param tag_file: path to the tag file to verify
+        :param output: path of a file to write results to, instead of
+            showing them in a new view
 
-                            return sublime.set_clipboard(failure)
-                        ex_failures.append(tag)
-                    sublime.set_timeout(self.__next__, 5)
+        :returns: None
+        """
+        verify = load_module("verify")
 
-                scroll_to_tag(view, tag, hook)
-                yield
+        with ActivityIndicator("CTags: Testing tags...") as progress:
 
-        failures = line_failures + ex_failures
-        tags_tested = sum(len(v) for v in list(tags.values())) - len(failures)
+            def on_progress(done, total):
+                progress.set_label(
+                    "CTags: Testing tags [%d/%d files]..." % (done, total)
+                )
+
+            tags_tested, failures = verify.verify_tags(
+                tag_file, on_progress=on_progress
+            )
+
+            progress.finish("Finished testing tags!")
 
-        view = sublime.active_window().new_file()
+        report = verify.format_report(tags_tested, failures)
+
+        if output:
+            with open(output, "w", encoding="utf-8") as file_:
+                file_.write(report)
+            in_main(status_message)("CTags test results written to %s" % output)
+        else:
+            in_main(self.show_report)(report)
+
+    def show_report(self, report):
+        view = self.view.window().new_file()
 
         with Edit(view) as edit:
-            edit.insert(view.size(), "%s Tags Tested OK\n" % tags_tested)
-            edit.insert(view.size(), "%s Tags Failed" % len(failures))
+            edit.insert(0, report)
 
         view.set_scratch(True)
         view.set_name("CTags Test Results")
-
-        if failures:
-            sublime.set_clipboard(pprint.pformat(failures))
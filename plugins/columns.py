@@ -0,0 +1,326 @@
+"""
+Columnar indexes of tag files, to filter tags without parsing them.
+"""
+
+import os
+import re
+
+from array import array
+from collections import Counter
+
+from .ctags import get_generation, iter_tags
+from .snapshot import load_snapshot, save_snapshot
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#
+# Contants
+#
+
+# columns of a ``ColumnIndex`` and their typecodes
+COLUMNS = (
+    ("symbol", "I"),
+    ("file", "I"),
+    ("kind", "H"),
+    ("access", "H"),
+    ("line", "I"),
+    ("offset", "Q"),
+)
+
+# columns holding ids of the strings of a string table
+TABLES = ("symbol", "file", "kind", "access")
+
+# columns of the tag elements used by the ``filters`` settings
+FILTER_COLUMNS = {
+    "symbol": "symbol",
+    "filename": "file",
+    "type": "kind",
+    "kind": "kind",
+    "access": "access",
+}
+
+#
+# Functions
+#
+
+
+def get_column_index(tag_file):
+    """
+    Get the columnar index of a tag file, (re)building it if outdated.
+
+    :param tag_file: the location of the tagfile
+
+    :returns: ``ColumnIndex`` of the tag file
+    """
+    index = ColumnIndex.load(tag_file)
+    if index is None:
+        index = ColumnIndex.build(tag_file)
+        index.save()
+    return index
+
+
+#
+# Models
+#
+
+
+class ColumnIndex(object):
+    """
+    Model the columns of a tag file.
+
+    Each tag is a row of the ids of its symbol, file, kind and access in
+    string tables, its line number (0 if unknown) and the offset of its line
+    in the tag file. Each column is a compact ``array``. Filtering tags by
+    these columns is a scan of the arrays, vectorized by NumPy if it can be
+    imported, and only the lines of matching tags are read and parsed.
+
+    Indexes are stored as ``columns`` snapshots, see ``snapshot.py``.
+    """
+
+    def __init__(self, tag_file, generation=None):
+        """
+        Initialise an empty index.
+
+        :param tag_file: the location of the tagfile
+        :param generation: generation of the tag file the index is built of
+
+        :returns: None
+        """
+        self.tag_file = tag_file
+        self.generation = generation
+        self.tables = {name: [] for name in TABLES}
+        self.columns = {name: array(typecode) for name, typecode in COLUMNS}
+
+    def __len__(self):
+        """
+        Get number of tags in index.
+        """
+        return len(self.columns["offset"])
+
+    @classmethod
+    def build(cls, tag_file):
+        """
+        Build the index of a tag file.
+
+        :param tag_file: the location of the tagfile
+
+        :returns: ``ColumnIndex``
+        """
+        ids = {name: {} for name in TABLES}
+
+        with open(tag_file, "rb") as file_:
+            index = cls(tag_file, get_generation(tag_file, os.fstat(file_.fileno())))
+            columns = {name: column.append for name, column in index.columns.items()}
+            offset = 0
+
+            for line in file_:
+                if not line.startswith(b"!_"):
+                    row = index.parse_line(line.decode("utf-8", "replace"), ids)
+                    if row:
+                        for name, value in row.items():
+                            columns[name](value)
+                        columns["offset"](offset)
+                offset += len(line)
+
+        return index
+
+    def parse_line(self, line, ids):
+        """
+        Get the values of the columns of a tag line, except its offset.
+
+        :param line: tag line from a tagfile
+        :param ids: dict of the ids of strings, by table, which is updated
+
+        :returns: dict of column values, or None if ``line`` is not a tag
+        """
+        parts = line.split("\t", 2)
+        if len(parts) < 3:
+            return None
+
+        symbol, filename, rest = parts
+        end = rest.rfind(';"\t')
+        if end == -1:
+            return None
+
+        ex_command = rest[:end]
+        fields = rest[end + 3 :].rstrip("\r\n").split("\t")
+
+        kind, access, line_number = "", "", 0
+        for i, field in enumerate(fields):
+            key, sep, value = field.partition(":")
+            if not sep and i == 0:
+                kind = field
+            elif key == "kind":
+                kind = value
+            elif key == "access":
+                access = value
+            elif key == "line" and value.isdigit():
+                line_number = int(value)
+
+        if not line_number and ex_command.isdigit():
+            line_number = int(ex_command)
+
+        row = {"line": line_number}
+        for name, value in (
+            ("symbol", symbol),
+            ("file", filename),
+            ("kind", kind),
+            ("access", access),
+        ):
+            table_ids = ids[name]
+            id_ = table_ids.get(value)
+            if id_ is None:
+                id_ = table_ids[value] = len(self.tables[name])
+                self.tables[name].append(value)
+            row[name] = id_
+
+        return row
+
+    @classmethod
+    def load(cls, tag_file):
+        """
+        Load the index of a tag file.
+
+        :param tag_file: the location of the tagfile
+
+        :returns: ``ColumnIndex``, or None if there is no index of the current
+            generation of the tag file
+        """
+        data = load_snapshot(tag_file, "columns")
+        if data is None:
+            return None
+
+        index = cls(tag_file, get_generation(tag_file))
+        index.tables, index.columns = data
+        return index
+
+    def save(self):
+        """
+        Save the index as snapshot of its tag file.
+
+        :returns: True if the index was saved, else False
+        """
+        return save_snapshot(
+            self.tag_file, "columns", (self.tables, self.columns), self.generation
+        )
+
+    def values(self, name):
+        """
+        Get a column as NumPy array, if NumPy is available.
+        """
+        column = self.columns[name]
+        if numpy is None:
+            return column
+        return numpy.frombuffer(column, dtype=column.typecode)
+
+    def kind_counts(self):
+        """
+        Count the tags of each kind.
+
+        :returns: ``Counter`` of kinds
+        """
+        if numpy is not None and len(self):
+            counts = numpy.bincount(self.values("kind")).tolist()
+        else:
+            counts = Counter(self.columns["kind"])
+            counts = [counts[id_] for id_ in range(len(self.tables["kind"]))]
+
+        return Counter(
+            {kind: count for kind, count in zip(self.tables["kind"], counts) if count}
+        )
+
+    def ids(self, name, values=None, pattern=None):
+        """
+        Get the ids of strings of a table.
+
+        :param name: name of the table
+        :param values: strings to get the ids of
+        :param pattern: regex the strings must match the start of, like the
+            ``filters`` settings
+
+        :returns: set of ids
+        """
+        table = self.tables[name]
+        if values is not None:
+            values = set(values)
+            return {id_ for id_, value in enumerate(table) if value in values}
+        return {id_ for id_, value in enumerate(table) if re.match(pattern, value)}
+
+    def select(self, kinds=None, files=None, filters=None, symbols=None):
+        """
+        Select the rows of tags by kind, file, symbol and filters.
+
+        :param kinds: kinds of tags to select, or None for all
+        :param files: file names of tags to select, or None for all
+        :param filters: filters of tags to exclude, see ``iter_tags``
+        :param symbols: symbols of tags to select, or None for all
+
+        :returns: tuple of the list of selected rows and the filters on
+            elements which aren't columns, which still have to be applied
+            when parsing the tags
+        """
+        masks = []
+        if kinds is not None:
+            masks.append(("kind", self.ids("kind", kinds), True))
+        if files is not None:
+            masks.append(("file", self.ids("file", files), True))
+        if symbols is not None:
+            masks.append(("symbol", self.ids("symbol", symbols), True))
+
+        remaining = []
+        for filt in filters or ():
+            rest = {}
+            for key, pattern in filt.items():
+                if key in FILTER_COLUMNS:
+                    name = FILTER_COLUMNS[key]
+                    masks.append((name, self.ids(name, pattern=pattern), False))
+                else:
+                    rest[key] = pattern
+            if rest:
+                remaining.append(rest)
+
+        if not len(self):
+            return [], remaining
+
+        if numpy is not None:
+            mask = numpy.ones(len(self), dtype=bool)
+            for name, ids, include in masks:
+                matched = numpy.isin(self.values(name), list(ids))
+                mask &= matched if include else ~matched
+            return numpy.flatnonzero(mask).tolist(), remaining
+
+        rows = range(len(self))
+        for name, ids, include in masks:
+            column = self.columns[name]
+            rows = [row for row in rows if (column[row] in ids) == include]
+        return list(rows), remaining
+
+    def read_tags(self, rows, tag_class=None, filters=None, fields=None):
+        """
+        Read and parse the tags of some rows.
+
+        :param rows: list of rows
+        :param tag_class: a Class to wrap around the resulting dictionary
+        :param filters: filters to apply to resulting dictionary
+        :param fields: names of the elements to parse, or None to parse all
+
+        :returns: list of tags, or None if the tag file changed since the
+            index was built
+        """
+        offsets = self.columns["offset"]
+        lines = []
+
+        with open(self.tag_file, "rb") as file_:
+            if get_generation(self.tag_file, os.fstat(file_.fileno())) != (
+                self.generation
+            ):
+                return None
+
+            for row in rows:
+                file_.seek(offsets[row])
+                lines.append(file_.readline().decode("utf-8", "replace"))
+
+        return list(iter_tags(lines, tag_class, filters, fields))
@@ -2,13 +2,22 @@
 A ctags wrapper, parser and sorter.
 """
 
-import bisect
+import hashlib
+import heapq
+import json
 import mmap
 import os
 import re
+import shlex
+import shutil
+import signal
 import subprocess
+import tempfile
+import threading
+import time
 
-from subprocess import check_output
+from subprocess import CalledProcessError, Popen, TimeoutExpired
+from sys import intern
 
 #
 # Contants
@@ -28,45 +37,160 @@ FILENAME = 1
 
 MATCHES_STARTWITH = "starts_with"
 
+# sort orders of a tag file, as given by the ``!_TAG_FILE_SORTED`` header
+UNSORTED = 0
+SORTED = 1
+FOLDCASE = 2
+
+SORTED_HEADER = "!_TAG_FILE_SORTED\t%d\t/0=unsorted, 1=sorted, 2=foldcase/\n"
+
 PATH_ORDER = [
     "function",
     "class",
     "struct",
 ]
 
-PATH_IGNORE_FIELDS = ("file", "access", "signature", "language", "line", "inherits")
+PATH_IGNORE_FIELDS = (
+    "file",
+    "access",
+    "signature",
+    "language",
+    "line",
+    "inherits",
+    "end",
+    "roles",
+    "typeref",
+    "extras",
+)
 
 TAG_PATH_SPLITTERS = ("/", ".", "::", ":")
 
-#
-# Functions
-#
+# splits a tag path on any of ``TAG_PATH_SPLITTERS``, the empty parts it
+# yields are dropped by ``create_tag_path``
+TAG_PATH_RE = re.compile("|".join(map(re.escape, TAG_PATH_SPLITTERS)))
 
-# Helper functions
+# elements of a tag which ``project_tag`` gets without parsing extension fields
+BASE_FIELDS = frozenset(("symbol", "filename", "ex_command", "type"))
 
+# directories never indexed
+VCS_DIRS = (".git", ".hg", ".svn", ".bzr", "CVS")
 
-def splits(string, *splitters):
-    """
-    Split a string on a number of splitters.
+# suffixes of a tag file's name which name the files created along with it:
+# partitions, sorted copies, databases, manifests and their temporary files
+TAG_FILE_SUFFIX_RE = re.compile(
+    r"(?:_lang_[\w+#-]+?)?"
+    r"(?:_sorted_by_file|_sorted_by_symbol|_sorted_foldcase|_db|_manifest"
+    r"|_languages|_search_paths)?"
+    r"(?:\.\w+\.tmp|\.tmp|\.pending|\.partial|\.json|-journal|-wal|-shm)*\Z"
+)
 
-    :param string: string to split
-    :param splitters: characters to split string on
+# version of the manifest format, part of the options hash
+MANIFEST_VERSION = 1
 
-    :returns: ``string`` split on characters in ``string``"""
-    if splitters:
-        split = string.split(splitters[0])
-        for val in split:
-            for char in splits(val, *splitters[1:]):
-                yield char
-    else:
-        if string:
-            yield string
+# options making Universal Ctags write JSON with all fields used by the plugin
+JSON_OPTIONS = ["--output-format=json", "--fields=+kneS-K"]
+
+# keys of JSON tag records which are not written as fields
+JSON_TAG_KEYS = ("_type", "name", "path", "pattern", "kind", "scopeKind")
+
+# minimum interval between progress reports of a build, in seconds
+PROGRESS_INTERVAL = 0.2
+
+GENERATION_HEADER = (
+    "!_TAG_SOURCE_GENERATION\t%s\t/generation of the tag file this was sorted from/\n"
+)
+
+# languages of source files by extension, as named by Universal Ctags. Used
+# to partition tag files of tags without ``language`` field
+LANGUAGE_EXTENSIONS = {
+    ".c": "C",
+    ".c++": "C++",
+    ".cc": "C++",
+    ".cpp": "C++",
+    ".cs": "C#",
+    ".cxx": "C++",
+    ".erl": "Erlang",
+    ".ex": "Elixir",
+    ".exs": "Elixir",
+    ".go": "Go",
+    ".h": "C++",
+    ".hh": "C++",
+    ".hpp": "C++",
+    ".hxx": "C++",
+    ".java": "Java",
+    ".js": "JavaScript",
+    ".jsx": "JavaScript",
+    ".kt": "Kotlin",
+    ".lua": "Lua",
+    ".m": "ObjectiveC",
+    ".mjs": "JavaScript",
+    ".php": "PHP",
+    ".pl": "Perl",
+    ".pm": "Perl",
+    ".py": "Python",
+    ".pyi": "Python",
+    ".pyw": "Python",
+    ".rb": "Ruby",
+    ".rs": "Rust",
+    ".scala": "Scala",
+    ".sh": "Sh",
+    ".swift": "Swift",
+    ".ts": "TypeScript",
+    ".tsx": "TypeScript",
+}
+
+LANGUAGES_HEADER = (
+    "!_TAG_SOURCE_GENERATION\t%s\t/generation of the tag file this was split from/\n"
+)
+
+# files of a partition, by suffix of the partition's path, which are removed
+# along with the partition of a language which is gone
+PARTITION_SUFFIXES = (
+    "",
+    "_sorted_by_symbol",
+    "_sorted_foldcase",
+    "_db",
+    "_db-journal",
+    "_db-wal",
+    "_db-shm",
+)
+
+# fields whose values are rarely shared by tags, so not interned
+UNSHARED_FIELDS = ("signature",)
+
+# JSON support of ctags executables, see ``supports_json``
+json_support = {}
+
+# tuples of field keys shared by tags, see ``share_field_keys``
+field_keys_tuples = {}
+
+# maximum number of shared tuples of field keys, the cache is cleared when
+# exceeded
+FIELD_KEYS_CACHE_SIZE = 1024
+
+# new files waiting to replace files opened by readers on Windows, by the
+# path of the file they replace, see ``replace_file``
+pending_replacements = {}
+pending_lock = threading.Lock()
+
+# seconds between attempts to swap in pending replacements
+PENDING_RETRY_INTERVAL = 0.5
+
+# threads writing sorted copies of tag files, by location of the copy, see
+# ``start_sort_ctags``
+sort_threads = {}
+sort_threads_lock = threading.Lock()
 
+#
+# Functions
+#
 
 # Tag processing functions
 
 
-def parse_tag_lines(lines, order_by="symbol", tag_class=None, filters=None):
+def parse_tag_lines(
+    lines, order_by="symbol", tag_class=None, filters=None, fields=None
+):
     """
     Parse and sort a list of tags.
 
@@ -79,12 +203,48 @@ def parse_tag_lines(lines, order_by="symbol", tag_class=None, filters=None):
     :param order_by: element by which the result should be sorted
     :param tag_class: a Class to wrap around the resulting dictionary
     :param filters: filters to apply to resulting dictionary
+    :param fields: names of the elements to parse, see ``iter_tags``
 
     :returns: tag object or dictionary containing a sorted, filtered version
         of the original input tag lines
     """
     tags_lookup = {}
 
+    if fields is not None and order_by not in fields:
+        fields = tuple(fields) + (order_by,)
+
+    for tag in iter_tags(lines, tag_class=tag_class, filters=filters, fields=fields):
+        tags_lookup.setdefault(tag[order_by], []).append(tag)
+
+    return tags_lookup
+
+
+def iter_tags(lines, tag_class=None, filters=None, fields=None):
+    """
+    Parse a list of tags lazily.
+
+    Parse tags one by one, in the order of the given ``lines``. Unlike
+    ``parse_tag_lines`` no lookup dictionary is built, so the first tags are
+    available before the whole input has been read.
+
+    If ``fields`` are given, lines are split instead of matched against
+    ``TAGS_RE`` and only the requested elements are processed, see
+    ``project_tag``. Elements used by ``filters`` are always included.
+
+    :param lines: iterable of tag lines from a tagfile
+    :param tag_class: a Class to wrap around the resulting dictionary
+    :param filters: filters to apply to resulting dictionary
+    :param fields: names of the elements to parse, or None to parse all.
+        ``tag_path`` may be left out if ``tag_class`` is a ``TagElements``
+        class, which creates it on demand.
+
+    :returns: generator of tag objects or dictionaries
+    """
+    if fields is not None:
+        fields = set(fields)
+        for filt in filters or ():
+            fields.update(filt)
+
     for line in lines:
         skip = False
 
@@ -93,14 +253,19 @@ def parse_tag_lines(lines, order_by="symbol", tag_class=None, filters=None):
 
         line = line.rstrip("\r\n")
 
-        search_obj = TAGS_RE.search(line)
+        if fields is not None:
+            tag = project_tag(line, fields)
+            if tag is None:
+                continue
+        else:
+            search_obj = TAGS_RE.search(line)
 
-        if not search_obj:
-            continue
+            if not search_obj:
+                continue
 
-        tag = search_obj.groupdict()  # convert regex search result to dict
+            tag = search_obj.groupdict()  # convert regex search result to dict
 
-        tag = post_process_tag(tag)
+            tag = post_process_tag(tag)
 
         if tag_class is not None:  # if 'casting' to a class
             tag = tag_class(tag)
@@ -115,9 +280,53 @@ def parse_tag_lines(lines, order_by="symbol", tag_class=None, filters=None):
         if skip:  # if a filter was matched, ignore line (filter out)
             continue
 
-        tags_lookup.setdefault(tag[order_by], []).append(tag)
+        yield tag
 
-    return tags_lookup
+
+def project_tag(line, fields):
+    """
+    Parse the requested elements of a tag line only.
+
+    The line is split on tabs rather than matched against ``TAGS_RE``. Like
+    the regex, the ex command extends up to the last ``;"<tab>``, so patterns
+    containing tabs are handled. ``symbol``, ``filename`` and ``type`` are
+    always included, as they come for free. Extension fields are only parsed
+    if ``fields``, ``field_keys``, ``tag_path`` or any other name is
+    requested, and the ex command is only unescaped if requested.
+
+    :param line: tag line from a tagfile, without line ending
+    :param fields: set of names of the elements to parse
+
+    :returns: dict containing the requested elements, or None if ``line`` is
+        not a valid tag
+    """
+    symbol, _, rest = line.partition("\t")
+    filename, _, rest = rest.partition("\t")
+
+    end = rest.rfind(';"\t')
+    if end <= 0 or not symbol or not filename:
+        return None
+
+    type_, _, extension = rest[end + 3 :].partition("\t")
+    if not type_:
+        return None
+
+    tag = {
+        "symbol": intern(symbol),
+        "filename": intern(filename),
+        "type": intern(type_),
+    }
+
+    if "ex_command" in fields:
+        tag["ex_command"] = process_ex_cmd({"ex_command": rest[:end]})
+
+    if not fields.issubset(BASE_FIELDS):
+        tag["fields"] = extension
+        tag.update(process_fields(tag))
+        if "tag_path" in fields:
+            tag.update(create_tag_path(tag))
+
+    return tag
 
 
 def post_process_tag(tag):
@@ -137,7 +346,7 @@ def post_process_tag(tag):
         ex_command  > ex_command    line number or regex used to find symbol
         type        > type          type of symbol (i.e. class, method)
         fields      > fields        string of fields
-        .           > [field_keys]  list of parsed field keys
+        .           > [field_keys]  tuple of parsed field keys
         .           > [field_one]   parsed field element one
         .           > [...]         additional parsed field element
         =========== = ============= =========================================
@@ -153,7 +362,7 @@ def post_process_tag(tag):
         ex_command  > ex_command    '\tprivate int getSum(int a, int b) {'
         type        > type          'm'
         fields      > fields        'class:DemoClass\tfile:'
-        .           > field_keys    ['class', 'file']
+        .           > field_keys    ('class', 'file')
         .           > class         'DemoClass'
         .           > file          ''
         =========== = ============= =========================================
@@ -162,6 +371,9 @@ def post_process_tag(tag):
 
     :returns: dict containing the processed tag
     """
+    for key in ("symbol", "filename", "type"):
+        tag[key] = intern(tag[key])
+
     tag.update(process_fields(tag))
 
     tag["ex_command"] = process_ex_cmd(tag)
@@ -186,6 +398,8 @@ def process_ex_cmd(tag):
 
     if ex_cmd.isdigit():  # if a line number, do nothing
         return ex_cmd
+    elif "\\" not in ex_cmd:  # a regex without escapes
+        return ex_cmd[2:-2]
     else:  # else a regex, so unescape
         return re.sub(r"\\(\$|/|\^|\\)", r"\1", ex_cmd[2:-2])  # unescape regex
 
@@ -208,15 +422,66 @@ def process_fields(tag):
     if not fields:  # do nothing
         return {}
 
-    # split the fields string into a dictionary of key-value pairs
-    result = dict(f.split(":", 1) for f in fields.split("\t"))
+    # split the fields string into a dictionary of key-value pairs. Keys and
+    # most values repeat across tags, so they are interned
+    result = {}
+    for field in fields.split("\t"):
+        key, value = field.split(":", 1)
+        key = intern(key)
+        result[key] = value if key in UNSHARED_FIELDS else intern(value)
 
     # append all keys to the dictionary
-    result["field_keys"] = sorted(result.keys())
+    result["field_keys"] = share_field_keys(result)
 
     return result
 
 
+def share_field_keys(keys):
+    """
+    Get the sorted tuple of field keys shared by all tags with these keys.
+
+    :param keys: iterable of field keys
+
+    :returns: tuple of field keys
+    """
+    keys = tuple(sorted(keys))
+    shared = field_keys_tuples.get(keys)
+    if shared is None:
+        # tag files with many distinct field combinations mustn't grow the
+        # cache without bound
+        if len(field_keys_tuples) >= FIELD_KEYS_CACHE_SIZE:
+            field_keys_tuples.clear()
+        shared = field_keys_tuples.setdefault(keys, keys)
+    return shared
+
+
+def intern_tag(tag):
+    """
+    Share the repeated elements of a tag with other tags.
+
+    Tags parsed by ``iter_tags`` are interned already. This is for tags
+    created otherwise, e.g. restored from snapshots.
+
+    :param tag: dict containing a tag, which is updated
+
+    :returns: ``tag``
+    """
+    for key in ("symbol", "filename", "type"):
+        if key in tag:
+            tag[key] = intern(tag[key])
+
+    if "field_keys" in tag:
+        for key in tag["field_keys"]:
+            if key not in UNSHARED_FIELDS and key in tag:
+                tag[key] = intern(tag[key])
+        tag["field_keys"] = share_field_keys(tag["field_keys"])
+
+    if "tag_path" in tag:
+        tag["tag_path"] = tuple(intern(part) for part in tag["tag_path"])
+
+    return tag
+
+
 def create_tag_path(tag):
     """
     Create a tag path entry for a tag dictionary.
@@ -233,29 +498,22 @@ def create_tag_path(tag):
 
     :returns: dict containing the 'tag_path' entry
     """
-    field_keys = tag.get("field_keys", [])[:]
-    fields = []
-    tag_path = ""
-
-    # sort field arguments related to path order in correct order
-    for field in PATH_ORDER:
-        if field in field_keys:
-            fields.append(field)
-            field_keys.pop(field_keys.index(field))
+    field_keys = tag.get("field_keys", [])
 
+    # sort field arguments related to path order in correct order, then
     # append all remaining field arguments
-    fields.extend(field_keys)
+    fields = [field for field in PATH_ORDER if field in field_keys]
+    fields.extend(field for field in field_keys if field not in PATH_ORDER)
 
     # convert list of fields to dot-joined string, dropping any "ignore" fields
-    for field in fields:
-        if field not in PATH_IGNORE_FIELDS:
-            tag_path += tag.get(field) + "."
-
-    # append symbol as last item in string
-    tag_path += tag.get("symbol")
+    # and appending symbol as last item in string
+    parts = [tag.get(field) for field in fields if field not in PATH_IGNORE_FIELDS]
+    parts.append(tag.get("symbol"))
+    tag_path = ".".join(parts)
 
     # split string on seperators and append tag filename to resulting list
-    splitup = [tag.get("filename")] + list(splits(tag_path, *TAG_PATH_SPLITTERS))
+    splitup = [tag.get("filename")]
+    splitup.extend(intern(part) for part in TAG_PATH_RE.split(tag_path) if part)
 
     # convert list to tuple
     result = {"tag_path": tuple(splitup)}
@@ -266,7 +524,21 @@ def create_tag_path(tag):
 # Tag building/sorting functions
 
 
-def build_ctags(path, cmd=None, tag_file=None, recursive=False, opts=None):
+def build_ctags(
+    path,
+    cmd=None,
+    tag_file=None,
+    recursive=False,
+    opts=None,
+    with_diff=False,
+    incremental=False,
+    hash_content=False,
+    exclude_patterns=None,
+    use_gitignore=False,
+    job=None,
+    output_format="classic",
+    partition=False,
+):
     """
     Execute the ``ctags`` command using ``Popen``.
 
@@ -276,8 +548,124 @@ def build_ctags(path, cmd=None, tag_file=None, recursive=False, opts=None):
         given by path. This overrides filename specified by ``path``
     :param tag_file: filename to use for the tag file. Defaults to ``tags``
     :param opts: list of additional options to pass to the ctags executable
+    :param with_diff: also return the changes to the previous tag file
+    :param incremental: only re-index source files which changed since the
+        last build, as recorded in the tag file's manifest. Only applies to
+        recursive builds of directories.
+    :param hash_content: record content hashes in the manifest, so files
+        which were touched without changing are not re-indexed
+    :param exclude_patterns: list of ``.gitignore``-style patterns of source
+        files not to index when building tags for a directory
+    :param use_gitignore: also skip source files ignored by ``.gitignore``
+        files when building tags for a directory
+    :param job: ``BuildJob`` to cancel the build or limit its resources
+    :param output_format: ``classic`` to read the tag file format of ctags,
+        ``json`` to read the JSON output of Universal Ctags, or ``auto`` to
+        read JSON if supported by ``cmd``
+    :param partition: also split the tag file by language, see
+        ``partition_ctags``
+
+    :returns: original ``tag_file`` filename, or a tuple of it and a
+        ``TagsDiff`` if ``with_diff`` is set
+    """
+    cmd, cwd, tag_path = prepare_ctags(path, cmd, tag_file, opts)
+    json_output = use_json_output(cmd, output_format)
+
+    # the new tag file is written next to the live one and swapped in when
+    # complete, so lookups never see a partially written tag file
+    temp_file = tag_path + ".tmp"
+
+    # a cancelled or failed build must not leave the new tag file behind
+    try:
+        if os.path.isfile(path) and not recursive:
+            name = os.path.basename(path)
+            if job:
+                job.add_sources([(name, os.stat(path))])
+            groups = write_tags(cmd, cwd, temp_file, [name], job, json_output)
+            return finish_ctags(tag_path, with_diff, temp_file, job, partition, groups)
+
+        # enumerate source files here rather than letting ctags walk the tree or
+        # expanding a glob, so ignore rules apply and no argument limit is hit
+        sources = list(
+            list_source_files(
+                cwd,
+                tag_path,
+                recursive=recursive,
+                exclude_patterns=exclude_patterns,
+                use_gitignore=use_gitignore,
+            )
+        )
+
+        manifest = None
+        if incremental and recursive:
+            options_hash = get_options_hash(
+                cmd, recursive, exclude_patterns, use_gitignore, json_output
+            )
+            manifest = Manifest(tag_path, options_hash)
+            # changes are merged into the tag file, so it must be current
+            if (
+                manifest.load()
+                and os.path.exists(tag_path)
+                and not is_replacement_pending(tag_path)
+            ):
+                changed, deleted = manifest.update(cwd, sources, hash_content)
+                if changed or deleted:
+                    if job:
+                        job.add_sources(sources, changed)
+                    groups = update_ctags(
+                        cmd,
+                        cwd,
+                        tag_path,
+                        changed,
+                        deleted,
+                        temp_file,
+                        job,
+                        json_output,
+                    )
+                    result = finish_ctags(
+                        tag_path, with_diff, temp_file, job, partition, groups
+                    )
+                    if not is_replacement_pending(tag_path):
+                        manifest.save()
+                    return result
+
+                # nothing changed, so there is nothing to do
+                if with_diff:
+                    return tag_path, TagsDiff({}, {})
+                return tag_path
+
+            manifest.update(cwd, sources, hash_content)
+
+        if job:
+            job.add_sources(sources)
+
+        groups = write_tags(
+            cmd, cwd, temp_file, [name for name, _ in sources], job, json_output
+        )
+        result = finish_ctags(tag_path, with_diff, temp_file, job, partition, groups)
+
+        # saved only once the tag file is published, as an outdated manifest
+        # just causes files to be indexed again
+        if manifest and not is_replacement_pending(tag_path):
+            manifest.save()
+
+        return result
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def prepare_ctags(path, cmd=None, tag_file=None, opts=None):
+    """
+    Prepare the ``ctags`` command for building a tag file.
+
+    :param path: path to file or directory to generate ctags for
+    :param cmd: ctags executable. Defaults to ``ctags``
+    :param tag_file: filename to use for the tag file. Defaults to ``tags``
+    :param opts: list of additional options to pass to the ctags executable
 
-    :returns: original ``tag_file`` filename
+    :returns: tuple of the command as a list without the tag file option,
+        working directory and path to the tag file
     """
     # build the CTags command
     if cmd:
@@ -295,229 +683,1895 @@ def build_ctags(path, cmd=None, tag_file=None, recursive=False, opts=None):
     else:
         cwd = path
 
-    if tag_file:
-        cmd.append("-f {0}".format(tag_file))
-
     if opts:
         if type(opts) == list:
             cmd.extend(opts)
         else:  # *should* be a list, but better safe than sorry
             cmd.append(opts)
 
-    if recursive:  # ignore any file specified in path if recursive set
-        cmd.append("-R")
-    elif os.path.isfile(path):
-        filename = os.path.basename(path)
-        cmd.append(filename)
-    else:  # search all files in current directory
-        cmd.append(os.path.join(path, "*"))
-
-    # workaround for the issue described here:
-    #   http://bugs.python.org/issue6689
-    if os.name == "posix":
-        cmd = " ".join(cmd)
-
-    # execute the command
-    check_output(
-        cmd, cwd=cwd, shell=True, stdin=subprocess.PIPE, stderr=subprocess.STDOUT
-    )
-
     if not tag_file:  # Exuberant ctags defaults to ``tags`` filename.
-        tag_file = os.path.join(cwd, "tags")
+        tag_path = os.path.join(cwd, "tags")
+    elif os.path.dirname(tag_file) != cwd:
+        tag_path = os.path.join(cwd, tag_file)
     else:
-        if os.path.dirname(tag_file) != cwd:
-            tag_file = os.path.join(cwd, tag_file)
-
-    # re-sort ctag file in filename order to improve search performance
-    resort_ctags(tag_file)
+        tag_path = tag_file
+
+    return cmd, cwd, tag_path
+
+
+def build_priority_ctags(
+    path,
+    files,
+    cmd=None,
+    tag_file=None,
+    opts=None,
+    exclude_patterns=None,
+    use_gitignore=False,
+    job=None,
+    output_format="classic",
+    partition=False,
+):
+    """
+    Index the source files next to some given files ahead of a full build.
 
-    return tag_file
+    All source files in the directories of ``files`` are indexed. If there is
+    no tag file yet, the result is published as a partial tag file, so tags
+    of these files can be looked up while the full tag file is being built.
+    Otherwise their tags are refreshed in the existing tag file.
 
+    :param path: path to the directory the tag file is built for
+    :param files: absolute paths of files to index first, usually the files
+        open in a window. Files outside ``path`` are ignored.
+    :param cmd: ctags executable. Defaults to ``ctags``
+    :param tag_file: filename to use for the tag file. Defaults to ``tags``
+    :param opts: list of additional options to pass to the ctags executable
+    :param exclude_patterns: list of ``.gitignore``-style patterns of source
+        files not to index
+    :param use_gitignore: also skip source files ignored by ``.gitignore``
+        files
+    :param job: ``BuildJob`` to cancel the build or limit its resources
+    :param output_format: format of the ctags output to read, see
+        ``build_ctags``
+    :param partition: also split the tag file by language, see
+        ``partition_ctags``
+
+    :returns: tuple of the tag file and a ``TagsDiff``, or None if no source
+        files were indexed
+    """
+    cmd, cwd, tag_path = prepare_ctags(path, cmd, tag_file, opts)
+    json_output = use_json_output(cmd, output_format)
 
-def resort_ctags(tag_file):
+    dirs = set()
+    for name in files:
+        try:
+            rel_path = os.path.relpath(name, cwd)
+        except ValueError:  # on another drive on Windows
+            continue
+        if not rel_path.startswith(os.pardir):
+            dirs.add(os.path.dirname(rel_path).replace(os.sep, "/"))
+
+    if not dirs:
+        return None
+
+    sources = [
+        (name, stat)
+        for name, stat in list_source_files(
+            cwd,
+            tag_path,
+            exclude_patterns=exclude_patterns,
+            use_gitignore=use_gitignore,
+        )
+        if name.rpartition("/")[0] in dirs
+    ]
+
+    if not sources:
+        return None
+
+    if job:
+        job.add_sources(sources)
+
+    names = [name for name, _ in sources]
+    temp_file = tag_path + ".tmp"
+
+    try:
+        if os.path.exists(tag_path):
+            groups = update_ctags(
+                cmd, cwd, tag_path, set(names), set(), temp_file, job, json_output
+            )
+        else:
+            groups = write_tags(cmd, cwd, temp_file, names, job, json_output)
+            # the partial tag file must not pass for a complete one in an
+            # incremental build
+            manifest_file = tag_path + "_manifest"
+            if os.path.exists(manifest_file):
+                os.remove(manifest_file)
+
+        return finish_ctags(tag_path, True, temp_file, job, partition, groups)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def write_tags(cmd, cwd, output_file, files, job=None, json_output=False):
     """
-    Rearrange ctags file for speed.
+    Run ``ctags`` to write a tag file.
+
+    :param cmd: list containing the ctags command and its options
+    :param cwd: working directory of the command
+    :param output_file: the location of the tagfile to write
+    :param files: list of source files to index, relative to ``cwd``
+    :param job: ``BuildJob`` to cancel the command or limit its resources
+    :param json_output: let ctags write JSON, which is converted to a tag
+        file while ctags runs, rather than a tag file
+
+    :returns: tag lines grouped by source file, see ``convert_json_tags``, if
+        ``json_output`` is set, else None
+    """
+    if not json_output:
+        run_ctags(cmd[:1] + ["-f", quote(output_file)] + cmd[1:], cwd, files, job)
+        return None
 
-    Resorts (re-sort) a CTag file in order of file. This improves searching
-    performance when searching tags by file as a binary search can be used.
+    json_cmd = cmd[:1] + JSON_OPTIONS + ["-f", "-"] + cmd[1:]
+    result = []
 
-    The algorithm works as so:
+    def on_output(stream):
+        result.append(convert_json_tags(stream, output_file))
 
-        For each line in the tag file
-            Read the file name (``file_name``) the tag belongs to
-            If not exists, create an empty array and store in the
-                dictionary with the file name as key
-            Save the line to this list
-        Create a new ``tagfile`` file
-        For each key in the sorted dictionary
-            For each line in the list indicated by the key
-                Split the line on tab character
-                Remove the prepending ``.`` from the ``file_name`` part of
-                    the                   tag
-                Join the line again and write the ``sorted_by_file`` file
+    run_ctags(json_cmd, cwd, files, job, on_output)
+    return result[0]
 
-    :param tag_file: The location of the tagfile to be sorted
 
-    :returns: None
+def use_json_output(cmd, output_format):
     """
-    groups = {}
+    Check if the JSON output of ctags should be read.
 
-    with open(tag_file, encoding="utf-8", errors="replace") as file_:
-        for line in file_:
-            # meta data not needed in sorted files
-            if line.startswith("!_TAG"):
-                continue
+    :param cmd: list containing the ctags command and its options
+    :param output_format: ``classic``, ``json`` or ``auto``
 
-            # read all valid symbol tags, which contain at least
-            # symbol name and containing file and build a list of tuples
-            split = line.split("\t", FILENAME + 1)
-            if len(split) > FILENAME:
-                groups.setdefault(split[FILENAME], []).append(line)
+    :returns: True if ctags should write JSON
+    """
+    if output_format == "json":
+        return True
+    if output_format == "auto":
+        return supports_json(cmd[0])
+    return False
 
-    with open(
-        tag_file + "_sorted_by_file", "w", encoding="utf-8", errors="replace"
-    ) as file_:
-        for group in sorted(groups):
-            file_.writelines(groups[group])
 
+def supports_json(executable):
+    """
+    Check if a ctags executable supports JSON output.
 
-#
-# Models
-#
+    Only Universal Ctags built with libjansson does. The result is cached per
+    executable.
 
+    :param executable: ctags executable
 
-class TagElements(dict):
-    """
-    Model the entries of a tag file.
+    :returns: True if JSON output is supported
     """
+    if executable not in json_support:
+        cmd = [executable, "--list-features"]
+        if os.name == "posix":
+            cmd = " ".join(cmd)
 
-    def __init__(self, *args, **kw):
-        """Initialise Tag object"""
-        dict.__init__(self, *args, **kw)
-        self.__dict__ = self
+        try:
+            output = subprocess.run(
+                cmd,
+                shell=True,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=10,
+            ).stdout
+        except (OSError, subprocess.SubprocessError):
+            output = b""
+
+        json_support[executable] = any(
+            line.split()[:1] == [b"json"] for line in output.splitlines()
+        )
 
+    return json_support[executable]
 
-class Tag(object):
-    """
-    Model a tag.
 
-    This exists mainly to enable different types of sorting.
+def json_tag(record):
     """
+    Convert a JSON tag record of Universal Ctags to a tag line.
 
-    def __init__(self, line, column=0):
-        if isinstance(line, bytes):  # python 3 compatibility
-            line = line.decode("utf-8", "replace")
-        self.line = line
-        self.column = column
+    Tabs and backslashes in field values are escaped as ctags does in tag
+    files. The scope is written as ``<scope kind>:<scope>`` field.
 
-    def __lt__(self, other):
-        try:
-            return self.key < other
-        except IndexError:
-            return False
+    :param record: dict decoded from a line of JSON output
 
-    def __gt__(self, other):
-        try:
-            return self.key > other
-        except IndexError:
-            return False
+    :returns: tuple of the tag line and its ``tag_path``, equal to the result
+        of ``tag_path_key`` for the line
+    """
+    ex_command = record.get("pattern") or str(record.get("line", ""))
+    tag = {"symbol": record["name"], "filename": record["path"]}
+    fields = []
 
-    def __getitem__(self, index):
-        return self.line.split("\t", self.column + 1)[index]
+    for key, value in record.items():
+        if key in JSON_TAG_KEYS or value is False:
+            continue
+        if key == "scope":
+            key = record.get("scopeKind", "scope")
+        if value is True:
+            value = ""
+        value = str(value).replace("\\", "\\\\").replace("\t", "\\t")
+        fields.append("\t%s:%s" % (key, value))
+        tag[intern(key)] = value
+
+    line = '%s\t%s\t%s;"\t%s%s\n' % (
+        record["name"],
+        record["path"],
+        ex_command,
+        record.get("kind", ""),
+        "".join(fields),
+    )
 
-    def __len__(self):
-        return self.line.count("\t") + 1
+    if not ex_command or not record.get("kind"):  # not matched by ``TAGS_RE``
+        return line, (line,)
 
-    @property
-    def key(self):
-        return self[self.column]
+    if fields:
+        tag["field_keys"] = share_field_keys(
+            key for key in tag if key not in ("symbol", "filename")
+        )
+    return line, create_tag_path(tag)["tag_path"]
 
 
-class TagFile(object):
+def convert_json_tags(stream, tag_file):
     """
-    Model a tag file.
+    Convert the JSON output of Universal Ctags to a sorted tag file.
 
-    This doesn't actually hold a entire tag file, due in part to the sheer
-    size of some tag files (> 100 MB files are possible). Instead, it acts
-    as a 'wrapper' of sorts around a file, providing functionality like
-    searching for a retrieving tags, finding tags based on given criteria
-    (prefix, suffix, exact), getting the directory of a tag and so forth.
+    Records are decoded one by one as they are read, and tags are grouped by
+    source file and sorted by their ``tag_path`` as taken from the records,
+    so no tag line has to be parsed again, see ``resort_ctags``.
+
+    :param stream: binary stream or iterable of lines of JSON output
+    :param tag_file: the location of the tagfile to write
+
+    :returns: dict of source file names and their tag lines, in order of
+        ``tag_path``
     """
+    headers = []
+    tags = []
 
-    def __init__(self, path, column):
-        """
-        Initialise object.
+    for line in stream:
+        if not line.startswith(b"{"):  # warnings, if any
+            continue
 
-        The file indicated by ``path`` must be sorted by values in the column
-        indicated by ``column``.
+        record = json.loads(line.decode("utf-8", "replace"))
 
-        :param path: path to a tag file
-        :param column: column to search on
+        if record.get("_type") == "tag":
+            tags.append((record["name"], record["path"]) + json_tag(record))
+        elif record.get("_type") == "ptag":
+            name = record["name"]
+            if name == "TAG_FILE_SORTED":
+                continue
+            if record.get("parserName"):
+                name += "!" + record["parserName"]
+            headers.append(
+                "!_%s\t%s\t/%s/\n"
+                % (name, record.get("path", ""), record.get("pattern", ""))
+            )
 
-        :returns: None
-        """
-        self.path = path
-        self.column = column
-        self.file = None
-        self.mmap = None
+    tags.sort(key=lambda tag: tag[0])
 
-    def __getitem__(self, index):
-        """
-        Provide sequence-type interface to tag file.
-        """
-        if not self.mmap:
-            raise RuntimeError("No tag file open.")
+    groups = {}
+    for _, filename, line, tag_path in tags:
+        groups.setdefault(filename, []).append((tag_path, line))
 
-        self.mmap.seek(index)
-        result = self.mmap.readline()
+    with open(tag_file, "w", encoding="utf-8") as file_:
+        file_.write(SORTED_HEADER % SORTED)
+        file_.writelines(headers)
+        file_.writelines(tag[2] for tag in tags)
 
-        if index != 0:  # handle first line
-            result = self.mmap.readline()  # get a complete line
+    return {
+        filename: [line for _, line in sorted(group, key=lambda tag: tag[0])]
+        for filename, group in groups.items()
+    }
 
-        result = result.strip()
-        if not result:
-            raise IndexError("Invalid tag at index %d." % index)
 
-        return Tag(result, self.column)
+def run_ctags(cmd, cwd, files=None, job=None, on_output=None):
+    """
+    Execute a ``ctags`` command.
 
-    def __len__(self):
-        """
-        Get size of tag file in bytes.
-        """
-        if not self.mmap:
-            raise RuntimeError("No tag file open.")
+    :param cmd: list containing the command and its arguments
+    :param cwd: working directory of the command
+    :param files: list of source files to index, relative to ``cwd``. The
+        list is passed to ctags via stdin.
+    :param job: ``BuildJob`` to cancel the command or limit its resources
+    :param on_output: function reading the standard output of ctags from a
+        binary stream while ctags runs. Messages of ctags are then read from
+        its standard error separately.
 
-        return len(self.mmap)
+    :raises CalledProcessError: if ctags fails
+    :raises BuildAborted: if ``job`` is cancelled or times out
 
-    def __enter__(self):
-        """
-        Open file on enter when using ``with`` keyword.
-        """
-        self.open()
-        return self
+    :returns: None
+    """
+    data = None
+    if files is not None:
+        cmd = cmd + ["-L", "-"]
+        data = b"".join(os.fsencode(name) + b"\n" for name in files)
 
-    def __exit__(self, type_, value, traceback):
-        """
-        Close file on exit when using ``with`` keyword.
-        """
-        self.close()
+    # ctags reports each file it opens in verbose mode
+    track_progress = job is not None and job.on_progress is not None
+    if track_progress:
+        cmd = cmd[:1] + ["--verbose"] + cmd[1:]
 
-    @property
-    def dir(self):
-        """
-        Get directory of tag file.
-        """
-        return os.path.dirname(self.path)
+    kwargs = {}
+    if job and job.low_priority:
+        cmd, kwargs = low_priority_command(cmd)
 
-    def open(self):
-        """
-        Open file.
-        """
-        self.file = open(self.path, "r", encoding="utf-8")
-        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    if os.name == "posix":
+        # run in a process group of its own, to kill the shell and ctags
+        kwargs["start_new_session"] = True
 
-    def close(self):
-        """
+    # workaround for the issue described here:
+    #   http://bugs.python.org/issue6689
+    if os.name == "posix":
+        cmd = " ".join(cmd)
+
+    # execute the command
+    process = Popen(
+        cmd,
+        cwd=cwd,
+        shell=True,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE if on_output else subprocess.STDOUT,
+        **kwargs
+    )
+
+    output = []
+    errors = []
+    threads = [
+        threading.Thread(target=write_input, args=(process.stdin, data)),
+        threading.Thread(
+            target=read_output,
+            args=(
+                process.stderr if on_output else process.stdout,
+                output,
+                job if track_progress else None,
+            ),
+        ),
+    ]
+    if on_output:
+        threads.append(
+            threading.Thread(
+                target=pass_output, args=(process.stdout, on_output, errors)
+            )
+        )
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            try:
+                process.wait(timeout=0.1)
+                break
+            except TimeoutExpired:
+                if job:
+                    job.check()
+    except BaseException:
+        kill_process(process)
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+
+    if process.returncode:
+        raise CalledProcessError(process.returncode, cmd, b"".join(output))
+    if errors:
+        raise errors[0]
+
+
+def pass_output(stream, on_output, errors):
+    """
+    Pass the standard output of a ``ctags`` process to a function.
+
+    :param stream: stdout of the process
+    :param on_output: function reading the stream
+    :param errors: list to append an exception raised by ``on_output`` to.
+        The rest of the output is discarded then, so ctags isn't blocked.
+
+    :returns: None
+    """
+    with stream:
+        try:
+            on_output(stream)
+        except Exception as e:
+            errors.append(e)
+            for _ in stream:
+                pass
+
+
+def write_input(stream, data):
+    """
+    Write the input of a ``ctags`` process and close it.
+
+    :param stream: stdin of the process
+    :param data: bytes to write, or None
+
+    :returns: None
+    """
+    try:
+        if data:
+            stream.write(data)
+    except OSError:  # ctags exited early
+        pass
+    finally:
+        try:
+            stream.close()
+        except OSError:
+            pass
+
+
+def read_output(stream, output, job=None):
+    """
+    Read the output of a ``ctags`` process.
+
+    :param stream: stdout of the process
+    :param output: list to append output lines to
+    :param job: ``BuildJob`` to report opened files to. Verbose output about
+        opened files is not kept.
+
+    :returns: None
+    """
+    with stream:
+        for line in stream:
+            if job and line.startswith(b"OPENING "):
+                name = line[8:].rpartition(b" as ")[0]
+                job.file_done(os.fsdecode(name))
+            else:
+                output.append(line)
+
+
+def low_priority_command(cmd):
+    """
+    Make a command run with low CPU and I/O priority.
+
+    :param cmd: list containing the command and its arguments
+
+    :returns: tuple of the command and keyword arguments for ``Popen``
+    """
+    if os.name == "nt":
+        return cmd, {"creationflags": subprocess.BELOW_NORMAL_PRIORITY_CLASS}
+
+    prefix = []
+    if shutil.which("nice"):
+        prefix += ["nice", "-n", "19"]
+    if shutil.which("ionice"):
+        prefix += ["ionice", "-c", "3"]
+
+    return prefix + cmd, {}
+
+
+def kill_process(process):
+    """
+    Kill a process started by ``run_ctags``, along with its children.
+
+    :param process: ``Popen`` object
+
+    :returns: None
+    """
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            subprocess.call(
+                ["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+    except OSError:
+        process.kill()
+
+    process.wait()
+
+
+def finish_ctags(
+    tag_file, with_diff=False, temp_file=None, job=None, partition=False, groups=None
+):
+    """
+    Post-process a freshly built tag file and publish it.
+
+    Files derived from the tag file are swapped in before the new tag file
+    itself, each by an atomic rename. Readers keep using the files they
+    opened, and copies sorted by symbol are rebuilt once they find the tag
+    file's generation changed.
+
+    :param tag_file: the location of the tagfile
+    :param with_diff: also return the changes to the previous tag file
+    :param temp_file: the location of the new tagfile, if it was built next
+        to ``tag_file``
+    :param job: ``BuildJob`` to record the output of the build in
+    :param partition: also split the tag file by language
+    :param groups: tag lines of the new tag file grouped by source file, if
+        known, see ``resort_ctags``
+
+    :returns: ``tag_file``, or a tuple of it and a ``TagsDiff`` if
+        ``with_diff`` is set
+    """
+    try:
+        # re-sort ctag file in filename order to improve search performance
+        diff = resort_ctags(tag_file, temp_file, groups)
+
+        if partition:
+            partition_ctags(tag_file, temp_file)
+
+        if job:
+            job.add_output(os.path.getsize(temp_file or tag_file), diff.tag_count)
+
+        if temp_file:
+            replace_file(temp_file, tag_file)
+    finally:
+        if temp_file and os.path.exists(temp_file):
+            os.remove(temp_file)
+
+    if with_diff:
+        return tag_file, diff
+
+    return tag_file
+
+
+def replace_file(src, dst, retries=20):
+    """
+    Atomically replace a file by another one.
+
+    On Windows, files can't be replaced while opened by a reader, so the
+    rename is retried for a short while. If the file is still open then, the
+    new file is kept as ``dst + ".pending"`` and swapped in by a background
+    thread as soon as the readers are done, see ``retry_replacements``.
+
+    :param src: path to the new file
+    :param dst: path to the file to replace
+    :param retries: number of attempts
+
+    :returns: True if the file was replaced, False if the replacement is
+        pending
+    """
+    # a pending older version must not replace this one later
+    with pending_lock:
+        pending = pending_replacements.pop(dst, None)
+    if pending and os.path.exists(pending):
+        os.remove(pending)
+
+    for attempt in range(retries):
+        try:
+            os.replace(src, dst)
+            return True
+        except PermissionError:
+            if attempt + 1 < retries:
+                time.sleep(0.05)
+
+    pending = dst + ".pending"
+    os.replace(src, pending)
+
+    with pending_lock:
+        start = not pending_replacements
+        pending_replacements[dst] = pending
+    if start:
+        threading.Thread(target=retry_replacements, daemon=True).start()
+
+    return False
+
+
+def retry_replacements():
+    """
+    Swap in pending replacements of files, see ``replace_file``.
+
+    Runs until all pending replacements are done.
+
+    :returns: None
+    """
+    while True:
+        time.sleep(PENDING_RETRY_INTERVAL)
+
+        with pending_lock:
+            for dst, pending in list(pending_replacements.items()):
+                try:
+                    os.replace(pending, dst)
+                except PermissionError:
+                    continue
+                except OSError:
+                    pass
+                del pending_replacements[dst]
+
+            if not pending_replacements:
+                return
+
+
+def is_replacement_pending(path):
+    """
+    Check if a new version of a file waits to replace it, see ``replace_file``.
+
+    :param path: path to the file
+
+    :returns: True if a replacement is pending, else False
+    """
+    with pending_lock:
+        return path in pending_replacements
+
+
+def get_generation(tag_file, stat=None):
+    """
+    Identify the generation of a tag file.
+
+    Tag files are replaced by renaming new ones over them, so each generation
+    is a different file with its own inode and modification time.
+
+    :param tag_file: the location of the tagfile
+    :param stat: ``os.stat_result`` of the tagfile, if already known
+
+    :returns: string identifying the generation, or None if there is no tag
+        file
+    """
+    if stat is None:
+        try:
+            stat = os.stat(tag_file)
+        except OSError:
+            return None
+
+    return "%d:%d:%d" % (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def quote(arg):
+    """
+    Quote a command line argument for ``run_ctags``.
+    """
+    if os.name == "posix":
+        return shlex.quote(arg)
+    return arg
+
+
+def update_ctags(
+    cmd, cwd, tag_file, changed, deleted, output_file, job=None, json_output=False
+):
+    """
+    Update the tags of some source files of an existing tag file.
+
+    Runs ``ctags`` for the changed source files only and merges the result
+    with the tag file, replacing all previous tags of changed or deleted
+    source files. The sort order of the tag file is preserved.
+
+    :param cmd: list containing the ctags command and its options
+    :param cwd: directory the tag file's source file names are relative to
+    :param tag_file: the location of the tagfile
+    :param changed: names of new or changed source files, relative to ``cwd``
+    :param deleted: names of deleted source files, relative to ``cwd``
+    :param output_file: the location to write the updated tagfile to
+    :param job: ``BuildJob`` to cancel the build or limit its resources
+    :param json_output: read the JSON output of Universal Ctags
+
+    :returns: tag lines of the updated tag file grouped by source file, see
+        ``resort_ctags``, if ``json_output`` is set and the tags of other
+        source files are in order in the previous ``sorted_by_file`` file,
+        else None
+    """
+    partial_file = tag_file + ".partial"
+    groups = None
+
+    try:
+        if changed:
+            groups = write_tags(
+                cmd, cwd, partial_file, sorted(changed), job, json_output
+            )
+            with open(partial_file, "rb") as file_:
+                lines = [line for line in file_ if not line.startswith(b"!_TAG")]
+        else:
+            lines = []
+
+        dropped = {name.encode("utf-8") for name in changed | deleted}
+        headers = []
+
+        with open(tag_file, "rb") as file_:
+            for line in file_:
+                if line.startswith(b"!_TAG"):
+                    headers.append(line)
+                    continue
+                split = line.split(b"\t", FILENAME + 1)
+                if len(split) > FILENAME and split[FILENAME] not in dropped:
+                    lines.append(line)
+
+        sort_order = read_sort_order(tag_file)
+        if sort_order == FOLDCASE:
+            lines.sort(key=bytes.upper)
+        elif sort_order == SORTED:
+            lines.sort()
+
+        with open(output_file, "wb") as file_:
+            file_.writelines(headers)
+            file_.writelines(lines)
+
+    finally:
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+
+    sorted_file = tag_file + "_sorted_by_file"
+    if not json_output or not os.path.exists(sorted_file):
+        return None
+
+    # tags of other source files are unchanged, so keep their order
+    kept = group_tag_lines(sorted_file)
+    for name in changed | deleted:
+        kept.pop(name, None)
+    kept.update(groups or {})
+
+    return kept
+
+
+def get_options_hash(
+    cmd, recursive, exclude_patterns=None, use_gitignore=False, json_output=False
+):
+    """
+    Get a hash of the options a tag file was built with.
+
+    :param cmd: list containing the ctags command and its options
+    :param recursive: if the tag file is built recursively
+    :param exclude_patterns: list of patterns of excluded source files
+    :param use_gitignore: if ``.gitignore`` files are applied
+    :param json_output: if the JSON output of Universal Ctags is read
+
+    :returns: hex digest of the options
+    """
+    options = json.dumps(
+        [cmd, recursive, exclude_patterns, use_gitignore, json_output, MANIFEST_VERSION]
+    )
+    return hashlib.sha1(options.encode("utf-8")).hexdigest()
+
+
+def hash_file(path):
+    """
+    Get a hash of the content of a file.
+
+    :param path: path to a file
+
+    :returns: hex digest of the file's content
+    """
+    digest = hashlib.sha1()
+
+    with open(path, "rb") as file_:
+        for chunk in iter(lambda: file_.read(1 << 16), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def translate_pattern(pattern):
+    """
+    Translate a ``.gitignore``-style glob pattern to a regular expression.
+
+    ``*`` and ``?`` don't match ``/``, while ``**`` matches any number of
+    directories when it forms a whole path component.
+
+    :param pattern: glob pattern, without negation and trailing slash
+
+    :returns: regular expression string
+    """
+    i, n = 0, len(pattern)
+    result = []
+
+    while i < n:
+        char = pattern[i]
+        i += 1
+
+        if char == "*":
+            if pattern.startswith("*", i) and (i == 1 or pattern[i - 2] == "/"):
+                if i + 1 == n:  # trailing "/**"
+                    result.append(".*")
+                    i += 1
+                    continue
+                if pattern[i + 1] == "/":  # leading or inner "**/"
+                    result.append("(?:.*/)?")
+                    i += 2
+                    continue
+            while pattern.startswith("*", i):
+                i += 1
+            result.append("[^/]*")
+        elif char == "?":
+            result.append("[^/]")
+        elif char == "[":
+            j = pattern.find("]", i + 1 if pattern.startswith(("!", "^"), i) else i)
+            if j == -1:
+                result.append(re.escape(char))
+                continue
+            chars = pattern[i:j].replace("\\", "\\\\")
+            if chars[0] in "!^":
+                chars = "^" + chars[1:]
+            result.append("[%s]" % chars)
+            i = j + 1
+        elif char == "\\" and i < n:
+            result.append(re.escape(pattern[i]))
+            i += 1
+        else:
+            result.append(re.escape(char))
+
+    return "".join(result)
+
+
+def read_ignore_file(path):
+    """
+    Read the patterns of a ``.gitignore``-style file.
+
+    :param path: path to the file
+
+    :returns: list of lines, or an empty list if the file can't be read
+    """
+    try:
+        with open(path, encoding="utf-8", errors="replace") as file_:
+            return file_.read().splitlines()
+    except OSError:
+        return []
+
+
+def list_source_files(
+    path, tag_file, recursive=True, exclude_patterns=None, use_gitignore=False
+):
+    """
+    List all files of a directory tree which might be indexed by ctags.
+
+    Files and directories matching any of the ``exclude_patterns`` or, if
+    enabled, the rules of ``.gitignore`` files are skipped. Excluded
+    directories are not descended into.
+
+    :param path: path to a directory
+    :param tag_file: the location of the tagfile, which is excluded along with
+        the files created along with it, see ``TAG_FILE_SUFFIX_RE``
+    :param recursive: also list files of subdirectories
+    :param exclude_patterns: list of ``.gitignore``-style patterns, relative
+        to ``path``
+    :param use_gitignore: apply the rules of ``.gitignore`` files and
+        ``.git/info/exclude``
+
+    :returns: generator of tuples of file name relative to ``path``, using
+        ``/`` as separator, and ``os.stat_result``
+    """
+    tag_name = os.path.basename(tag_file)
+
+    rules = IgnoreRules().extend(exclude_patterns or ())
+    if use_gitignore:
+        rules = rules.extend(
+            read_ignore_file(os.path.join(path, ".git", "info", "exclude"))
+        )
+
+    visited = set()
+    stack = [("", path, rules)]
+
+    while stack:
+        rel_dir, dir_path, rules = stack.pop()
+
+        if use_gitignore:
+            lines = read_ignore_file(os.path.join(dir_path, ".gitignore"))
+            if lines:
+                rules = rules.extend(lines, rel_dir)
+
+        try:
+            entries = list(os.scandir(dir_path))
+        except OSError:
+            continue
+
+        subdirs = []
+
+        for entry in entries:
+            name = rel_dir + "/" + entry.name if rel_dir else entry.name
+
+            try:
+                is_dir = entry.is_dir()
+                stat = entry.stat()
+            except OSError:
+                continue
+
+            if is_dir:
+                if not recursive or entry.name in VCS_DIRS:
+                    continue
+                if rules.match(name, True):
+                    continue
+                # guard against cycles of symlinked directories
+                if (stat.st_dev, stat.st_ino) in visited:
+                    continue
+                visited.add((stat.st_dev, stat.st_ino))
+                subdirs.append((name, entry.path, rules))
+            elif not rel_dir and is_tag_file_name(entry.name, tag_name):
+                continue
+            elif rules.match(name, False):
+                continue
+            else:
+                yield name, stat
+
+        stack.extend(reversed(subdirs))
+
+
+def is_tag_file_name(name, tag_name):
+    """
+    Check if a file name is that of a tag file or of a file created with it.
+
+    :param name: name of a file
+    :param tag_name: name of the tag file
+
+    :returns: True if ``name`` is ``tag_name`` with one of the suffixes of
+        ``TAG_FILE_SUFFIX_RE``, else False
+    """
+    return name.startswith(tag_name) and bool(
+        TAG_FILE_SUFFIX_RE.match(name, len(tag_name))
+    )
+
+
+def resort_ctags(tag_file, source=None, groups=None):
+    """
+    Rearrange ctags file for speed.
+
+    Resorts (re-sort) a CTag file in order of file. This improves searching
+    performance when searching tags by file as a binary search can be used.
+    Tags of a file are stored in order of their ``tag_path``, which is the
+    order symbols are displayed in. Hence a list of all symbols can be read
+    sequentially, without sorting it again.
+
+    The algorithm works as so:
+
+        For each line in the tag file
+            Read the file name (``file_name``) the tag belongs to
+            If not exists, create an empty array and store in the
+                dictionary with the file name as key
+            Save the line to this list
+        Create a new ``tagfile`` file
+        For each key in the sorted dictionary
+            For each line in the list indicated by the key
+                Split the line on tab character
+                Remove the prepending ``.`` from the ``file_name`` part of
+                    the                   tag
+                Join the line again and write the ``sorted_by_file`` file
+                    in order of the line's ``tag_path``
+
+    :param tag_file: The location of the tagfile to be sorted
+    :param source: the location of a new version of the tagfile to sort
+        instead, which is about to replace it
+    :param groups: dict of source file names and all their tag lines in
+        order of ``tag_path``, e.g. as decoded from JSON output by
+        ``convert_json_tags``, to write instead of parsing the tag file
+
+    :returns: ``TagsDiff`` describing the changes to the previous
+        ``sorted_by_file`` file
+    """
+    sorted_file = tag_file + "_sorted_by_file"
+
+    if groups is None:
+        groups = group_tag_lines(source or tag_file)
+        for lines in groups.values():
+            lines.sort(key=tag_path_key)
+
+    if os.path.exists(sorted_file):
+        # a new version is sorted before it replaces the tag file, so the
+        # tag file is still the version the sorted file was made of
+        base = get_generation(tag_file) if source else None
+        diff = TagsDiff(group_tag_lines(sorted_file), groups, base)
+    else:
+        diff = TagsDiff({}, groups)
+
+    temp_file = sorted_file + ".tmp"
+    with open(temp_file, "w", encoding="utf-8", errors="replace") as file_:
+        for group in sorted(groups):
+            file_.writelines(groups[group])
+    replace_file(temp_file, sorted_file)
+
+    return diff
+
+
+def group_tag_lines(tag_file):
+    """
+    Group the lines of a tag file by source file.
+
+    :param tag_file: The location of the tagfile
+
+    :returns: dict of source file names and their tag lines, in order of the
+        tag file
+    """
+    groups = {}
+
+    with open(tag_file, encoding="utf-8", errors="replace") as file_:
+        for line in file_:
+            # meta data not needed in sorted files
+            if line.startswith("!_TAG"):
+                continue
+
+            # read all valid symbol tags, which contain at least
+            # symbol name and containing file and build a list of tuples
+            split = line.split("\t", FILENAME + 1)
+            if len(split) > FILENAME:
+                groups.setdefault(split[FILENAME], []).append(line)
+
+    return groups
+
+
+def tag_path_key(line):
+    """
+    Get sort key of a tag line for displaying it in a list of symbols.
+
+    :param line: tag line from a tagfile
+
+    :returns: ``tag_path`` of the tag, or the raw line if it can't be parsed
+    """
+    search_obj = TAGS_RE.search(line.rstrip("\r\n"))
+    if not search_obj:
+        return (line,)
+
+    return post_process_tag(search_obj.groupdict())["tag_path"]
+
+
+def read_sort_order(tag_file):
+    """
+    Read the sort order of a tag file from its ``!_TAG_FILE_SORTED`` header.
+
+    :param tag_file: path to a tag file
+
+    :returns: ``UNSORTED``, ``SORTED`` or ``FOLDCASE``. Files without header,
+        like the ``sorted_by_file`` files, are considered ``SORTED``.
+    """
+    with open(tag_file, "rb") as file_:
+        for line in file_:
+            if not line.startswith(b"!_TAG"):
+                break
+            if line.startswith(b"!_TAG_FILE_SORTED\t"):
+                value = line.split(b"\t", 2)[1]
+                if value.isdigit():
+                    return int(value)
+                break
+
+    return SORTED
+
+
+def sort_ctags(tag_file, sorted_file, foldcase=False):
+    """
+    Write a copy of a tag file, sorted by symbol.
+
+    Tags with equal symbols keep their order. ``foldcase`` sorting folds
+    ASCII letters to upper case, as Exuberant and Universal ctags do.
+
+    :param tag_file: the location of the tagfile to be sorted
+    :param sorted_file: the location of the sorted copy
+    :param foldcase: sort case-insensitively
+
+    :returns: None
+    """
+    headers = []
+    lines = []
+
+    with open(tag_file, "rb") as file_:
+        generation = get_generation(tag_file, os.fstat(file_.fileno()))
+        for line in file_:
+            if not line.endswith(b"\n"):
+                line += b"\n"
+            if line.startswith((b"!_TAG_FILE_SORTED", b"!_TAG_SOURCE_GENERATION")):
+                continue
+            elif line.startswith(b"!_TAG"):
+                headers.append(line)
+            else:
+                lines.append(line)
+
+    if foldcase:
+        lines.sort(key=lambda line: line.split(b"\t", 1)[0].upper())
+    else:
+        lines.sort(key=lambda line: line.split(b"\t", 1)[0])
+
+    # several threads may sort the same tag file, so each writes its own file
+    fd, temp_file = tempfile.mkstemp(
+        prefix=os.path.basename(sorted_file) + ".",
+        suffix=".tmp",
+        dir=os.path.dirname(os.path.abspath(sorted_file)),
+    )
+    try:
+        with open(fd, "wb") as file_:
+            file_.write((SORTED_HEADER % (FOLDCASE if foldcase else SORTED)).encode())
+            file_.write((GENERATION_HEADER % generation).encode())
+            file_.writelines(headers)
+            file_.writelines(lines)
+
+        replace_file(temp_file, sorted_file)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def start_sort_ctags(tag_file, sorted_file, foldcase=False):
+    """
+    Write a sorted copy of a tag file in a background thread.
+
+    See ``sort_ctags``. Nothing is started if the copy is already being
+    written.
+
+    :param tag_file: the location of the tagfile to be sorted
+    :param sorted_file: the location of the sorted copy
+    :param foldcase: sort case-insensitively
+
+    :returns: ``threading.Thread`` writing the copy
+    """
+
+    def run():
+        try:
+            sort_ctags(tag_file, sorted_file, foldcase)
+        finally:
+            with sort_threads_lock:
+                del sort_threads[sorted_file]
+
+    with sort_threads_lock:
+        thread = sort_threads.get(sorted_file)
+        if thread is None:
+            thread = threading.Thread(target=run, daemon=True)
+            sort_threads[sorted_file] = thread
+            thread.start()
+
+    return thread
+
+
+def get_sorted_ctags(tag_file, foldcase=False, build=True):
+    """
+    Get a copy of a tag file sorted by symbol, if it is up to date.
+
+    Missing or outdated copies are (re)built in the background, see
+    ``start_sort_ctags``, so callers don't wait for a whole tag file to be
+    sorted.
+
+    :param tag_file: the location of the tagfile
+    :param foldcase: get a case-insensitively sorted copy
+    :param build: start building the copy if it isn't up to date
+
+    :returns: the location of the sorted copy, or None if it isn't
+        available yet
+    """
+    sorted_file = tag_file + ("_sorted_foldcase" if foldcase else "_sorted_by_symbol")
+
+    if read_source_generation(sorted_file) == get_generation(tag_file):
+        return sorted_file
+
+    if build:
+        start_sort_ctags(tag_file, sorted_file, foldcase)
+    return None
+
+
+def read_source_generation(sorted_file):
+    """
+    Read the generation of the tag file a sorted copy was made from.
+
+    :param sorted_file: the location of a copy made by ``sort_ctags``
+
+    :returns: generation of the tag file, or None if unknown
+    """
+    try:
+        with open(sorted_file, "rb") as file_:
+            for line in file_:
+                if not line.startswith(b"!_TAG"):
+                    break
+                if line.startswith(b"!_TAG_SOURCE_GENERATION\t"):
+                    return line.split(b"\t")[1].decode("ascii")
+    except OSError:
+        pass
+
+    return None
+
+
+def tag_language(line):
+    """
+    Get the language of a tag line.
+
+    :param line: tag line from a tagfile
+
+    :returns: value of the ``language`` field, else the language of the
+        extension of the source file, or None if unknown
+    """
+    start = line.find("\tlanguage:")
+    if start != -1:
+        start += len("\tlanguage:")
+        end = line.find("\t", start)
+        return line[start : end if end != -1 else None].rstrip("\r\n")
+
+    filename = line.split("\t", 2)[1]
+    return LANGUAGE_EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+
+
+def partition_path(tag_file, language):
+    """
+    Get the path of the partition of a tag file holding a language's tags.
+    """
+    return "%s_lang_%s" % (tag_file, re.sub(r"[^\w+#-]", "_", language))
+
+
+def partition_ctags(tag_file, source=None):
+    """
+    Split a tag file into one tag file per language.
+
+    Partitions are written next to the tag file, sorted by symbol, see
+    ``partition_path``. Their languages are listed in an index with
+    ``_languages`` suffix, along with the generation of the tag file they
+    were split from. Tags of unknown languages are left out. If all tags are
+    of one language, no partition is written and the index refers to the tag
+    file itself.
+
+    :param tag_file: the location of the tagfile
+    :param source: the location of a new version of the tagfile to split
+        instead, which is about to replace it
+
+    :returns: list of languages
+    """
+    headers = []
+    partitions = {}
+    sort_order = SORTED
+
+    with open(source or tag_file, "r", encoding="utf-8", errors="replace") as file_:
+        generation = get_generation(source or tag_file, os.fstat(file_.fileno()))
+        for line in file_:
+            if not line.endswith("\n"):
+                line += "\n"
+            if line.startswith("!_TAG_FILE_SORTED\t"):
+                value = line.split("\t", 2)[1]
+                sort_order = int(value) if value.isdigit() else UNSORTED
+            elif line.startswith("!_TAG_SOURCE_GENERATION"):
+                continue
+            elif line.startswith("!_"):
+                headers.append(line)
+            else:
+                language = tag_language(line)
+                if language:
+                    partitions.setdefault(language, []).append(line)
+
+    languages = sorted(partitions)
+
+    # file names of the partitions, relative to the tag file's directory
+    names = {}
+    if len(languages) > 1:
+        for language in languages:
+            names[language] = os.path.basename(partition_path(tag_file, language))
+
+    for language, name in names.items():
+        lines = partitions[language]
+        if sort_order != SORTED:
+            lines.sort(key=lambda line: line.split("\t", 1)[0])
+
+        path = partition_path(tag_file, language)
+        with open(path + ".tmp", "w", encoding="utf-8") as file_:
+            file_.write(SORTED_HEADER % SORTED)
+            file_.write(GENERATION_HEADER % generation)
+            file_.writelines(headers)
+            file_.writelines(lines)
+        replace_file(path + ".tmp", path)
+
+    index = tag_file + "_languages"
+
+    # remove partitions of languages which are gone, and the files made of
+    # them. Files still opened by readers are left to the next build.
+    directory = os.path.dirname(tag_file)
+    for name in set(read_partition_names(index)) - set(names.values()):
+        for suffix in PARTITION_SUFFIXES:
+            path = os.path.join(directory, name + suffix)
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError:
+                pass
+
+    with open(index + ".tmp", "w", encoding="utf-8") as file_:
+        file_.write(LANGUAGES_HEADER % generation)
+        for language in languages:
+            file_.write("%s\t%s\n" % (language, names.get(language, "")))
+    replace_file(index + ".tmp", index)
+
+    return languages
+
+
+def read_partition_names(index):
+    """
+    Read the file names of the partitions listed in a languages index.
+
+    :param index: the location of the index written by ``partition_ctags``
+
+    :returns: list of file names of partitions, relative to the tag file's
+        directory
+    """
+    names = []
+
+    try:
+        with open(index, "r", encoding="utf-8") as file_:
+            for line in file_:
+                name = line.rstrip("\n").partition("\t")[2]
+                if name and not line.startswith("!_"):
+                    names.append(name)
+    except OSError:
+        pass
+
+    return names
+
+
+def get_partitions(tag_file, languages):
+    """
+    Get the partitions of a tag file holding the tags of some languages.
+
+    :param tag_file: the location of the tagfile
+    :param languages: names of languages
+
+    :returns: list of paths of the partitions, which may be empty, or None if
+        the tag file isn't partitioned or its partitions are outdated
+    """
+    index = tag_file + "_languages"
+    generation = get_generation(tag_file)
+    if generation is None or read_source_generation(index) != generation:
+        return None
+
+    paths = []
+    with open(index, "r", encoding="utf-8") as file_:
+        for line in file_:
+            if line.startswith("!_"):
+                continue
+            language, _, name = line.rstrip("\n").partition("\t")
+            if language in languages:
+                path = (
+                    os.path.join(os.path.dirname(tag_file), name) if name else tag_file
+                )
+                if path not in paths:
+                    paths.append(path)
+
+    return paths
+
+
+#
+# Models
+#
+
+
+class TagElements(dict):
+    """
+    Model the entries of a tag file.
+
+    The ``tag_path`` of tags parsed with a projection of fields is created on
+    first access, via item or attribute.
+    """
+
+    def __init__(self, *args, **kw):
+        """Initialise Tag object"""
+        dict.__init__(self, *args, **kw)
+        self.__dict__ = self
+
+    def __missing__(self, key):
+        if key == "tag_path" and "symbol" in self:
+            self.update(create_tag_path(self))
+            return self[key]
+        raise KeyError(key)
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class BuildAborted(Exception):
+    """
+    Raised when a build is stopped before it finished.
+    """
+
+
+class BuildCancelled(BuildAborted):
+    """
+    Raised when a build is cancelled by the user.
+    """
+
+
+class BuildJob(object):
+    """
+    Model a running build, which may be cancelled or limited in time and in
+    size, and which keeps statistics about its progress.
+    """
+
+    def __init__(
+        self, timeout=None, low_priority=False, max_bytes=None, on_progress=None
+    ):
+        """
+        Initialise object.
+
+        :param timeout: maximum duration of the build in seconds
+        :param low_priority: run ctags with low CPU and I/O priority
+        :param max_bytes: maximum total size of the source files to index
+        :param on_progress: callback receiving the job whenever ctags opened
+            more source files, at most every ``PROGRESS_INTERVAL`` seconds
+
+        :returns: None
+        """
+        self.timeout = timeout
+        self.low_priority = low_priority
+        self.max_bytes = max_bytes
+        self.on_progress = on_progress
+        self.started = time.monotonic()
+        self.cancelled = threading.Event()
+
+        self.sizes = {}
+        self.files_total = 0
+        self.files_done = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.tag_count = 0
+        self.peak_output = 0
+        self.last_report = 0
+
+    @property
+    def elapsed(self):
+        """
+        Get the duration of the build so far, in seconds.
+        """
+        return time.monotonic() - self.started
+
+    @property
+    def files_per_second(self):
+        """
+        Get the number of source files indexed per second.
+        """
+        return self.files_done / max(self.elapsed, 1e-3)
+
+    @property
+    def eta(self):
+        """
+        Get the estimated remaining duration in seconds, based on the indexed
+        bytes, or None if unknown.
+        """
+        if not self.bytes_done:
+            return None
+        return (self.bytes_total - self.bytes_done) * self.elapsed / self.bytes_done
+
+    def cancel(self):
+        """
+        Cancel the build. Running ctags processes are killed.
+        """
+        self.cancelled.set()
+
+    def check(self):
+        """
+        Check if the build should go on.
+
+        :raises BuildCancelled: if the build was cancelled
+        :raises BuildAborted: if the build timed out
+
+        :returns: None
+        """
+        if self.cancelled.is_set():
+            raise BuildCancelled("Build cancelled.")
+
+        if self.timeout and self.elapsed > self.timeout:
+            raise BuildAborted("Build timed out after %d seconds." % self.timeout)
+
+    def add_sources(self, sources, names=None):
+        """
+        Add source files about to be indexed, checking the size limit.
+
+        :param sources: list of tuples of source file name and
+            ``os.stat_result``
+        :param names: names of the source files to index, if not all
+
+        :raises BuildAborted: if the source files exceed the limit
+
+        :returns: None
+        """
+        self.check()
+
+        sizes = {
+            name: stat.st_size
+            for name, stat in sources
+            if names is None or name in names
+        }
+
+        total = sum(sizes.values())
+        if self.max_bytes and total > self.max_bytes:
+            raise BuildAborted(
+                "Source files to index total %d bytes, exceeding the limit of %d"
+                " bytes. Exclude some files or raise 'max_indexed_bytes'."
+                % (total, self.max_bytes)
+            )
+
+        self.sizes = sizes
+        self.files_total += len(sizes)
+        self.bytes_total += total
+
+    def file_done(self, name):
+        """
+        Record that ctags opened a source file.
+
+        :param name: name of the source file, as passed to ctags
+
+        :returns: None
+        """
+        self.files_done += 1
+        self.bytes_done += self.sizes.get(name, 0)
+
+        now = time.monotonic()
+        if self.on_progress and now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            self.on_progress(self)
+
+    def add_output(self, size, tag_count):
+        """
+        Record a tag file written by the build.
+
+        :param size: size of the tag file in bytes
+        :param tag_count: number of tags in the tag file
+
+        :returns: None
+        """
+        self.tag_count += tag_count
+        self.peak_output = max(self.peak_output, size)
+
+
+class IgnoreRules(object):
+    """
+    Model a list of ``.gitignore``-style exclude rules.
+
+    Patterns without a slash match names at any level, other patterns are
+    relative to the directory they were read from. Trailing slashes restrict
+    a pattern to directories and a leading ``!`` re-includes previously
+    excluded paths. The last matching rule wins.
+    """
+
+    def __init__(self, rules=()):
+        """
+        Initialise object.
+
+        :param rules: list of tuples of compiled pattern, negation and
+            directory-only flags
+
+        :returns: None
+        """
+        self.rules = list(rules)
+
+    def extend(self, lines, base=""):
+        """
+        Create rules which additionally apply patterns read from a file.
+
+        :param lines: lines of a ``.gitignore``-style file
+        :param base: directory containing the file, relative to the root
+            directory and using ``/`` as separator
+
+        :returns: new ``IgnoreRules`` object
+        """
+        rules = list(self.rules)
+
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+
+            # trailing spaces are ignored, unless escaped
+            stripped = line.rstrip(" ")
+            if stripped.endswith("\\") and stripped != line:
+                stripped += " "
+            line = stripped
+
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+
+            regex = translate_pattern(line.lstrip("/"))
+            if "/" not in line:
+                regex = "(?:.*/)?" + regex
+            if base:
+                regex = re.escape(base + "/") + regex
+
+            rules.append((re.compile(regex, re.DOTALL), negate, dir_only))
+
+        return IgnoreRules(rules)
+
+    def match(self, name, is_dir):
+        """
+        Check if a path is excluded.
+
+        :param name: path relative to the root directory, using ``/`` as
+            separator
+        :param is_dir: if the path is a directory
+
+        :returns: True if ``name`` is excluded
+        """
+        for regex, negate, dir_only in reversed(self.rules):
+            if dir_only and not is_dir:
+                continue
+            if regex.fullmatch(name):
+                return not negate
+        return False
+
+
+class Manifest(object):
+    """
+    Model the manifest of a tag file.
+
+    The manifest records each indexed source file with modification time,
+    size and optionally a content hash, along with a hash of the options the
+    tag file was built with. It is stored next to the tag file.
+    """
+
+    def __init__(self, tag_file, options_hash):
+        """
+        Initialise object.
+
+        :param tag_file: the location of the tagfile
+        :param options_hash: hash of the options used to build the tag file
+
+        :returns: None
+        """
+        self.tag_file = tag_file
+        self.path = tag_file + "_manifest"
+        self.options_hash = options_hash
+        self.files = {}
+
+    def load(self):
+        """
+        Load the manifest, if it exists and matches the build options.
+
+        :returns: True if loaded, False if a full build is required
+        """
+        try:
+            with open(self.path, encoding="utf-8") as file_:
+                data = json.load(file_)
+        except (OSError, ValueError):
+            return False
+
+        if data.get("options") != self.options_hash:
+            return False
+
+        self.files = data.get("files", {})
+        return True
+
+    def save(self):
+        """
+        Save the manifest.
+        """
+        temp_file = self.path + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as file_:
+            json.dump({"options": self.options_hash, "files": self.files}, file_)
+        os.replace(temp_file, self.path)
+
+    def update(self, path, sources, hash_content=False):
+        """
+        Compare the manifest with the current source files and update it.
+
+        :param path: path to the directory the tag file is built for
+        :param sources: list of tuples of source file name and
+            ``os.stat_result``, as returned by ``list_source_files``
+        :param hash_content: compare and record content hashes
+
+        :returns: tuple of sets of new or changed and deleted file names
+        """
+        files = {}
+        changed = set()
+
+        for name, stat in sources:
+            entry = [stat.st_mtime_ns, stat.st_size, None]
+            old_entry = self.files.get(name)
+
+            if old_entry and old_entry[:2] == entry[:2]:
+                entry = old_entry
+            elif hash_content:
+                entry[2] = hash_file(os.path.join(path, name))
+                if not old_entry or old_entry[2] != entry[2]:
+                    changed.add(name)
+            else:
+                changed.add(name)
+
+            files[name] = entry
+
+        deleted = set(self.files) - set(files)
+        self.files = files
+
+        return changed, deleted
+
+
+class TagsDiff(object):
+    """
+    Model the changes between two versions of a tag file, file by file.
+    """
+
+    def __init__(self, old_groups, new_groups, base=None):
+        """
+        Compare the tag lines of two versions of a tag file.
+
+        Only the lines of source files which were added, removed or changed
+        are kept.
+
+        :param old_groups: dict of source file names and their old tag lines
+        :param new_groups: dict of source file names and their new tag lines
+        :param base: generation of the old version of the tag file, if known
+
+        :returns: None
+        """
+        self.base = base
+        self.added = set(new_groups) - set(old_groups)
+        self.removed = set(old_groups) - set(new_groups)
+        self.changed = {
+            name
+            for name in set(old_groups) & set(new_groups)
+            if old_groups[name] != new_groups[name]
+        }
+
+        affected = self.added | self.removed | self.changed
+        self.old_lines = {name: old_groups[name] for name in affected - self.added}
+        self.new_lines = {name: new_groups[name] for name in affected - self.removed}
+        self.tag_count = sum(len(lines) for lines in new_groups.values())
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    @property
+    def files(self):
+        """
+        Get names of all added, removed or changed source files.
+        """
+        return self.added | self.removed | self.changed
+
+
+class Tag(object):
+    """
+    Model a tag.
+
+    This exists mainly to enable different types of sorting.
+
+    Lines read from a tag file are kept as bytes, until the text of the tag
+    is first accessed.
+    """
+
+    def __init__(self, line, column=0):
+        self._line = line
+        self.column = column
+
+    @property
+    def line(self):
+        if isinstance(self._line, bytes):  # decode lazily
+            self._line = self._line.decode("utf-8", "replace")
+        return self._line
+
+    def __lt__(self, other):
+        try:
+            return self.key < other
+        except IndexError:
+            return False
+
+    def __gt__(self, other):
+        try:
+            return self.key > other
+        except IndexError:
+            return False
+
+    def __getitem__(self, index):
+        return self.line.split("\t", self.column + 1)[index]
+
+    def __len__(self):
+        return self.line.count("\t") + 1
+
+    @property
+    def key(self):
+        return self[self.column]
+
+
+class TagFile(object):
+    """
+    Model a tag file.
+
+    This doesn't actually hold a entire tag file, due in part to the sheer
+    size of some tag files (> 100 MB files are possible). Instead, it acts
+    as a 'wrapper' of sorts around a file, providing functionality like
+    searching for a retrieving tags, finding tags based on given criteria
+    (prefix, suffix, exact), getting the directory of a tag and so forth.
+    """
+
+    def __init__(self, path, column, ignore_case=False, build=True):
+        """
+        Initialise object.
+
+        The file indicated by ``path`` must be sorted by values in the column
+        indicated by ``column``. Tag files searched by symbol may be sorted
+        case-insensitively (``--sort=foldcase``) or not at all (``--sort=no``)
+        though, in which case a sorted copy is searched instead. The tag file
+        is read as a whole while that copy is being built.
+
+        :param path: path to a tag file
+        :param column: column to search on
+        :param ignore_case: search symbols case-insensitively
+        :param build: build a missing sorted copy, see ``get_sorted_ctags``
+
+        :returns: None
+        """
+        self.path = path
+        self.column = column
+        self.ignore_case = ignore_case
+        self.build = build
+        self.foldcase = False
+        self.scan = False
+        self.file = None
+        self.mmap = None
+
+    def __getitem__(self, index):
+        """
+        Provide sequence-type interface to tag file.
+        """
+        if not self.mmap:
+            raise RuntimeError("No tag file open.")
+
+        self.mmap.seek(index)
+        result = self.mmap.readline()
+
+        if index != 0:  # handle first line
+            result = self.mmap.readline()  # get a complete line
+
+        result = result.strip()
+        if not result:
+            raise IndexError("Invalid tag at index %d." % index)
+
+        return Tag(result, self.column)
+
+    def __len__(self):
+        """
+        Get size of tag file in bytes.
+        """
+        if not self.mmap:
+            raise RuntimeError("No tag file open.")
+
+        return len(self.mmap)
+
+    def __enter__(self):
+        """
+        Open file on enter when using ``with`` keyword.
+        """
+        self.open()
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        """
+        Close file on exit when using ``with`` keyword.
+        """
+        self.close()
+
+    @property
+    def dir(self):
+        """
+        Get directory of tag file.
+        """
+        return os.path.dirname(self.path)
+
+    def open(self):
+        """
+        Open file.
+        """
+        path = self.path
+
+        if self.column == SYMBOL:
+            sort_order = read_sort_order(path)
+            if (self.ignore_case and sort_order != FOLDCASE) or sort_order == UNSORTED:
+                sorted_path = get_sorted_ctags(path, self.ignore_case, self.build)
+                if sorted_path:
+                    path = sorted_path
+                    sort_order = FOLDCASE if self.ignore_case else SORTED
+                else:  # until the sorted copy is available
+                    self.scan = True
+            self.foldcase = sort_order == FOLDCASE
+
+        self.file = open(path, "r", encoding="utf-8")
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def prefault(self):
+        """
+        Touch every page of the open file.
+
+        Makes the operating system load the whole file, so later searches
+        don't have to wait for the disk.
+
+        :returns: size of the file in bytes
+        """
+        if not self.mmap:
+            raise RuntimeError("No tag file open.")
+
+        size = self.mmap.size()
+        for offset in range(0, size, mmap.PAGESIZE):
+            self.mmap[offset]
+
+        return size
+
+    def close(self):
+        """
         Close file.
         """
         if not self.mmap or not self.file:
@@ -543,23 +2597,193 @@ class TagFile(object):
 
         if not tags:
             while self.mmap.tell() < self.mmap.size():
-                result = Tag(self.mmap.readline().strip(), self.column)
-                if result.line:
-                    yield result
+                line = self.mmap.readline().strip()
+                if line:
+                    yield Tag(line, self.column)
+            return
+
+        for _, tag in self.search_many(tags, exact_match):
+            yield tag
+
+    def search_many(self, keys, exact_match=True):
+        """
+        Search for a batch of tags in the tag file.
+
+        The keys are sorted and resolved in a single forward pass, with each
+        binary search limited to the part of the file following the matches
+        of the previous key. Resolving many keys hence costs about one pass
+        over the file instead of one full binary search per key.
+
+        :param keys: iterable of tags to search for
+        :param exact_match: if search should be an exact or partial match
+
+        :returns: tuples of key and matching tag, in order of the sorted keys
+        """
+        if not self.mmap:
+            raise RuntimeError("No tag file open.")
+
+        if self.scan:
+            yield from self.scan_many(keys, exact_match)
             return
 
-        for key in tags:
-            left_index = bisect.bisect_left(self, key)
+        # case-sensitive search in a case-insensitively sorted file
+        filter_case = self.foldcase and not self.ignore_case
+
+        needles = []
+        for key in set(keys):
+            needle = key.encode("utf-8")
+            folded = needle.upper() if self.foldcase else needle
+            needles.append((folded, needle, key))
+        needles.sort()
+
+        lo = 0
+        for folded, needle, key in needles:
+            lo = self.bisect_left(folded, lo)
+            start, end = self.line_bounds(lo)
+            while start < end:
+                value = self.key_at(start, end)
+                if value is None:
+                    break
+                if not self.match(value, folded, exact_match, self.foldcase):
+                    break
+                if not filter_case or self.match(value, needle, exact_match):
+                    yield key, Tag(self.mmap[start:end].strip(), self.column)
+                start, end = self.line_bounds(end, True)
+
+    def scan_many(self, keys, exact_match=True):
+        """
+        Search for a batch of tags by reading the whole tag file.
+
+        Used instead of a binary search if the tag file isn't sorted as
+        required and no sorted copy is available, see ``open``.
+
+        :param keys: iterable of tags to search for
+        :param exact_match: if search should be an exact or partial match
+
+        :returns: tuples of key and matching tag, in order of the sorted keys
+        """
+        needles = {}
+        for key in set(keys):
+            needle = key.encode("utf-8")
+            needles[needle.upper() if self.ignore_case else needle] = key
+
+        matches = {needle: [] for needle in needles}
+
+        self.mmap.seek(0)
+        for line in iter(self.mmap.readline, b""):
+            line = line.strip()
+            if not line or line.startswith(b"!_TAG"):
+                continue
+            value = line.split(b"\t", self.column + 1)[self.column]
+            if self.ignore_case:
+                value = value.upper()
             if exact_match:
-                result = self[left_index]
-                while result.line and result[result.column] == key:
-                    yield result
-                    result = Tag(self.mmap.readline().strip(), self.column)
+                if value in matches:
+                    matches[value].append(line)
+            else:
+                for needle in needles:
+                    if value.startswith(needle):
+                        matches[needle].append(line)
+
+        for needle in sorted(needles):
+            for line in matches[needle]:
+                yield needles[needle], Tag(line, self.column)
+
+    @staticmethod
+    def match(value, key, exact_match, foldcase=False):
+        """
+        Check if an encoded column value matches an encoded search key.
+        """
+        if foldcase:
+            value = value.upper()
+        if exact_match:
+            return value == key
+        return value.startswith(key)
+
+    def line_bounds(self, index, at_line_end=False):
+        """
+        Get the byte range of a complete line in the tag file.
+
+        Follows the conventions of ``__getitem__``, i.e. a non-zero ``index``
+        addresses the first line starting after ``index``.
+
+        :param index: byte offset into the tag file
+        :param at_line_end: ``index`` is known to point to a line break
+
+        :returns: tuple of start and end offset of the line, excluding the
+            line break. Both are equal to the file size at its end.
+        """
+        size = len(self.mmap)
+
+        if at_line_end:
+            start = index + 1
+        elif index:
+            start = self.mmap.find(b"\n", index) + 1 or size
+        else:
+            start = 0
+
+        if start >= size:
+            return size, size
+
+        end = self.mmap.find(b"\n", start)
+        if end == -1:
+            end = size
+
+        return start, end
+
+    def key_at(self, start, end):
+        """
+        Get the search column of a line as bytes, without decoding the line.
+
+        :param start: start offset of the line
+        :param end: end offset of the line
+
+        :returns: encoded value of the search column, or None if the line has
+            too few columns
+        """
+        for _ in range(self.column):
+            start = self.mmap.find(b"\t", start, end)
+            if start == -1:
+                return None
+            start += 1
+
+        stop = self.mmap.find(b"\t", start, end)
+        if stop == -1:
+            stop = end
+            if stop > start and self.mmap[stop - 1] == 13:  # strip '\r'
+                stop -= 1
+
+        return self.mmap[start:stop]
+
+    def bisect_left(self, key, lo=0):
+        """
+        Find the position of the first tag not less than ``key``.
+
+        Comparable to ``bisect.bisect_left(self, key, lo)``, but compares
+        encoded keys directly against the memory mapped file, so no line needs
+        to be decoded and no ``Tag`` needs to be created during the search.
+
+        :param key: encoded search key, folded to upper case if the file is
+            sorted case-insensitively
+        :param lo: byte offset to start searching at, i.e. the result of a
+            previous search for a smaller key
+
+        :returns: byte offset to be passed to ``__getitem__``
+        """
+        hi = len(self.mmap)
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start, end = self.line_bounds(mid)
+            value = self.key_at(start, end) if start < end else None
+            if value is not None and self.foldcase:
+                value = value.upper()
+            if value is not None and value < key:
+                lo = mid + 1
             else:
-                result = self[left_index]
-                while result.line and result[result.column].startswith(key):
-                    yield result
-                    result = Tag(self.mmap.readline().strip(), self.column)
+                hi = mid
+
+        return lo
 
     def search_by_suffix(self, suffix):
         """
@@ -597,7 +2821,22 @@ class TagFile(object):
         """
         filters = kw.get("filters", [])
         return parse_tag_lines(
-            self.search(True, *tags), tag_class=self.tag_class(), filters=filters
+            self.search(True, *tags),
+            tag_class=self.tag_class(),
+            filters=filters,
+            fields=kw.get("fields"),
+        )
+
+    def iter_tags(self, *tags, **kw):
+        """
+        Return the tags from a tag file as a stream, in order of the file.
+        """
+        filters = kw.get("filters", [])
+        return iter_tags(
+            self.search(True, *tags),
+            tag_class=self.tag_class(),
+            filters=filters,
+            fields=kw.get("fields"),
         )
 
     def get_tags_dict_by_suffix(self, suffix, **kw):
@@ -606,5 +2845,130 @@ class TagFile(object):
         """
         filters = kw.get("filters", [])
         return parse_tag_lines(
-            self.search_by_suffix(suffix), tag_class=self.tag_class(), filters=filters
+            self.search_by_suffix(suffix),
+            tag_class=self.tag_class(),
+            filters=filters,
+            fields=kw.get("fields"),
+        )
+
+
+class MultiTagFile(object):
+    """
+    Model several tag files as one.
+
+    Used for windows with several folders, each with its own tag file. Every
+    search is a search of each tag file, whose results are merged in order
+    of the searched column. Tag files listed more than once, e.g. via
+    symlinks, are only searched once. Tags found in several tag files, e.g.
+    of nested folders, are only returned once.
+    """
+
+    def __init__(self, tag_files):
+        """
+        Initialise object.
+
+        :param tag_files: list of ``TagFile`` objects, all searching on the
+            same column
+
+        :returns: None
+        """
+        self.tag_files = []
+
+        seen = set()
+        for tag_file in tag_files:
+            real_path = os.path.normcase(os.path.realpath(tag_file.path))
+            if real_path not in seen:
+                seen.add(real_path)
+                self.tag_files.append(tag_file)
+
+        self.column = self.tag_files[0].column if self.tag_files else SYMBOL
+
+    def __enter__(self):
+        """
+        Open files using the ``with`` keyword
+        """
+        self.open()
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        """
+        Close files on exit when using ``with`` keyword.
+        """
+        self.close()
+
+    def open(self):
+        """
+        Open files.
+        """
+        opened = []
+        try:
+            for tag_file in self.tag_files:
+                tag_file.open()
+                opened.append(tag_file)
+        except Exception:
+            for tag_file in opened:
+                tag_file.close()
+            raise
+
+    def close(self):
+        """
+        Close files.
+        """
+        for tag_file in self.tag_files:
+            tag_file.close()
+
+    @staticmethod
+    def tag_key(tag):
+        """
+        Identify a tag by its source file, symbol and ex command.
+        """
+        path = os.path.normpath(os.path.join(tag.root_dir, tag.filename))
+        return (os.path.normcase(path), tag.symbol, tag.get("ex_command"))
+
+    def merge_dicts(self, results):
+        """
+        Merge the tags dictionaries of several tag files.
+        """
+        merged = {}
+        seen = set()
+
+        for result in results:
+            for name, tags in result.items():
+                for tag in tags:
+                    key = self.tag_key(tag)
+                    if key not in seen:
+                        seen.add(key)
+                        merged.setdefault(name, []).append(tag)
+
+        return merged
+
+    def get_tags_dict(self, *tags, **kw):
+        """
+        Return the tags from all tag files as a dict.
+        """
+        return self.merge_dicts(tf.get_tags_dict(*tags, **kw) for tf in self.tag_files)
+
+    def get_tags_dict_by_suffix(self, suffix, **kw):
+        """
+        Return the tags with the given suffix of all tag files as a dict.
+        """
+        return self.merge_dicts(
+            tf.get_tags_dict_by_suffix(suffix, **kw) for tf in self.tag_files
         )
+
+    def iter_tags(self, *tags, **kw):
+        """
+        Return the tags from all tag files as a stream, in order of the
+        searched column.
+        """
+        column = ("symbol", "filename")[self.column]
+        streams = [tf.iter_tags(*tags, **kw) for tf in self.tag_files]
+
+        # duplicates of nested folders differ in file names relative to their
+        # tag files, e.g. "sub/a.py" and "a.py", so aren't adjacent
+        seen = set()
+        for tag in heapq.merge(*streams, key=lambda tag: tag[column]):
+            key = self.tag_key(tag)
+            if key not in seen:
+                seen.add(key)
+                yield tag
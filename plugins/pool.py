@@ -0,0 +1,43 @@
+"""
+Worker pools for background jobs over many files.
+"""
+
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def can_spawn_processes():
+    """
+    Check if worker processes can be started from this interpreter.
+
+    ``multiprocessing`` starts workers using ``sys.executable``, which is the
+    plugin host rather than a Python interpreter when running in Sublime Text.
+
+    :returns: True if ``sys.executable`` is a Python interpreter
+    """
+    executable = os.path.basename(sys.executable or "").lower()
+    return executable.startswith("python")
+
+
+def create_pool(max_workers=None):
+    """
+    Create a pool of workers.
+
+    Only a Python interpreter, e.g. running the tests, gets worker processes.
+    In Sublime Text, workers are threads of the plugin host, which share its
+    GIL, so only reading files overlaps and the rest of the work is done one
+    worker at a time.
+
+    :param max_workers: maximum number of workers, defaults to the number of
+        CPUs
+
+    :returns: ``ProcessPoolExecutor`` if possible, else ``ThreadPoolExecutor``
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+
+    if can_spawn_processes():
+        return ProcessPoolExecutor(max_workers)
+
+    return ThreadPoolExecutor(max_workers)
@@ -0,0 +1,249 @@
+"""
+A search for references of symbols in indexed source files.
+"""
+
+import mmap
+import os
+import re
+import shutil
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .columns import get_column_index
+from .pool import create_pool
+
+#
+# Contants
+#
+
+# number of source files searched by each task of the pool
+FILES_PER_TASK = 64
+
+# number of source files searched by each run of a search tool
+FILES_PER_RUN = 512
+
+# commands of search tools, which print the lines of files containing a fixed
+# string as a whole word, each line prefixed with the file name, a null byte
+# and the line number
+SEARCH_TOOLS = (
+    (
+        "rg",
+        [
+            "--no-config",
+            "--no-ignore",
+            "--no-messages",
+            "--null",
+            "--with-filename",
+            "--line-number",
+            "--no-heading",
+            "--color=never",
+            "--word-regexp",
+            "--fixed-strings",
+        ],
+    ),
+    ("grep", ["--null", "--with-filename", "--line-number", "-s", "-w", "-F"]),
+)
+
+#
+# Functions
+#
+
+
+def symbol_pattern(symbol):
+    """
+    Create a regex matching a symbol as a whole word.
+    """
+    return re.compile(rb"(?<!\w)" + re.escape(symbol.encode("utf-8")) + rb"(?!\w)")
+
+
+def search_file(path, symbol):
+    """
+    Search a source file for references of a symbol.
+
+    The file is memory-mapped and only matched against the regex of the
+    symbol if it contains the symbol at all, which most files don't.
+
+    :param path: path to the source file
+    :param symbol: symbol to search for
+
+    :returns: list of tuples of the line number and the text of each line
+        containing the symbol
+    """
+    references = []
+
+    with open(path, "rb") as file_:
+        if not os.fstat(file_.fileno()).st_size:  # empty files can't be mapped
+            return references
+
+        with mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            if content.find(symbol.encode("utf-8")) == -1:
+                return references
+
+            line_number, line_start = 1, 0
+            for match in symbol_pattern(symbol).finditer(content):
+                start = content.rfind(b"\n", 0, match.start()) + 1
+                if references and start == line_start:  # same line
+                    continue
+
+                line_number += content[line_start:start].count(b"\n")
+                line_start = start
+
+                end = content.find(b"\n", start)
+                line = content[start : end if end != -1 else len(content)]
+                references.append(
+                    (line_number, line.decode("utf-8", "replace").rstrip("\r"))
+                )
+
+    return references
+
+
+def search_files(paths, symbol):
+    """
+    Search source files for references of a symbol, see ``search_file``.
+
+    Files which can't be read are skipped.
+
+    :returns: list of tuples of the path and the references of each file
+        containing the symbol
+    """
+    result = []
+
+    for path in paths:
+        try:
+            references = search_file(path, symbol)
+        except (OSError, ValueError):
+            continue
+        if references:
+            result.append((path, references))
+
+    return result
+
+
+def find_search_tool():
+    """
+    Find a search tool to run as separate process.
+
+    :returns: command of the first search tool found in ``PATH`` as list, or
+        None if there is none
+    """
+    for name, options in SEARCH_TOOLS:
+        executable = shutil.which(name)
+        if executable:
+            return [executable] + options
+    return None
+
+
+def run_search_tool(tool, paths, symbol):
+    """
+    Search source files for references of a symbol with a search tool.
+
+    :param tool: command of the search tool, see ``find_search_tool``
+    :param paths: paths to the source files
+    :param symbol: symbol to search for
+
+    :returns: list of tuples of the path and the references of each file
+        containing the symbol, in order of ``paths``, see ``search_files``
+    """
+    kwargs = {}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW
+
+    # exits with 1 if nothing is found, and with 2 if some files can't be
+    # read, which are skipped
+    output = subprocess.run(
+        tool + ["-e", symbol, "--"] + paths,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        **kwargs
+    ).stdout
+
+    references = {}
+    for line in output.splitlines():
+        path, _, rest = line.partition(b"\0")
+        line_number, _, text = rest.partition(b":")
+        if line_number.isdigit():
+            references.setdefault(os.fsdecode(path), []).append(
+                (int(line_number), text.decode("utf-8", "replace").rstrip("\r"))
+            )
+
+    return [(path, references[path]) for path in paths if path in references]
+
+
+def list_indexed_files(tag_files, symbol=None):
+    """
+    List the source files indexed by tag files.
+
+    :param tag_files: paths to tag files
+    :param symbol: symbol whose defining files are listed first
+
+    :returns: list of absolute paths of the files defining ``symbol``, in
+        order of the tag files, followed by all other files in order of path
+    """
+    defining, other = [], []
+    seen = set()
+
+    for tag_file in tag_files:
+        index = get_column_index(tag_file)
+        root_dir = os.path.dirname(tag_file)
+
+        rows = index.select(symbols=[symbol])[0] if symbol else []
+        file_ids = {index.columns["file"][row] for row in rows}
+
+        for file_id, filename in enumerate(index.tables["file"]):
+            path = os.path.normpath(os.path.join(root_dir, filename))
+            if path not in seen:
+                seen.add(path)
+                (defining if file_id in file_ids else other).append(path)
+
+    return defining + sorted(other)
+
+
+def search_references(tag_files, symbol, max_workers=None, on_progress=None):
+    """
+    Search the source files indexed by tag files for references of a symbol.
+
+    Files are searched in batches by ``rg`` or ``grep`` if either is found,
+    running in parallel as separate processes. Otherwise they are searched
+    by a pool of workers, see ``create_pool``, which are threads sharing the
+    GIL in Sublime Text. Results are streamed in order of
+    ``list_indexed_files`` as soon as they are available. Batches which are
+    still pending are cancelled when the generator is closed.
+
+    :param tag_files: paths to tag files
+    :param symbol: symbol to search for
+    :param max_workers: maximum number of workers
+    :param on_progress: callback receiving the number of searched and total
+        source files whenever a batch of files has been searched
+
+    :returns: generator of tuples of the path and the references of each
+        file containing the symbol, see ``search_file``
+    """
+    paths = list_indexed_files(tag_files, symbol)
+    tool = find_search_tool()
+
+    if tool:
+        # the tools run in parallel, while threads just wait for them
+        size = FILES_PER_RUN
+        pool = ThreadPoolExecutor(max_workers or os.cpu_count() or 1)
+        search, args = run_search_tool, (tool,)
+    else:
+        size = FILES_PER_TASK
+        pool = create_pool(max_workers)
+        search, args = search_files, ()
+
+    batches = [paths[i : i + size] for i in range(0, len(paths), size)]
+
+    with pool:
+        futures = [pool.submit(search, *args, batch, symbol) for batch in batches]
+
+        try:
+            for done, future in enumerate(futures, start=1):
+                yield from future.result()
+
+                if on_progress:
+                    on_progress(min(done * size, len(paths)), len(paths))
+        finally:
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,166 @@
+"""
+Persistent snapshots of the caches built from tag files.
+
+Snapshots are pickled, so they are only stored in and loaded from
+``snapshot_dir``, a directory of the user rather than of the project. Files
+of a cloned project can't be loaded as snapshots that way.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+
+from sys import intern
+
+from . import __version__
+from .ctags import get_generation, intern_tag, replace_file
+
+#
+# Contants
+#
+
+# version of the snapshot format, part of the header of each snapshot
+SNAPSHOT_VERSION = 2
+
+# maximum length of the header line of a snapshot
+MAX_HEADER_SIZE = 64 * 1024
+
+# directory to store snapshots in, e.g. in ``sublime.cache_path()``. No
+# snapshots are used until it is set
+snapshot_dir = None
+
+#
+# Functions
+#
+
+
+def snapshot_path(tag_file, name):
+    """
+    Get the path of a snapshot of a tag file.
+
+    :param tag_file: path to the tag file
+    :param name: name of the cache, e.g. ``completions``
+
+    :returns: path of the snapshot in ``snapshot_dir``, or None if it isn't
+        set
+    """
+    if not snapshot_dir:
+        return None
+
+    key = os.path.normcase(os.path.realpath(tag_file))
+    digest = hashlib.sha1(key.encode("utf-8", "surrogateescape")).hexdigest()
+    return os.path.join(snapshot_dir, "%s_%s" % (digest, name))
+
+
+def snapshot_header(tag_file, generation):
+    """
+    Create the header identifying the contents of a snapshot.
+
+    The header is a line of JSON, so it is checked without unpickling
+    anything.
+
+    :returns: header as bytes
+    """
+    header = [
+        SNAPSHOT_VERSION,
+        __version__,
+        generation,
+        os.path.normcase(os.path.realpath(tag_file)),
+    ]
+    return json.dumps(header).encode("utf-8") + b"\n"
+
+
+def load_snapshot(tag_file, name):
+    """
+    Load a snapshot of a cache of a tag file.
+
+    Only the header is read if the snapshot was taken of another generation
+    of the tag file or by another version of the plugin.
+
+    :param tag_file: path to the tag file
+    :param name: name of the cache
+
+    :returns: the cached data, or None if there is no valid snapshot
+    """
+    path = snapshot_path(tag_file, name)
+    generation = get_generation(tag_file)
+    if path is None or generation is None:
+        return None
+
+    try:
+        with open(path, "rb") as file_:
+            if file_.readline(MAX_HEADER_SIZE) != snapshot_header(tag_file, generation):
+                return None
+            return pickle.load(file_)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+
+def save_snapshot(tag_file, name, data, generation):
+    """
+    Save a snapshot of a cache of a tag file.
+
+    The snapshot is written to a temporary file first, so readers never see
+    a partial snapshot. Failures are ignored, as snapshots only speed up
+    loading the cache.
+
+    :param tag_file: path to the tag file
+    :param name: name of the cache
+    :param data: picklable data of the cache
+    :param generation: generation of the tag file the data was created from
+
+    :returns: True if the snapshot was saved, else False
+    """
+    path = snapshot_path(tag_file, name)
+    if path is None or generation is None:
+        return False
+
+    temp_file = path + ".tmp"
+
+    try:
+        os.makedirs(snapshot_dir, exist_ok=True)
+        with open(temp_file, "wb") as file_:
+            file_.write(snapshot_header(tag_file, generation))
+            pickle.dump(data, file_, pickle.HIGHEST_PROTOCOL)
+        replace_file(temp_file, path)
+    except (OSError, pickle.PicklingError):
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        return False
+
+    return True
+
+
+def dump_tags(tags):
+    """
+    Convert parsed tags to plain, picklable dictionaries.
+
+    :param tags: list of tag objects or dict of lists of tag objects, keyed
+        by symbol
+
+    :returns: list of dicts or dict of lists of dicts
+    """
+    if isinstance(tags, dict):
+        return {symbol: [dict(tag) for tag in tags[symbol]] for symbol in tags}
+    return [dict(tag) for tag in tags]
+
+
+def restore_tags(tags, tag_class):
+    """
+    Convert plain dictionaries back to tag objects, see ``dump_tags``.
+
+    Repeated elements of the tags are shared with those of parsed tags, see
+    ``intern_tag``.
+
+    :param tags: list of dicts or dict of lists of dicts
+    :param tag_class: class to wrap the tags in
+
+    :returns: list of tag objects or dict of lists of tag objects
+    """
+    if isinstance(tags, dict):
+        return {
+            intern(symbol): [tag_class(intern_tag(tag)) for tag in tags[symbol]]
+            for symbol in tags
+        }
+    return [tag_class(intern_tag(tag)) for tag in tags]
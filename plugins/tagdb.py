@@ -0,0 +1,433 @@
+"""
+A SQLite-backed alternative to ``TagFile``.
+"""
+
+import os
+import sqlite3
+import string
+
+from .ctags import (
+    FILENAME,
+    SYMBOL,
+    TAGS_RE,
+    Tag,
+    TagFile,
+    get_generation,
+    process_fields,
+)
+
+#
+# Contants
+#
+
+# tag fields naming the parent scope of a tag, in order of preference
+SCOPE_FIELDS = (
+    "class",
+    "struct",
+    "union",
+    "enum",
+    "interface",
+    "namespace",
+    "module",
+    "function",
+    "scope",
+)
+
+# version of the database format, databases of other versions are rebuilt
+DATABASE_VERSION = "2"
+
+# folds ASCII letters to upper case, as ``TagFile`` does when searching
+# case-insensitively, so both backends find the same tags
+FOLDCASE_TABLE = str.maketrans(string.ascii_lowercase, string.ascii_uppercase)
+
+# upper bound of any string starting with a given prefix
+PREFIX_END = "\U0010ffff"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS tags (
+    id INTEGER PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    symbol_fold TEXT NOT NULL,
+    symbol_rev TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    filename_rev TEXT NOT NULL,
+    kind TEXT,
+    scope TEXT,
+    line TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tags_symbol ON tags (symbol);
+CREATE INDEX IF NOT EXISTS tags_symbol_fold ON tags (symbol_fold);
+CREATE INDEX IF NOT EXISTS tags_symbol_rev ON tags (symbol_rev);
+CREATE INDEX IF NOT EXISTS tags_filename ON tags (filename);
+CREATE INDEX IF NOT EXISTS tags_filename_rev ON tags (filename_rev);
+CREATE INDEX IF NOT EXISTS tags_kind ON tags (kind);
+CREATE INDEX IF NOT EXISTS tags_scope ON tags (scope);
+"""
+
+# searchable column names by tag file column index
+COLUMNS = {
+    SYMBOL: "symbol",
+    FILENAME: "filename",
+}
+
+#
+# Functions
+#
+
+
+def tag_row(line):
+    """
+    Convert a tag line to a row of the ``tags`` table.
+
+    :param line: tag line from a tagfile
+
+    :returns: tuple of column values, or None if ``line`` is not a valid tag
+    """
+    line = line.rstrip("\r\n")
+
+    search_obj = TAGS_RE.search(line)
+    if not search_obj:
+        return None
+
+    tag = search_obj.groupdict()
+    fields = process_fields(tag)
+
+    scope = None
+    for field in SCOPE_FIELDS:
+        if fields.get(field):
+            scope = fields[field]
+            break
+
+    symbol = tag["symbol"]
+    filename = tag["filename"]
+
+    return (
+        symbol,
+        symbol.translate(FOLDCASE_TABLE),
+        symbol[::-1],
+        filename,
+        filename[::-1],
+        tag["type"],
+        scope,
+        line,
+    )
+
+
+def read_signature(connection):
+    """
+    Read the signature of the tag file a database was built of.
+
+    :param connection: connection to the database
+
+    :returns: signature, or None if the database is empty or of another
+        ``DATABASE_VERSION``
+    """
+    meta = dict(connection.execute("SELECT key, value FROM meta"))
+    if meta.get("version") != DATABASE_VERSION:
+        return None
+    return meta.get("source")
+
+
+def source_signature(path):
+    """
+    Get a signature of a tag file to detect outdated databases.
+
+    :param path: path to a tag file
+
+    :returns: generation of the tag file
+    """
+    signature = get_generation(path)
+    if signature is None:
+        raise OSError("Tag file '%s' not found." % path)
+    return signature
+
+
+#
+# Models
+#
+
+
+class TagDatabase(TagFile):
+    """
+    Model a tag file loaded into a SQLite database.
+
+    The database is stored next to the tag file and (re)built from it when
+    missing or outdated. Lookups which require a binary search or a linear
+    scan in ``TagFile`` become indexed queries, and the tags of single files
+    can be replaced without rebuilding the whole database.
+    """
+
+    def __init__(self, path, column, ignore_case=False, build=True):
+        """
+        Initialise object.
+
+        :param path: path to a tag file
+        :param column: column to search on
+        :param ignore_case: search symbols case-insensitively
+        :param build: build the database if it is missing or outdated,
+            else ``open`` fails, see ``is_current``
+
+        :returns: None
+        """
+        TagFile.__init__(self, path, column, ignore_case, build)
+        self.db_path = path + "_db"
+        self.connection = None
+
+    def unsupported(self, *args, **kwargs):
+        """
+        Reject the methods of ``TagFile`` which address the memory mapped tag
+        file by byte offsets. Queries take their place.
+        """
+        raise NotImplementedError("Tag databases are searched by queries.")
+
+    __getitem__ = bisect_left = key_at = line_bounds = scan_many = unsupported
+
+    def __len__(self):
+        """
+        Get number of tags in tag database.
+        """
+        if not self.connection:
+            raise RuntimeError("No tag file open.")
+
+        return self.connection.execute("SELECT COUNT(*) FROM tags").fetchone()[0]
+
+    def open(self):
+        """
+        Open database, building it from the tag file if required.
+        """
+        signature = source_signature(self.path)
+
+        if not self.build and not os.path.isfile(self.db_path):
+            raise OSError("Tag database '%s' not found." % self.db_path)
+
+        if self.connect() != signature:
+            if not self.build:
+                self.close()
+                raise OSError("Tag database '%s' is outdated." % self.db_path)
+            self.load(signature)
+
+    def is_current(self):
+        """
+        Check if the database was built of the current tag file.
+
+        The database is neither created nor changed.
+
+        :returns: True if the database is up to date, else False
+        """
+        if not os.path.isfile(self.db_path):
+            return False
+
+        try:
+            connection = sqlite3.connect(self.db_path)
+            try:
+                signature = read_signature(connection)
+            finally:
+                connection.close()
+        except sqlite3.Error:
+            return False
+
+        return signature is not None and signature == get_generation(self.path)
+
+    def connect(self):
+        """
+        Connect to the database, creating its tables if required.
+
+        :returns: signature of the tag file the database was built of, or
+            None if it is empty or of another ``DATABASE_VERSION``
+        """
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.executescript(SCHEMA)
+
+        return read_signature(self.connection)
+
+    def update(self, diff):
+        """
+        Open database, applying the changes of a rebuilt tag file to it.
+
+        Only the tags of added, removed or changed source files are replaced
+        if the database was built of the version of the tag file the diff is
+        based on. Otherwise the database is rebuilt.
+
+        :param diff: ``TagsDiff`` of the rebuilt tag file
+
+        :returns: None
+        """
+        signature = source_signature(self.path)
+        stored = self.connect()
+
+        if stored == signature:
+            return
+
+        if stored is not None and stored == diff.base:
+            self.update_files(
+                {name: diff.new_lines.get(name, []) for name in diff.files}, signature
+            )
+        else:
+            self.load(signature)
+
+    def prefault(self):
+        """
+        Read the whole database file.
+
+        Makes the operating system load it, so later queries don't have to
+        wait for the disk.
+
+        :returns: size of the database in bytes
+        """
+        if not self.connection:
+            raise RuntimeError("No tag file open.")
+
+        size = 0
+        with open(self.db_path, "rb") as file_:
+            for chunk in iter(lambda: file_.read(1024 * 1024), b""):
+                size += len(chunk)
+
+        return size
+
+    def close(self):
+        """
+        Close database.
+        """
+        if not self.connection:
+            raise RuntimeError("No tag file open.")
+
+        self.connection.close()
+        self.connection = None
+
+    def load(self, signature=None):
+        """
+        Replace all rows of the database with the content of the tag file.
+
+        :param signature: signature of the tag file to store
+
+        :returns: None
+        """
+        if signature is None:
+            signature = source_signature(self.path)
+
+        with open(self.path, encoding="utf-8", errors="replace") as file_:
+            rows = (tag_row(line) for line in file_ if not line.startswith("!_TAG"))
+
+            with self.connection:
+                self.connection.execute("DELETE FROM tags")
+                self.connection.executemany(
+                    "INSERT INTO tags (symbol, symbol_fold, symbol_rev, filename,"
+                    " filename_rev, kind, scope, line) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (row for row in rows if row),
+                )
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    (("source", signature), ("version", DATABASE_VERSION)),
+                )
+
+    def update_files(self, files, signature=None):
+        """
+        Replace the tags of a number of source files.
+
+        :param files: dict of source file names and their new tag lines. An
+            empty list of lines removes all tags of a file.
+        :param signature: signature of the tag file the database is now up
+            to date with, if any
+
+        :returns: None
+        """
+        if not self.connection:
+            raise RuntimeError("No tag file open.")
+
+        with self.connection:
+            for filename, lines in files.items():
+                self.connection.execute(
+                    "DELETE FROM tags WHERE filename = ?", (filename,)
+                )
+                rows = (tag_row(line) for line in lines)
+                self.connection.executemany(
+                    "INSERT INTO tags (symbol, symbol_fold, symbol_rev, filename,"
+                    " filename_rev, kind, scope, line) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (row for row in rows if row),
+                )
+            if signature is not None:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('source', ?)",
+                    (signature,),
+                )
+
+    def query(self, sql, *args):
+        """
+        Run a query returning tag lines.
+
+        :param sql: SQL query selecting the ``line`` column of the tags table
+        :param args: query parameters
+
+        :returns: matching tags
+        """
+        if not self.connection:
+            raise RuntimeError("No tag file open.")
+
+        for (line,) in self.connection.execute(sql, args):
+            yield Tag(line, self.column)
+
+    def search(self, exact_match=True, *tags):
+        """
+        Search for one or more tags in the tag database.
+
+        :param exact_match: if search should be an exact or partial match
+
+        :returns: matching tags
+        """
+        column = COLUMNS[self.column]
+
+        if self.ignore_case and self.column == SYMBOL:
+            column = "symbol_fold"
+            tags = [key.translate(FOLDCASE_TABLE) for key in tags]
+
+        if not tags:
+            yield from self.query("SELECT line FROM tags ORDER BY id")
+            return
+
+        for key in tags:
+            if exact_match:
+                yield from self.query(
+                    "SELECT line FROM tags WHERE %s = ? ORDER BY id" % column, key
+                )
+            else:
+                yield from self.query(
+                    "SELECT line FROM tags WHERE %s >= ? AND %s < ?"
+                    " ORDER BY %s, id" % (column, column, column),
+                    key,
+                    key + PREFIX_END,
+                )
+
+    def search_many(self, keys, exact_match=True):
+        """
+        Search for a batch of tags in the tag database.
+
+        :param keys: iterable of tags to search for
+        :param exact_match: if search should be an exact or partial match
+
+        :returns: tuples of key and matching tag, in order of the sorted keys
+        """
+        for key in sorted(set(keys)):
+            for tag in self.search(exact_match, key):
+                yield key, tag
+
+    def search_by_suffix(self, suffix):
+        """
+        Search for one or more tags with the given suffix in the tag database.
+
+        :param suffix: suffix to search for
+
+        :returns: matching tags
+        """
+        column = COLUMNS[self.column] + "_rev"
+        prefix = suffix[::-1]
+
+        yield from self.query(
+            "SELECT line FROM tags WHERE %s >= ? AND %s < ? ORDER BY id"
+            % (column, column),
+            prefix,
+            prefix + PREFIX_END,
+        )
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+Unit tests for 'columns.py'.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from .. import columns
+from .. import ctags
+from .. import snapshot
+
+
+class ColumnsTest(unittest.TestCase):
+    #
+    # Helper functions
+    #
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.tag_file = os.path.join(self.tmp_dir, "tags")
+
+        with open(self.tag_file, "w", encoding="utf-8") as f:
+            f.writelines(
+                [
+                    "!_TAG_FILE_SORTED\t1\t/0=unsorted, 1=sorted/\n",
+                    'Alpha\ta.py\t/^class Alpha:$/;"\tc\n',
+                    'alpha\ta.py\t/^def alpha():$/;"\tf\tline:3\n',
+                    'beta\tb.py\t7;"\tkind:function\taccess:private\n',
+                    'gamma\tb.py\t/^gamma = 1$/;"\tv\n',
+                ]
+            )
+
+        self.snapshot_dir = snapshot.snapshot_dir
+        snapshot.snapshot_dir = os.path.join(self.tmp_dir, "snapshots")
+
+    def tearDown(self):
+        snapshot.snapshot_dir = self.snapshot_dir
+        shutil.rmtree(self.tmp_dir)
+
+    #
+    # Test functions
+    #
+
+    def test_build(self):
+        index = columns.ColumnIndex.build(self.tag_file)
+
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.generation, ctags.get_generation(self.tag_file))
+        self.assertEqual(index.tables["file"], ["a.py", "b.py"])
+        self.assertEqual(list(index.columns["line"]), [0, 3, 7, 0])
+        self.assertEqual(index.kind_counts(), {"c": 1, "f": 1, "function": 1, "v": 1})
+
+    def test_select(self):
+        index = columns.ColumnIndex.build(self.tag_file)
+
+        self.assertEqual(index.select(kinds=["f", "function"]), ([1, 2], []))
+        self.assertEqual(index.select(files=["b.py"]), ([2, 3], []))
+        self.assertEqual(
+            index.select(filters=[{"access": "private"}, {"symbol": "^A"}]),
+            ([1, 3], []),
+        )
+        self.assertEqual(
+            index.select(kinds=["v"], filters=[{"ex_command": "x", "type": "c"}]),
+            ([3], [{"ex_command": "x"}]),
+        )
+
+    def test_read_tags(self):
+        index = columns.get_column_index(self.tag_file)
+        rows, _ = index.select(kinds=["c", "v"])
+        tags = index.read_tags(rows, fields=("symbol", "filename"))
+
+        self.assertEqual([tag["symbol"] for tag in tags], ["Alpha", "gamma"])
+        self.assertEqual(tags[1]["filename"], "b.py")
+
+        # the saved index is reused until the tag file changes
+        self.assertIsNotNone(columns.ColumnIndex.load(self.tag_file))
+
+        with open(self.tag_file, "a", encoding="utf-8") as f:
+            f.write('delta\tc.py\t1;"\tv\n')
+
+        self.assertIsNone(index.read_tags(rows))
+        self.assertIsNone(columns.ColumnIndex.load(self.tag_file))
+        self.assertEqual(len(columns.get_column_index(self.tag_file)), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
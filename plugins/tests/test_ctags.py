@@ -5,7 +5,11 @@ Unit tests for 'ctags.py'.
 """
 
 import os
+import shutil
+import sys
 import tempfile
+import threading
+import time
 import unittest
 
 from subprocess import CalledProcessError
@@ -158,6 +162,28 @@ class CTagsTest(unittest.TestCase):
 
         return path
 
+    def build_tag_file(self, lines):
+        """
+        Build a tag file from a list of tag lines.
+
+        :returns: Path to the tag file
+        """
+        with tempfile.NamedTemporaryFile(
+            mode="w", delete=False, encoding="utf-8"
+        ) as temp:
+            temp.writelines(lines)
+
+        return temp.name
+
+    def join_sort_threads(self):
+        """
+        Wait for all sorted copies of tag files to be written.
+        """
+        with ctags.sort_threads_lock:
+            threads = list(ctags.sort_threads.values())
+        for thread in threads:
+            thread.join()
+
     #
     # Test functions
     #
@@ -275,6 +301,302 @@ class CTagsTest(unittest.TestCase):
                 os.remove(path)  # clean up
                 os.remove(tag_file)
 
+    def test_build_ctags__incremental(self):
+        """
+        Test incremental builds only re-index changed source files.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        paths = [os.path.join(tmp_dir, name) for name in ("a.py", "b.py")]
+
+        try:
+            for path, name in zip(paths, ("alpha", "beta")):
+                with open(path, "w", encoding="utf-8") as file_:
+                    file_.write("def {0}():\n\tpass\n".format(name))
+
+            tag_file = ctags.build_ctags(
+                path=tmp_dir, tag_file=".tags", recursive=True, incremental=True
+            )
+            self.assertTrue(os.path.exists(tag_file + "_manifest"))
+
+            # unchanged rebuild doesn't touch the tag file
+            mtime = os.stat(tag_file).st_mtime_ns
+            ctags.build_ctags(
+                path=tmp_dir, tag_file=".tags", recursive=True, incremental=True
+            )
+            self.assertEqual(os.stat(tag_file).st_mtime_ns, mtime)
+
+            os.remove(paths[0])
+            with open(paths[1], "w", encoding="utf-8") as file_:
+                file_.write("def beta():\n\tpass\n\ndef gamma():\n\tpass\n")
+
+            _, diff = ctags.build_ctags(
+                path=tmp_dir,
+                tag_file=".tags",
+                recursive=True,
+                incremental=True,
+                with_diff=True,
+            )
+
+            with open(tag_file, encoding="utf-8") as output:
+                symbols = [
+                    line.split("\t", 1)[0] for line in output if line[:2] != "!_"
+                ]
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEqual(symbols, ["beta", "gamma"])
+        self.assertEqual(diff.removed, {"a.py"})
+        self.assertEqual(diff.changed, {"b.py"})
+
+    def test_build_priority_ctags(self):
+        """
+        Test only the directories of the given files are indexed.
+        """
+        tmp_dir = tempfile.mkdtemp()
+
+        try:
+            for name in ("a.py", "lib/b.py", "other/c.py"):
+                path = os.path.join(tmp_dir, *name.split("/"))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w", encoding="utf-8") as file_:
+                    file_.write("def {0}():\n\tpass\n".format(name[-4]))
+
+            tag_file, diff = ctags.build_priority_ctags(
+                tmp_dir,
+                [os.path.join(tmp_dir, "lib", "b.py"), "/elsewhere/d.py"],
+                tag_file=".tags",
+            )
+
+            with open(tag_file, encoding="utf-8") as output:
+                symbols = [
+                    line.split("\t", 1)[0] for line in output if line[:2] != "!_"
+                ]
+
+            self.assertIsNone(
+                ctags.build_priority_ctags(
+                    tmp_dir, ["/elsewhere/d.py"], tag_file=".tags"
+                )
+            )
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEqual(symbols, ["b"])
+        self.assertEqual(diff.added, {"lib/b.py"})
+
+    def test_run_ctags__cancel(self):
+        """
+        Test cancelling a build kills the running command.
+        """
+        job = ctags.BuildJob()
+        timer = threading.Timer(0.2, job.cancel)
+        timer.start()
+
+        cmd = [ctags.quote(sys.executable), "-c", '"import time; time.sleep(10)"']
+        started = time.monotonic()
+
+        with self.assertRaises(ctags.BuildCancelled):
+            ctags.run_ctags(cmd, tempfile.gettempdir(), job=job)
+
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_build_ctags__cancel(self):
+        """
+        Test cancelled builds remove the partially written tag file.
+        """
+        tmp_dir = tempfile.mkdtemp()
+
+        try:
+            with open(os.path.join(tmp_dir, "a.py"), "w", encoding="utf-8") as file_:
+                file_.write("def a():\n\tpass\n")
+
+            job = ctags.BuildJob()
+            timer = threading.Timer(0.2, job.cancel)
+            timer.start()
+
+            cmd = " ".join(
+                [
+                    ctags.quote(sys.executable),
+                    "-c",
+                    "\"import time; open('.tags.tmp', 'w').write('a'); "
+                    'time.sleep(10)"',
+                ]
+            )
+
+            with self.assertRaises(ctags.BuildCancelled):
+                ctags.build_ctags(
+                    path=tmp_dir, cmd=cmd, tag_file=".tags", recursive=True, job=job
+                )
+
+            names = os.listdir(tmp_dir)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEqual(names, ["a.py"])
+
+    def test_build_ctags__progress(self):
+        """
+        Test builds count the source files opened by ctags.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        reports = []
+
+        try:
+            for name in ("a.py", "b.py", "c.py"):
+                with open(os.path.join(tmp_dir, name), "w", encoding="utf-8") as file_:
+                    file_.write("def {0}():\n\tpass\n".format(name[0]))
+
+            job = ctags.BuildJob(on_progress=lambda job: reports.append(job.files_done))
+            ctags.build_ctags(path=tmp_dir, tag_file=".tags", recursive=True, job=job)
+            size = os.path.getsize(os.path.join(tmp_dir, ".tags"))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertTrue(reports)
+        self.assertEqual((job.files_done, job.files_total), (3, 3))
+        self.assertEqual(job.bytes_done, job.bytes_total)
+        self.assertEqual(job.tag_count, 3)
+        self.assertEqual(job.peak_output, size)
+
+    def test_convert_json_tags(self):
+        """
+        Test converting JSON output of Universal Ctags to a tag file.
+        """
+        json_file = self.build_tag_file(
+            [
+                '{"_type": "ptag", "name": "TAG_FILE_SORTED", "path": "1",'
+                ' "pattern": "0=unsorted, 1=sorted, 2=foldcase"}\n',
+                '{"_type": "ptag", "name": "TAG_KIND_DESCRIPTION",'
+                ' "parserName": "Python", "path": "c,class", "pattern": "classes"}\n',
+                '{"_type": "tag", "name": "method", "path": "a.py",'
+                ' "pattern": "/^\\tdef method(self, a):$/", "line": 2, "kind": "m",'
+                ' "signature": "(self,\\ta)", "scope": "Klass",'
+                ' "scopeKind": "class", "end": 3}\n',
+                '{"_type": "tag", "name": "Klass", "path": "a.py",'
+                ' "pattern": "/^class Klass:$/", "line": 1, "kind": "c",'
+                ' "file": true, "end": 3}\n',
+            ]
+        )
+        tag_file = json_file + ".tags"
+
+        try:
+            with open(json_file, "rb") as stream:
+                groups = ctags.convert_json_tags(stream, tag_file)
+            with open(tag_file, encoding="utf-8") as file_:
+                lines = file_.readlines()
+            tags = ctags.parse_tag_lines(lines)
+        finally:
+            os.remove(json_file)
+            os.remove(tag_file)
+
+        self.assertEqual(
+            lines,
+            [
+                ctags.SORTED_HEADER % ctags.SORTED,
+                "!_TAG_KIND_DESCRIPTION!Python\tc,class\t/classes/\n",
+                'Klass\ta.py\t/^class Klass:$/;"\tc\tline:1\tfile:\tend:3\n',
+                'method\ta.py\t/^\tdef method(self, a):$/;"\tm\tline:2'
+                "\tsignature:(self,\\ta)\tclass:Klass\tend:3\n",
+            ],
+        )
+        self.assertEqual(tags["method"][0]["tag_path"], ("a.py", "Klass", "method"))
+        self.assertEqual(tags["method"][0]["end"], "3")
+        self.assertEqual(groups, {"a.py": sorted(lines[2:], key=ctags.tag_path_key)})
+
+        # the sort key of a record is the one of its tag line
+        line, tag_path = ctags.json_tag(
+            {
+                "name": "x",
+                "path": "a.py",
+                "pattern": "/^x$/",
+                "kind": "v",
+                "scope": "A.B\\C\td",
+                "scopeKind": "class",
+                "file": True,
+            }
+        )
+        self.assertEqual(tag_path, ctags.tag_path_key(line))
+
+    def test_build_job__limits(self):
+        """
+        Test builds exceeding their time or size limits are aborted.
+        """
+        stat = os.stat_result((0,) * 6 + (60,) + (0,) * 3)
+        sources = [("a.py", stat), ("b.py", stat)]
+
+        job = ctags.BuildJob(max_bytes=100)
+        job.add_sources(sources[:1])
+        with self.assertRaises(ctags.BuildAborted):
+            job.add_sources(sources)
+
+        job = ctags.BuildJob(timeout=1)
+        job.started -= 2
+        with self.assertRaises(ctags.BuildAborted):
+            job.check()
+
+    def test_list_source_files(self):
+        """
+        Test source files are listed according to ignore rules.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        files = {
+            ".gitignore": "node_modules/\n*.min.js\n!keep.min.js\n/build\n",
+            "a.py": "",
+            "app.min.js": "",
+            "keep.min.js": "",
+            "build/out.js": "",
+            "lib/build/src.js": "",
+            "lib/.gitignore": "*.tmp\n",
+            "lib/x.tmp": "",
+            "node_modules/dep/index.js": "",
+            "vendor/v.js": "",
+            ".tags": "",
+            ".tags_sorted_by_file": "",
+            ".tags_lang_C++_db-journal": "",
+            ".tags.partial.json": "",
+            ".tags.py": "",
+            "lib/.tags": "",
+            ".git/config": "",
+        }
+
+        try:
+            for name, content in files.items():
+                path = os.path.join(tmp_dir, *name.split("/"))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w", encoding="utf-8") as file_:
+                    file_.write(content)
+
+            tag_file = os.path.join(tmp_dir, ".tags")
+            result = sorted(
+                name
+                for name, _ in ctags.list_source_files(
+                    tmp_dir, tag_file, exclude_patterns=["vendor/"], use_gitignore=True
+                )
+            )
+            flat = sorted(
+                name
+                for name, _ in ctags.list_source_files(
+                    tmp_dir, tag_file, recursive=False
+                )
+            )
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEqual(
+            result,
+            [
+                ".gitignore",
+                ".tags.py",
+                "a.py",
+                "keep.min.js",
+                "lib/.gitignore",
+                "lib/.tags",
+                "lib/build/src.js",
+            ],
+        )
+        self.assertEqual(
+            flat, [".gitignore", ".tags.py", "a.py", "app.min.js", "keep.min.js"]
+        )
+
     # post_process_tag
 
     def test_post_process_tag__line_numbers(self):
@@ -355,7 +677,7 @@ class CTagsTest(unittest.TestCase):
             "ex_command": "\tprivate int getSum(int a, int b) {",
             "type": "m",
             "fields": "class:DemoClass\tfile:",
-            "field_keys": ["class", "file"],
+            "field_keys": ("class", "file"),
             "class": "DemoClass",
             "file": "",
         }
@@ -404,7 +726,7 @@ class CTagsTest(unittest.TestCase):
                     "tag_path": (filename, "MyClass", "address"),
                     "type": "v",
                     "fields": "class:MyClass",
-                    "field_keys": ["class"],
+                    "field_keys": ("class",),
                     "class": "MyClass",
                 }
             ],
@@ -416,7 +738,7 @@ class CTagsTest(unittest.TestCase):
                     "tag_path": (filename, "MyClass", "last_name"),
                     "type": "v",
                     "fields": "class:MyClass",
-                    "field_keys": ["class"],
+                    "field_keys": ("class",),
                     "class": "MyClass",
                 }
             ],
@@ -438,7 +760,7 @@ class CTagsTest(unittest.TestCase):
                     "tag_path": (filename, "MyClass", "my_method"),
                     "type": "m",
                     "fields": "class:MyClass",
-                    "field_keys": ["class"],
+                    "field_keys": ("class",),
                     "class": "MyClass",
                 }
             ],
@@ -490,7 +812,7 @@ class CTagsTest(unittest.TestCase):
                     "tag_path": (filename, "typename", "void", "bar"),
                     "type": "f",
                     "fields": "typeref:typename:void",
-                    "field_keys": ["typeref"],
+                    "field_keys": ("typeref",),
                     "typeref": "typename:void",
                 }
             ],
@@ -502,7 +824,7 @@ class CTagsTest(unittest.TestCase):
                     "tag_path": (filename, "foo"),
                     "type": "d",
                     "fields": "file:",
-                    "field_keys": ["file"],
+                    "field_keys": ("file",),
                     "file": "",
                 }
             ],
@@ -514,7 +836,7 @@ class CTagsTest(unittest.TestCase):
                     "tag_path": (filename, "foobar"),
                     "type": "d",
                     "fields": "file:",
-                    "field_keys": ["file"],
+                    "field_keys": ("file",),
                     "file": "",
                 }
             ],
@@ -528,6 +850,561 @@ class CTagsTest(unittest.TestCase):
         for key in result:  # don't forget - we might have missed something!
             self.assertEqual(expected_outputs[key], result[key])
 
+    def test_parse_tag_lines__fields(self):
+        """
+        Test ``parse_tag_lines`` with a projection of fields.
+        """
+        content = [
+            'Klass\ta.py\t/^class Klass:$/;"\tc\tline:1\n',
+            'method\ta.py\t/^    def method(self):$/;"\tm\tline:2\tclass:Klass\n',
+        ]
+
+        full = ctags.parse_tag_lines(content)
+        result = ctags.parse_tag_lines(
+            content, fields=("ex_command", "line"), tag_class=ctags.TagElements
+        )
+
+        method = result["method"][0]
+        for key in ("symbol", "filename", "ex_command", "type", "line"):
+            self.assertEqual(method[key], full["method"][0][key])
+        self.assertNotIn("tag_path", dict(method))
+        self.assertEqual(method.tag_path, full["method"][0]["tag_path"])
+        self.assertEqual(result["Klass"][0]["tag_path"], ("a.py", "Klass"))
+
+        result = ctags.parse_tag_lines(content, fields=("symbol",))
+        self.assertEqual(sorted(result), ["Klass", "method"])
+        self.assertNotIn("ex_command", result["Klass"][0])
+
+    def test_parse_tag_lines__interning(self):
+        """
+        Test ``parse_tag_lines`` shares repeated elements between tags.
+        """
+        content = [
+            'alpha\ta.py\t/^    def alpha(self):$/;"\tm\tline:2\tclass:Klass\n',
+            'beta\ta.py\t/^    def beta(self):$/;"\tm\tline:4\tclass:Klass\n',
+        ]
+
+        for fields in (None, ("symbol", "tag_path")):
+            result = ctags.parse_tag_lines(content, fields=fields)
+            alpha, beta = result["alpha"][0], result["beta"][0]
+
+            for key in ("filename", "type", "class", "field_keys"):
+                self.assertIs(alpha[key], beta[key])
+            self.assertIs(alpha["tag_path"][1], beta["tag_path"][1])
+
+        # tags created otherwise are shared on demand
+        tag = ctags.intern_tag(
+            {
+                "filename": "".join(["a", ".py"]),
+                "class": "".join(["Kl", "ass"]),
+                "field_keys": ("class", "line"),
+                "tag_path": ("a.py", "".join(["Kl", "ass"]), "gamma"),
+            }
+        )
+        self.assertIs(tag["filename"], alpha["filename"])
+        self.assertIs(tag["class"], alpha["class"])
+        self.assertIs(tag["field_keys"], alpha["field_keys"])
+        self.assertIs(tag["tag_path"][1], alpha["tag_path"][1])
+
+    def test_share_field_keys(self):
+        """
+        Test ``share_field_keys`` shares sorted tuples in a bounded cache.
+        """
+        keys = ctags.share_field_keys(["line", "class"])
+
+        self.assertEqual(keys, ("class", "line"))
+        self.assertIs(ctags.share_field_keys(("class", "line")), keys)
+
+        for i in range(ctags.FIELD_KEYS_CACHE_SIZE + 1):
+            ctags.share_field_keys(["field%d" % i])
+        self.assertLessEqual(len(ctags.field_keys_tuples), ctags.FIELD_KEYS_CACHE_SIZE)
+
+    # resort_ctags
+
+    def test_resort_ctags__tag_path_order(self):
+        """
+        Test ``resort_ctags`` stores tags of a file in display order.
+        """
+        with tempfile.NamedTemporaryFile(
+            mode="w", delete=False, encoding="utf-8"
+        ) as temp:
+            temp.writelines(
+                [
+                    "!_TAG_FILE_SORTED\t1\t/0=unsorted, 1=sorted, 2=foldcase/\n",
+                    'Zeta\tb.py\t/^class Zeta:$/;"\tc\n',
+                    'alpha\tb.py\t/^    def alpha(self):$/;"\tm\tclass:Zeta\n',
+                    'beta\ta.py\t/^def beta():$/;"\tf\n',
+                    'gamma\tb.py\t/^def gamma():$/;"\tf\n',
+                ]
+            )
+            tag_file = temp.name
+
+        try:
+            ctags.resort_ctags(tag_file)
+
+            with open(tag_file + "_sorted_by_file", encoding="utf-8") as output:
+                symbols = [line.split("\t", 1)[0] for line in output]
+        finally:
+            os.remove(tag_file)
+            os.remove(tag_file + "_sorted_by_file")
+
+        self.assertEqual(symbols, ["beta", "Zeta", "alpha", "gamma"])
+
+    def test_resort_ctags__diff(self):
+        """
+        Test ``resort_ctags`` reports the files changed since the last sort.
+        """
+        tag_file = self.build_tag_file(
+            [
+                'alpha\ta.py\t/^def alpha():$/;"\tf\n',
+                'beta\tb.py\t/^def beta():$/;"\tf\n',
+                'gamma\tc.py\t/^def gamma():$/;"\tf\n',
+            ]
+        )
+
+        try:
+            first = ctags.resort_ctags(tag_file)
+
+            with open(tag_file, "w", encoding="utf-8") as file_:
+                file_.writelines(
+                    [
+                        'alpha\ta.py\t/^def alpha():$/;"\tf\n',
+                        'beta\tb.py\t/^def beta(x):$/;"\tf\n',
+                        'delta\td.py\t/^def delta():$/;"\tf\n',
+                    ]
+                )
+
+            second = ctags.resort_ctags(tag_file)
+        finally:
+            os.remove(tag_file)
+            os.remove(tag_file + "_sorted_by_file")
+
+        self.assertEqual(first.added, {"a.py", "b.py", "c.py"})
+        self.assertEqual(second.added, {"d.py"})
+        self.assertEqual(second.removed, {"c.py"})
+        self.assertEqual(second.changed, {"b.py"})
+        self.assertEqual(set(second.old_lines), {"b.py", "c.py"})
+        self.assertEqual(set(second.new_lines), {"b.py", "d.py"})
+
+    # partition_ctags
+
+    def test_partition_ctags(self):
+        """
+        Test ``partition_ctags`` splits a tag file by language.
+        """
+        tag_dir = tempfile.mkdtemp()
+        tag_file = os.path.join(tag_dir, "tags")
+
+        def write(lines):
+            with open(tag_file, "w", encoding="utf-8") as f:
+                f.write("!_TAG_FILE_SORTED\t0\t/0=unsorted, 1=sorted, 2=foldcase/\n")
+                f.writelines(lines)
+
+        write(
+            [
+                'get\tb.py\t/^def get():$/;"\tf\n',
+                'get\ta.js\t/^function get() {$/;"\tf\n',
+                'got\ta.py\t/^def got():$/;"\tf\n',
+                'Get\ta.h\t/^int Get();$/;"\tp\tlanguage:C\n',
+                'get\tREADME\t1;"\tf\n',
+            ]
+        )
+
+        try:
+            languages = ctags.partition_ctags(tag_file)
+            python = ctags.partition_path(tag_file, "Python")
+            with ctags.TagFile(python, ctags.SYMBOL) as tagfile:
+                found = [tag.line for tag in tagfile.search(True, "get")]
+            partitions = ctags.get_partitions(tag_file, ["Python", "Go"])
+            has_c = os.path.exists(ctags.partition_path(tag_file, "C"))
+
+            for name in ("tags_lang_C_sorted_by_symbol", "tags_lang_Python_db"):
+                open(os.path.join(tag_dir, name), "w").close()
+            write(
+                [
+                    'get\tb.py\t/^def get():$/;"\tf\n',
+                    'get\ta.js\t/^function get() {$/;"\tf\n',
+                ]
+            )
+            ctags.partition_ctags(tag_file)
+            kept = sorted(os.listdir(tag_dir))
+
+            write(['get\tb.py\t/^def get():$/;"\tf\n'])
+            stale = ctags.get_partitions(tag_file, ["Python"])
+            ctags.partition_ctags(tag_file)
+            single = ctags.get_partitions(tag_file, ["Python"])
+            names = sorted(os.listdir(tag_dir))
+        finally:
+            shutil.rmtree(tag_dir)
+
+        self.assertEqual(languages, ["C", "JavaScript", "Python"])
+        self.assertEqual(found, ['get\tb.py\t/^def get():$/;"\tf'])
+        self.assertEqual(partitions, [python])
+        self.assertTrue(has_c)
+        self.assertEqual(
+            kept,
+            [
+                "tags",
+                "tags_lang_JavaScript",
+                "tags_lang_Python",
+                "tags_lang_Python_db",
+                "tags_languages",
+            ],
+        )
+        self.assertIsNone(stale)
+        self.assertEqual(single, [tag_file])
+        self.assertEqual(names, ["tags", "tags_languages"])
+
+    # TagFile
+
+    def test_tag_file__search(self):
+        """
+        Test ``TagFile.search`` for exact and prefix matches.
+        """
+        tag_file = self.build_tag_file(
+            [
+                "!_TAG_FILE_SORTED\t1\t/0=unsorted, 1=sorted, 2=foldcase/\n",
+                'get\ta.py\t/^def get():$/;"\tf\n',
+                'get\tb.py\t/^def get():$/;"\tf\n',
+                'get_all\ta.py\t/^def get_all():$/;"\tf\n',
+                'put\ta.py\t/^def put():$/;"\tf\n',
+                '\u00fcber\ta.py\t/^def \u00fcber():$/;"\tf\n',
+            ]
+        )
+
+        try:
+            with ctags.TagFile(tag_file, ctags.SYMBOL) as tagfile:
+                exact = [tag.line.split("\t")[1] for tag in tagfile.search(True, "get")]
+                prefix = [tag.key for tag in tagfile.search(False, "get")]
+                unicode = [tag.key for tag in tagfile.search(True, "\u00fcber")]
+                missing = list(tagfile.search(True, "zzz"))
+        finally:
+            os.remove(tag_file)
+
+        self.assertEqual(exact, ["a.py", "b.py"])
+        self.assertEqual(prefix, ["get", "get", "get_all"])
+        self.assertEqual(unicode, ["\u00fcber"])
+        self.assertEqual(missing, [])
+
+    def test_multi_tag_file(self):
+        """
+        Test ``MultiTagFile`` merges and deduplicates several tag files.
+        """
+        root = tempfile.mkdtemp()
+        nested = os.path.join(root, "lib")
+        os.mkdir(nested)
+
+        for path, lines in (
+            (
+                root,
+                [
+                    'get\ta.py\t/^def get():$/;"\tf\n',
+                    'get\tlib/c.py\t/^def get():$/;"\tf\n',
+                    'put\ta.py\t/^def put():$/;"\tf\n',
+                ],
+            ),
+            (
+                nested,
+                [
+                    'get\tc.py\t/^def get():$/;"\tf\n',
+                    'got\tc.py\t/^def got():$/;"\tf\n',
+                ],
+            ),
+        ):
+            with open(os.path.join(path, "tags"), "w", encoding="utf-8") as f:
+                f.writelines(lines)
+
+        paths = [
+            os.path.join(root, "tags"),
+            os.path.join(nested, "tags"),
+            os.path.join(nested, "..", "tags"),
+        ]
+
+        try:
+            tagfile = ctags.MultiTagFile(
+                [ctags.TagFile(path, ctags.SYMBOL) for path in paths]
+            )
+            with tagfile:
+                tags = tagfile.get_tags_dict("get", "got")
+                stream = [(t.symbol, t.filename) for t in tagfile.iter_tags()]
+
+            by_file = ctags.MultiTagFile(
+                [ctags.TagFile(path, ctags.FILENAME) for path in paths]
+            )
+            with by_file:
+                file_stream = [
+                    (t.symbol, os.path.normpath(os.path.join(t.root_dir, t.filename)))
+                    for t in by_file.iter_tags()
+                ]
+        finally:
+            shutil.rmtree(root)
+
+        self.assertEqual(len(tagfile.tag_files), 2)
+        self.assertEqual(
+            [(t.root_dir, t.filename) for t in tags["get"]],
+            [(root, "a.py"), (root, "lib/c.py")],
+        )
+        self.assertEqual([t.root_dir for t in tags["got"]], [nested])
+        self.assertEqual(
+            stream,
+            [("get", "a.py"), ("get", "lib/c.py"), ("got", "c.py"), ("put", "a.py")],
+        )
+        self.assertEqual(
+            sorted(file_stream),
+            [
+                ("get", os.path.join(root, "a.py")),
+                ("get", os.path.join(nested, "c.py")),
+                ("got", os.path.join(nested, "c.py")),
+                ("put", os.path.join(root, "a.py")),
+            ],
+        )
+
+    def test_tag_file__prefault(self):
+        """
+        Test ``TagFile.prefault`` touches the whole file.
+        """
+        lines = ['sym%d\ta.py\t/^def sym%d():$/;"\tf\n' % (i, i) for i in range(500)]
+        tag_file = self.build_tag_file(lines)
+
+        try:
+            with ctags.TagFile(tag_file, ctags.FILENAME) as tagfile:
+                size = tagfile.prefault()
+                first = next(tagfile.search(True, "a.py"))
+        finally:
+            os.remove(tag_file)
+
+        self.assertEqual(size, len("".join(lines)))
+        self.assertEqual(first.line, lines[0].rstrip("\n"))
+
+    def test_tag_file__search_foldcase(self):
+        """
+        Test ``TagFile.search`` in a case-insensitively sorted tag file.
+        """
+        tag_file = self.build_tag_file(
+            [
+                "!_TAG_FILE_SORTED\t2\t/0=unsorted, 1=sorted, 2=foldcase/\n",
+                'alpha\ta.py\t/^alpha = 1$/;"\tv\n',
+                'Get\ta.py\t/^class Get:$/;"\tc\n',
+                'get\tb.py\t/^def get():$/;"\tf\n',
+                'get_all\ta.py\t/^def get_all():$/;"\tf\n',
+                'Zeta\ta.py\t/^class Zeta:$/;"\tc\n',
+            ]
+        )
+
+        try:
+            with ctags.TagFile(tag_file, ctags.SYMBOL) as tagfile:
+                exact = [tag.key for tag in tagfile.search(True, "get")]
+            with ctags.TagFile(tag_file, ctags.SYMBOL, ignore_case=True) as tagfile:
+                ignore_case = [tag.key for tag in tagfile.search(True, "GET")]
+        finally:
+            os.remove(tag_file)
+
+        self.assertEqual(exact, ["get"])
+        self.assertEqual(ignore_case, ["Get", "get"])
+
+    def test_tag_file__search_unsorted(self):
+        """
+        Test ``TagFile.search`` in unsorted tag files, using sorted copies.
+        """
+        tag_file = self.build_tag_file(
+            [
+                "!_TAG_FILE_SORTED\t0\t/0=unsorted, 1=sorted, 2=foldcase/\n",
+                'zeta\ta.py\t/^zeta = 1$/;"\tv\n',
+                'Get\ta.py\t/^class Get:$/;"\tc\n',
+                'alpha\ta.py\t/^alpha = 1$/;"\tv\n',
+                'get\tb.py\t/^def get():$/;"\tf\n',
+            ]
+        )
+
+        results = []
+        try:
+            # the first searches scan the tag file, the later ones the copies
+            for _ in range(2):
+                with ctags.TagFile(tag_file, ctags.SYMBOL) as tagfile:
+                    exact = [tag.key for tag in tagfile.search(True, "get")]
+                    prefix = [tag.key for tag in tagfile.search(False, "ze", "al")]
+                with ctags.TagFile(tag_file, ctags.SYMBOL, True) as tagfile:
+                    ignore_case = [tag.key for tag in tagfile.search(True, "get")]
+                    scanned = tagfile.scan
+                results.append((exact, prefix, ignore_case, scanned))
+                self.join_sort_threads()
+        finally:
+            os.remove(tag_file)
+            os.remove(tag_file + "_sorted_by_symbol")
+            os.remove(tag_file + "_sorted_foldcase")
+
+        self.assertEqual(
+            results,
+            [
+                (["get"], ["alpha", "zeta"], ["Get", "get"], True),
+                (["get"], ["alpha", "zeta"], ["Get", "get"], False),
+            ],
+        )
+
+    def test_tag_file__search_unsorted__no_build(self):
+        """
+        Test ``TagFile`` doesn't build sorted copies unless asked to.
+        """
+        tag_file = self.build_tag_file(
+            [
+                "!_TAG_FILE_SORTED\t0\t/0=unsorted, 1=sorted, 2=foldcase/\n",
+                'zeta\ta.py\t/^zeta = 1$/;"\tv\n',
+                'alpha\ta.py\t/^alpha = 1$/;"\tv\n',
+            ]
+        )
+
+        try:
+            with ctags.TagFile(tag_file, ctags.SYMBOL, build=False) as tagfile:
+                found = [tag.key for tag in tagfile.search(True, "alpha")]
+            self.join_sort_threads()
+            built = os.path.exists(tag_file + "_sorted_by_symbol")
+        finally:
+            os.remove(tag_file)
+
+        self.assertEqual(found, ["alpha"])
+        self.assertFalse(built)
+
+    def test_sort_ctags__concurrent(self):
+        """
+        Test concurrent sorts of a tag file don't share temporary files.
+        """
+        tag_file = self.build_tag_file(
+            ['%s\ta.py\t/^%s = 1$/;"\tv\n' % (name, name) for name in "zyx" * 100]
+        )
+        sorted_file = tag_file + "_sorted_by_symbol"
+
+        threads = [
+            threading.Thread(target=ctags.sort_ctags, args=(tag_file, sorted_file))
+            for _ in range(4)
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            with ctags.TagFile(sorted_file, ctags.SYMBOL) as tagfile:
+                found = len(list(tagfile.search(True, "x", "y", "z")))
+            leftovers = [
+                name
+                for name in os.listdir(os.path.dirname(tag_file))
+                if name.startswith(os.path.basename(sorted_file) + ".")
+            ]
+        finally:
+            os.remove(tag_file)
+            os.remove(sorted_file)
+
+        self.assertEqual(found, 300)
+        self.assertEqual(leftovers, [])
+
+    def test_replace_file__pending(self):
+        """
+        Test files still opened by readers are replaced once they are closed.
+        """
+        tag_file = self.build_tag_file(["old\n"])
+        new_file = self.build_tag_file(["new\n"])
+        opened = threading.Event()
+        opened.set()
+
+        # emulate Windows, where opened files can't be replaced
+        replace = os.replace
+
+        def replace_unless_opened(src, dst):
+            if dst == tag_file and opened.is_set():
+                raise PermissionError(dst)
+            replace(src, dst)
+
+        interval = ctags.PENDING_RETRY_INTERVAL
+        os.replace = replace_unless_opened
+        ctags.PENDING_RETRY_INTERVAL = 0.01
+
+        try:
+            replaced = ctags.replace_file(new_file, tag_file, retries=2)
+            pending = ctags.is_replacement_pending(tag_file)
+            with open(tag_file, encoding="utf-8") as file_:
+                before = file_.read()
+
+            opened.clear()
+            for _ in range(500):
+                if not ctags.is_replacement_pending(tag_file):
+                    break
+                time.sleep(0.01)
+            with open(tag_file, encoding="utf-8") as file_:
+                after = file_.read()
+        finally:
+            os.replace = replace
+            ctags.PENDING_RETRY_INTERVAL = interval
+            os.remove(tag_file)
+
+        self.assertFalse(replaced)
+        self.assertTrue(pending)
+        self.assertEqual((before, after), ("old\n", "new\n"))
+        self.assertFalse(os.path.exists(tag_file + ".pending"))
+        self.assertFalse(os.path.exists(new_file))
+
+    def test_tag_file__search_across_generations(self):
+        """
+        Test open tag files keep their generation and sorted copies follow it.
+        """
+        header = "!_TAG_FILE_SORTED\t0\t/0=unsorted, 1=sorted, 2=foldcase/\n"
+        tag_file = self.build_tag_file([header, 'old\ta.py\t/^old = 1$/;"\tv\n'])
+        new_file = self.build_tag_file([header, 'new\ta.py\t/^new = 1$/;"\tv\n'])
+
+        try:
+            with ctags.TagFile(tag_file, ctags.SYMBOL) as tagfile:
+                ctags.replace_file(new_file, tag_file)
+                # the sorted copy is newer than the new generation
+                os.utime(tag_file, ns=(0, 0))
+                old = [tag.key for tag in tagfile.search(True, "old", "new")]
+
+            self.join_sort_threads()
+
+            with ctags.TagFile(tag_file, ctags.SYMBOL) as tagfile:
+                new = [tag.key for tag in tagfile.search(True, "old", "new")]
+            self.join_sort_threads()
+        finally:
+            os.remove(tag_file)
+            if os.path.exists(tag_file + "_sorted_by_symbol"):
+                os.remove(tag_file + "_sorted_by_symbol")
+
+        self.assertEqual(old, ["old"])
+        self.assertEqual(new, ["new"])
+
+    def test_tag_file__search_many(self):
+        """
+        Test ``TagFile.search_many`` resolves a batch of keys in key order.
+        """
+        tag_file = self.build_tag_file(
+            [
+                'alpha\ta.py\t/^alpha = 1$/;"\tv\n',
+                'beta\ta.py\t/^beta = 1$/;"\tv\n',
+                'beta\tb.py\t/^beta = 1$/;"\tv\n',
+                'delta\ta.py\t/^delta = 1$/;"\tv\n',
+                'gamma\ta.py\t/^gamma = 1$/;"\tv\n',
+            ]
+        )
+
+        try:
+            with ctags.TagFile(tag_file, ctags.SYMBOL) as tagfile:
+                result = [
+                    (key, tag.key)
+                    for key, tag in tagfile.search_many(
+                        ["gamma", "missing", "beta", "alpha", "beta"]
+                    )
+                ]
+        finally:
+            os.remove(tag_file)
+
+        self.assertEqual(
+            result,
+            [
+                ("alpha", "alpha"),
+                ("beta", "beta"),
+                ("beta", "beta"),
+                ("gamma", "gamma"),
+            ],
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -8,6 +8,8 @@ import os
 import sys
 import shutil
 import tempfile
+import threading
+import time
 import unittest
 
 from .. import cmds
@@ -100,6 +102,19 @@ class CTagsPluginTest(unittest.TestCase):
         """
         shutil.rmtree(path)
 
+    def build_tag_file(self, lines):
+        """
+        Build a tag file from a list of tag lines.
+
+        :returns: Path to the tag file
+        """
+        with tempfile.NamedTemporaryFile(
+            mode="w", delete=False, encoding="utf-8"
+        ) as temp:
+            temp.writelines(lines)
+
+        return temp.name
+
     def remove_tmp_files(self, paths):
         """
         Remove temporary files made by ``make_x_file``
@@ -220,6 +235,260 @@ class CTagsPluginTest(unittest.TestCase):
 
         self.assertIn(result, relative_paths)
 
+    # update_tags_cache
+
+    def test_update_tags_cache(self):
+        old_groups = {
+            "a.py": ['alpha\ta.py\t/^def alpha():$/;"\tf\n'],
+            "b.py": ['beta\tb.py\t/^def beta():$/;"\tf\n'],
+            "c.py": ['gamma\tc.py\t/^def gamma():$/;"\tf\n'],
+        }
+        new_groups = {
+            "a.py": ['alpha\ta.py\t/^def alpha():$/;"\tf\n'],
+            "b.py": ['beta2\tb.py\t/^def beta2():$/;"\tf\n'],
+            "d.py": ['delta\td.py\t/^def delta():$/;"\tf\n'],
+        }
+        tag_class = ctags.TagFile("/tmp/tags", ctags.FILENAME).tag_class()
+
+        def parse(groups, *names):
+            lines = [line for name in names for line in groups[name]]
+            return list(ctags.iter_tags(lines, tag_class=tag_class))
+
+        cache = {
+            ("multi", None): ([], parse(old_groups, "a.py", "b.py", "c.py")),
+            ("file", "b.py"): ([], ctags.parse_tag_lines(old_groups["b.py"])),
+            ("file", "c.py"): ([], ctags.parse_tag_lines(old_groups["c.py"])),
+        }
+
+        diff = ctags.TagsDiff(old_groups, new_groups)
+        cmds.update_tags_cache(cache, diff, tag_class)
+
+        self.assertEqual(
+            [tag.symbol for tag in cache[("multi", None)][1]],
+            ["alpha", "beta2", "delta"],
+        )
+        self.assertEqual(list(cache[("file", "b.py")][1]), ["beta2"])
+        self.assertNotIn(("file", "c.py"), cache)
+
+    # update_completions
+
+    def test_update_completions(self):
+        tag_file = self.build_tag_file(
+            [
+                'alpha\ta.py\t1;"\tf\n',
+                'beta\ta.py\t2;"\tf\n',
+                'beta\tb.py\t2;"\tf\tsignature:(x)\n',
+            ]
+        )
+        completions = cmds.load_completions(tag_file)
+        self.remove_tmp_files([tag_file])
+        diff = ctags.TagsDiff(
+            {"a.py": ['alpha\ta.py\t1;"\tf\n', 'beta\ta.py\t2;"\tf\n']},
+            {"a.py": ['gamma\ta.py\t1;"\tv\n']},
+        )
+
+        cmds.update_completions(completions, cmds.diff_completions(diff))
+
+        self.assertEqual(
+            completions,
+            {
+                "beta": cmds.Counter({("b.py", "f", "(x)"): 1}),
+                "gamma": cmds.Counter({("a.py", "v", ""): 1}),
+            },
+        )
+
+    def test_update_caches__completions(self):
+        lines = ['alpha\ta.py\t1;"\tf\n', 'beta\ta.py\t2;"\tf\n']
+        tag_file = self.build_tag_file(lines)
+        completions = cmds.load_completions(tag_file)
+        cmds.ctags_completions[tag_file] = completions
+        diff = ctags.TagsDiff({"a.py": lines}, {"a.py": ['alpha\ta.py\t1;"\tv\n']})
+        setting = cmds.setting
+        cmds.setting = lambda key, default=None: default
+
+        try:
+            cmds.RebuildTags.update_caches(tag_file, diff)
+            updated = cmds.ctags_completions[tag_file]
+        finally:
+            cmds.setting = setting
+            del cmds.ctags_completions[tag_file]
+            self.remove_tmp_files([tag_file])
+
+        # the cached completions are replaced, not modified
+        self.assertEqual(
+            completions,
+            {
+                "alpha": cmds.Counter({("a.py", "f", ""): 1}),
+                "beta": cmds.Counter({("a.py", "f", ""): 1}),
+            },
+        )
+        self.assertEqual(updated, {"alpha": cmds.Counter({("a.py", "v", ""): 1})})
+
+    # rank_completions
+
+    def test_rank_completions(self):
+        tag_file = self.build_tag_file(
+            [
+                'Beta\tlib/other.py\t1;"\tc\n',
+                'alpha\tsrc/a.py\t1;"\tf\tsignature:(x)\n',
+                'alpha\tsrc/b.py\t1;"\tf\tsignature:(y)\n',
+                'apple\tlib/other.py\t1;"\tv\n',
+                'axe\tsrc/c.py\t1;"\tv\n',
+                'banana\tsrc/b.py\t1;"\tv\n',
+            ]
+        )
+        completions = cmds.load_completions(tag_file)
+        self.remove_tmp_files([tag_file])
+
+        other = {"apple": cmds.Counter({("apple.py", "f", ""): 1})}
+
+        self.assertEqual(
+            cmds.rank_completions(
+                [(completions, os.path.join("src", "b.py")), (other, None)], "A"
+            ),
+            [
+                ("alpha", "src/b.py", "f", "(y)"),
+                ("axe", "src/c.py", "v", ""),
+                ("apple", "lib/other.py", "v", ""),
+            ],
+        )
+        self.assertEqual(
+            cmds.rank_completions([(other, "apple.py"), (completions, None)], "ap"),
+            [("apple", "apple.py", "f", "")],
+        )
+        self.assertEqual(
+            [c[0] for c in cmds.rank_completions([(completions, "x.py")], "b", 1)],
+            ["banana"],
+        )
+
+    # CTagsAutoComplete
+
+    def test_auto_complete_query__superseded(self):
+        cache = cmds.ctags_completions.copy()
+        cmds.ctags_completions["tags"] = {"alpha": cmds.Counter({("a.py", "f", ""): 1})}
+        query = cmds.CTagsAutoComplete.query
+        query_id = cmds.CTagsAutoComplete.query_id
+        setting = cmds.setting
+        cmds.setting = lambda key, default=None: default
+
+        try:
+            self.assertEqual(len(query([("tags", None)], "a", query_id)), 1)
+            self.assertEqual(query([("tags", None)], "a", query_id - 1), [])
+        finally:
+            cmds.setting = setting
+            cmds.ctags_completions.clear()
+            cmds.ctags_completions.update(cache)
+
+    # remember_jump
+
+    def test_remember_jump(self):
+        tag_class = ctags.TagFile("/tmp/tags", ctags.FILENAME).tag_class()
+        content = [
+            'alpha\ta.py\t/^def alpha():$/;"\tf\n',
+            'alpha\ta.py\t/^def alpha(x):$/;"\tf\n',
+            'alpha\tb.py\t/^def alpha():$/;"\tf\n',
+        ]
+        first, moved, other = ctags.iter_tags(content, tag_class=tag_class)
+
+        self.assertTrue(cmds.is_same_definition(first, moved))
+        self.assertFalse(cmds.is_same_definition(first, other))
+
+        history = cmds.jump_history.copy()
+        try:
+            cmds.jump_history.clear()
+            for i in range(cmds.JUMP_HISTORY_SIZE + 1):
+                cmds.remember_jump(("alpha", "", str(i)), ("1:1:1",), first)
+            cmds.remember_jump(("alpha", "", "1"), ("1:2:1",), other)
+
+            self.assertEqual(len(cmds.jump_history), cmds.JUMP_HISTORY_SIZE)
+            self.assertNotIn(("alpha", "", "0"), cmds.jump_history)
+            self.assertEqual(
+                cmds.jump_history.popitem(), (("alpha", "", "1"), (("1:2:1",), other))
+            )
+        finally:
+            cmds.jump_history.clear()
+            cmds.jump_history.update(history)
+
+    def test_get_hover_tags(self):
+        cache = cmds.hover_cache.copy()
+        cmds.hover_cache.clear()
+        lookups = []
+
+        def find_tags(symbol):
+            lookups.append(symbol)
+            return [symbol]
+
+        try:
+            for i in range(cmds.HOVER_CACHE_SIZE):
+                key = ("tags", ("1:2:1",), "sym%d" % i)
+                cmds.get_hover_tags(key, lambda: find_tags(key[2]))
+
+            # hits don't look up the tags again, and keep them cached
+            key = ("tags", ("1:2:1",), "sym0")
+            self.assertEqual(cmds.get_hover_tags(key, None), ["sym0"])
+
+            key = ("tags", ("1:2:1",), "new")
+            self.assertEqual(
+                cmds.get_hover_tags(key, lambda: find_tags("new")), ["new"]
+            )
+            self.assertEqual(lookups[-1], "new")
+
+            self.assertEqual(len(cmds.hover_cache), cmds.HOVER_CACHE_SIZE)
+            self.assertIn(("tags", ("1:2:1",), "sym0"), cmds.hover_cache)
+            self.assertNotIn(("tags", ("1:2:1",), "sym1"), cmds.hover_cache)
+            self.assertEqual(len(lookups), cmds.HOVER_CACHE_SIZE + 1)
+        finally:
+            cmds.hover_cache.clear()
+            cmds.hover_cache.update(cache)
+
+    def test_hover_preview__is_current(self):
+        hover_id = cmds.CTagsHoverPreview.hover_id
+        now = time.time()
+
+        self.assertTrue(cmds.CTagsHoverPreview.is_current(hover_id, now + 10))
+        self.assertFalse(cmds.CTagsHoverPreview.is_current(hover_id, now - 1))
+        self.assertFalse(cmds.CTagsHoverPreview.is_current(hover_id - 1, now + 10))
+
+    def test_hover_preview__submit(self):
+        started, release, done = threading.Event(), threading.Event(), threading.Event()
+        lookups = []
+
+        def lookup(name):
+            lookups.append(name)
+            if name == "first":
+                started.set()
+                release.wait(5)
+            elif name == "last":
+                done.set()
+
+        submit = cmds.CTagsHoverPreview.submit
+        submit(lambda: lookup("first"))
+        self.assertTrue(started.wait(5))
+
+        # hovers while a lookup is running replace each other
+        submit(lambda: lookup("second"))
+        submit(lambda: lookup("last"))
+        release.set()
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual(lookups, ["first", "last"])
+
+    def test_load_module(self):
+        from .. import tagdb
+
+        self.assertIs(cmds.load_module("tagdb"), tagdb)
+        self.assertRaises(ValueError, cmds.load_module, "ctags")
+
+    def test_format_progress(self):
+        job = ctags.BuildJob()
+        job.started -= 10
+        job.files_total, job.files_done = 200, 50
+        job.bytes_total, job.bytes_done = 4 * 1024 * 1024, 1024 * 1024
+
+        self.assertEqual(
+            cmds.format_progress(job), "50/200 files, 5 files/s, 1.0 MB, ETA 0:30"
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
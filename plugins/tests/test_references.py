@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+Unit tests for 'references.py'.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from .. import references
+
+
+class ReferencesTest(unittest.TestCase):
+    #
+    # Helper functions
+    #
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        sources = {
+            "a.py": "import b\n\nb.my_func(my_func_2)\nmy_func()  # my_func\n",
+            "b.py": "def my_func():\n\tpass\r\n",
+            "c.py": "",
+            "d.py": "x = 1\n",
+        }
+        for name, content in sources.items():
+            with open(os.path.join(self.tmp_dir, name), "w", newline="") as f:
+                f.write(content)
+
+        self.tag_file = os.path.join(self.tmp_dir, "tags")
+        with open(self.tag_file, "w", encoding="utf-8") as f:
+            f.writelines(
+                [
+                    "!_TAG_FILE_SORTED\t1\t/0=unsorted, 1=sorted, 2=foldcase/\n",
+                    'gone\tgone.py\t/^def gone():$/;"\tf\n',
+                    'my_func\tb.py\t/^def my_func():$/;"\tf\n',
+                    'x\td.py\t/^x = 1$/;"\tv\n',
+                    'y\tc.py\t1;"\tv\n',
+                    'z\ta.py\t1;"\tv\n',
+                ]
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir, name)
+
+    #
+    # Test functions
+    #
+
+    def test_search_file(self):
+        self.assertEqual(
+            references.search_file(self.path("a.py"), "my_func"),
+            [(3, "b.my_func(my_func_2)"), (4, "my_func()  # my_func")],
+        )
+        self.assertEqual(
+            references.search_file(self.path("b.py"), "my_func"),
+            [(1, "def my_func():")],
+        )
+        self.assertEqual(references.search_file(self.path("c.py"), "my_func"), [])
+        self.assertEqual(references.search_file(self.path("a.py"), "my_fun"), [])
+
+    @unittest.skipUnless(references.find_search_tool(), "requires rg or grep")
+    def test_run_search_tool(self):
+        paths = [self.path(name) for name in ("b.py", "a.py", "c.py", "gone.py")]
+
+        self.assertEqual(
+            references.run_search_tool(references.find_search_tool(), paths, "my_func"),
+            references.search_files(paths, "my_func"),
+        )
+
+    def test_list_indexed_files(self):
+        self.assertEqual(
+            references.list_indexed_files([self.tag_file], "my_func"),
+            [self.path(name) for name in ("b.py", "a.py", "c.py", "d.py", "gone.py")],
+        )
+
+    def test_search_references(self):
+        progress = []
+
+        def on_progress(done, total):
+            progress.append((done, total))
+
+        result = list(
+            references.search_references(
+                [self.tag_file, self.tag_file], "my_func", 2, on_progress
+            )
+        )
+
+        self.assertEqual(
+            [(os.path.basename(path), len(refs)) for path, refs in result],
+            [("b.py", 1), ("a.py", 2)],
+        )
+        self.assertEqual(progress, [(5, 5)])
+
+    def test_search_references__close(self):
+        searched = []
+
+        def search(*args):
+            paths = args[-2]
+            searched.extend(paths)
+            time.sleep(0.05)
+            return [(path, [(1, "")]) for path in paths]
+
+        saved = references.find_search_tool, references.run_search_tool
+        saved_size = references.FILES_PER_RUN
+        references.find_search_tool = lambda: ["rg"]
+        references.run_search_tool = search
+        references.FILES_PER_RUN = 1
+
+        try:
+            results = references.search_references([self.tag_file], "my_func", 1)
+            next(results)
+            results.close()
+        finally:
+            references.find_search_tool, references.run_search_tool = saved
+            references.FILES_PER_RUN = saved_size
+
+        # pending batches are cancelled, so at most the next one was searched
+        self.assertLessEqual(len(searched), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
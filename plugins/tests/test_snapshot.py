@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""
+Unit tests for 'snapshot.py'.
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from .. import ctags
+from .. import snapshot
+
+
+class SnapshotTest(unittest.TestCase):
+    #
+    # Helper functions
+    #
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.tag_file = os.path.join(self.tmp_dir, "tags")
+
+        with open(self.tag_file, "w", encoding="utf-8") as f:
+            f.write('alpha\ta.py\t/^def alpha():$/;"\tf\n')
+
+        self.snapshot_dir = snapshot.snapshot_dir
+        snapshot.snapshot_dir = os.path.join(self.tmp_dir, "snapshots")
+
+    def tearDown(self):
+        snapshot.snapshot_dir = self.snapshot_dir
+        shutil.rmtree(self.tmp_dir)
+
+    #
+    # Test functions
+    #
+
+    def test_load_snapshot(self):
+        generation = ctags.get_generation(self.tag_file)
+        data = {"alpha": [("a.py", "f", "")]}
+
+        self.assertIsNone(snapshot.load_snapshot(self.tag_file, "completions"))
+        self.assertTrue(
+            snapshot.save_snapshot(self.tag_file, "completions", data, generation)
+        )
+        self.assertEqual(snapshot.load_snapshot(self.tag_file, "completions"), data)
+        self.assertIsNone(snapshot.load_snapshot(self.tag_file, "symbols"))
+
+    def test_load_snapshot__outdated(self):
+        generation = ctags.get_generation(self.tag_file)
+        snapshot.save_snapshot(self.tag_file, "completions", {}, generation)
+
+        with open(self.tag_file, "a", encoding="utf-8") as f:
+            f.write('beta\ta.py\t/^def beta():$/;"\tf\n')
+
+        self.assertIsNone(snapshot.load_snapshot(self.tag_file, "completions"))
+
+    def test_load_snapshot__untrusted(self):
+        class Exploit(object):
+            def __reduce__(self):
+                return (os.remove, (self.tag_file,))
+
+        Exploit.tag_file = self.tag_file
+        payload = pickle.dumps(Exploit())
+
+        # files next to the tag file are never loaded
+        with open(self.tag_file + "_completions", "wb") as f:
+            f.write(payload)
+        self.assertIsNone(snapshot.load_snapshot(self.tag_file, "completions"))
+
+        # payloads of snapshots of other tag files aren't unpickled
+        path = snapshot.snapshot_path(self.tag_file, "completions")
+        os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(b'[2, "0", "", "tags"]\n' + payload)
+        self.assertIsNone(snapshot.load_snapshot(self.tag_file, "completions"))
+
+        self.assertTrue(os.path.exists(self.tag_file))
+
+        # nothing is stored or loaded without a snapshot directory
+        snapshot.snapshot_dir = None
+        self.assertFalse(snapshot.save_snapshot(self.tag_file, "completions", {}, "1"))
+        self.assertIsNone(snapshot.load_snapshot(self.tag_file, "completions"))
+
+    def test_restore_tags(self):
+        tag_class = ctags.TagFile(self.tag_file, ctags.FILENAME).tag_class()
+        with open(self.tag_file, encoding="utf-8") as f:
+            tags = ctags.parse_tag_lines(f, tag_class=tag_class)
+
+        restored = snapshot.restore_tags(snapshot.dump_tags(tags), tag_class)
+
+        self.assertEqual(restored, tags)
+        self.assertEqual(restored["alpha"][0].root_dir, self.tmp_dir)
+        self.assertEqual(
+            snapshot.restore_tags(snapshot.dump_tags(tags["alpha"]), tag_class),
+            tags["alpha"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
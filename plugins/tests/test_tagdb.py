@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+"""
+Unit tests for 'tagdb.py'.
+"""
+
+import os
+import tempfile
+import unittest
+
+from .. import ctags
+from .. import tagdb
+
+
+class TagDatabaseTest(unittest.TestCase):
+    #
+    # Helper functions
+    #
+
+    def build_tag_file(self):
+        """
+        Build a small, sorted tag file.
+
+        :returns: Path to the tag file
+        """
+        with tempfile.NamedTemporaryFile(
+            mode="w", delete=False, encoding="utf-8"
+        ) as temp:
+            temp.writelines(
+                [
+                    "!_TAG_FILE_SORTED\t1\t/0=unsorted, 1=sorted, 2=foldcase/\n",
+                    'MyClass\ta.py\t/^class MyClass:$/;"\tc\n',
+                    'get_name\ta.py\t/^    def get_name(self):$/;"\tm\tclass:MyClass\n',
+                    'get_value\tb.py\t/^def get_value():$/;"\tf\n',
+                    'set_name\ta.py\t/^    def set_name(self):$/;"\tm\tclass:MyClass\n',
+                ]
+            )
+
+        return temp.name
+
+    def setUp(self):
+        self.tag_file = self.build_tag_file()
+
+    def tearDown(self):
+        for path in (self.tag_file, self.tag_file + "_db"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    #
+    # Test functions
+    #
+
+    def test_search__exact(self):
+        with tagdb.TagDatabase(self.tag_file, ctags.SYMBOL) as db:
+            result = [tag.line for tag in db.search(True, "get_name")]
+
+        self.assertEqual(
+            result, ['get_name\ta.py\t/^    def get_name(self):$/;"\tm\tclass:MyClass']
+        )
+
+    def test_search__prefix(self):
+        with tagdb.TagDatabase(self.tag_file, ctags.SYMBOL) as db:
+            result = [tag.key for tag in db.search(False, "get_")]
+
+        self.assertEqual(result, ["get_name", "get_value"])
+
+    def test_search__ignore_case(self):
+        with open(self.tag_file, "a", encoding="utf-8") as file_:
+            file_.write('Stra\u00dfe\tb.py\t/^Stra\u00dfe = 1$/;"\tv\n')
+
+        with tagdb.TagDatabase(self.tag_file, ctags.SYMBOL, True) as db:
+            result = [tag.key for tag in db.search(True, "GET_NAME", "STRASSE")]
+            folded = [tag.key for tag in db.search(False, "stra\u00df")]
+
+        # only ASCII letters are folded, as in ``TagFile``
+        self.assertEqual(result, ["get_name"])
+        self.assertEqual(folded, ["Stra\u00dfe"])
+
+    def test_search_by_suffix(self):
+        with tagdb.TagDatabase(self.tag_file, ctags.SYMBOL) as db:
+            result = sorted(tag.key for tag in db.search_by_suffix("_name"))
+
+        self.assertEqual(result, ["get_name", "set_name"])
+
+    def test_get_tags_dict(self):
+        with tagdb.TagDatabase(self.tag_file, ctags.FILENAME) as db:
+            result = db.get_tags_dict("b.py")
+
+        self.assertEqual(list(result), ["get_value"])
+        self.assertEqual(
+            result["get_value"][0].root_dir, os.path.dirname(self.tag_file)
+        )
+
+    def test_update_files(self):
+        with tagdb.TagDatabase(self.tag_file, ctags.SYMBOL) as db:
+            db.update_files(
+                {
+                    "a.py": ['get_other\ta.py\t/^def get_other():$/;"\tf\n'],
+                    "b.py": [],
+                }
+            )
+            result = [tag.key for tag in db.search()]
+
+        self.assertEqual(result, ["get_other"])
+
+    def test_update(self):
+        with tagdb.TagDatabase(self.tag_file, ctags.SYMBOL) as db:
+            pass
+
+        base = ctags.get_generation(self.tag_file)
+        line = 'zed\tb.py\t/^zed = 1$/;"\tv\n'
+        with open(self.tag_file, "a", encoding="utf-8") as file_:
+            file_.write(line)
+
+        old_lines = ['get_value\tb.py\t/^def get_value():$/;"\tf\n']
+        diff = ctags.TagsDiff({"b.py": old_lines}, {"b.py": old_lines + [line]}, base)
+
+        db = tagdb.TagDatabase(self.tag_file, ctags.SYMBOL)
+        db.load = None  # must not reload all tags
+        db.update(diff)
+        db.close()
+
+        # the database is up to date with the rebuilt tag file
+        with tagdb.TagDatabase(self.tag_file, ctags.SYMBOL) as db:
+            db.load = None
+            result = [tag.key for tag in db.search(False, "")]
+
+        self.assertEqual(
+            sorted(result), ["MyClass", "get_name", "get_value", "set_name", "zed"]
+        )
+
+    def test_update__reloads_other_base(self):
+        with tagdb.TagDatabase(self.tag_file, ctags.SYMBOL) as db:
+            pass
+
+        with open(self.tag_file, "a", encoding="utf-8") as file_:
+            file_.write('zed\tb.py\t/^zed = 1$/;"\tv\n')
+
+        db = tagdb.TagDatabase(self.tag_file, ctags.SYMBOL)
+        db.update(ctags.TagsDiff({}, {}, "other"))
+        self.assertEqual(len(db), 5)
+        db.close()
+
+    def test_open__reloads_other_version(self):
+        with tagdb.TagDatabase(self.tag_file, ctags.SYMBOL) as db:
+            with db.connection:
+                db.connection.execute("DELETE FROM tags")
+                db.connection.execute(
+                    "UPDATE meta SET value = '1' WHERE key = 'version'"
+                )
+
+        with tagdb.TagDatabase(self.tag_file, ctags.SYMBOL) as db:
+            self.assertEqual(len(db), 4)
+
+    def test_open__no_build(self):
+        db = tagdb.TagDatabase(self.tag_file, ctags.SYMBOL, build=False)
+        self.assertFalse(db.is_current())
+        self.assertRaises(OSError, db.open)
+        self.assertFalse(os.path.exists(db.db_path))
+
+        with tagdb.TagDatabase(self.tag_file, ctags.SYMBOL):
+            pass
+        self.assertTrue(db.is_current())
+
+        with open(self.tag_file, "a", encoding="utf-8") as file_:
+            file_.write('zed\tb.py\t/^zed = 1$/;"\tv\n')
+        self.assertFalse(db.is_current())
+        self.assertRaises(OSError, db.open)
+
+    def test_prefault(self):
+        with tagdb.TagDatabase(self.tag_file, ctags.SYMBOL) as db:
+            size = db.prefault()
+
+        self.assertEqual(size, os.path.getsize(self.tag_file + "_db"))
+
+    def test_offsets__unsupported(self):
+        with tagdb.TagDatabase(self.tag_file, ctags.SYMBOL) as db:
+            self.assertRaises(NotImplementedError, lambda: db[0])
+            self.assertRaises(NotImplementedError, db.bisect_left, b"get")
+            self.assertRaises(NotImplementedError, db.key_at, 0, 10)
+            self.assertRaises(NotImplementedError, db.line_bounds, 0)
+
+    def test_open__reloads_outdated_database(self):
+        with tagdb.TagDatabase(self.tag_file, ctags.SYMBOL) as db:
+            self.assertEqual(len(db), 4)
+
+        with open(self.tag_file, "a", encoding="utf-8") as file_:
+            file_.write('zed\tb.py\t/^zed = 1$/;"\tv\n')
+
+        with tagdb.TagDatabase(self.tag_file, ctags.SYMBOL) as db:
+            self.assertEqual(len(db), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
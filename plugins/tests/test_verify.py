@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""
+Unit tests for 'verify.py'.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from .. import verify
+
+
+class VerifyTest(unittest.TestCase):
+    #
+    # Helper functions
+    #
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        with open(os.path.join(self.tmp_dir, "a.py"), "w", encoding="utf-8") as f:
+            f.writelines(
+                [
+                    "class MyClass(object):\n",
+                    "\tdef my_method(self):\n",
+                    "\t\tpass\n",
+                ]
+            )
+
+        self.tag_file = os.path.join(self.tmp_dir, "tags")
+        with open(self.tag_file, "w", encoding="utf-8") as f:
+            f.writelines(
+                [
+                    "!_TAG_FILE_SORTED\t1\t/0=unsorted, 1=sorted, 2=foldcase/\n",
+                    'MyClass\ta.py\t/^class MyClass(object):$/;"\tc\n',
+                    'gone\ta.py\t/^def gone():$/;"\tf\n',
+                    'missing\tb.py\t/^def missing():$/;"\tf\n',
+                    'my_method\ta.py\t2;"\tm\tclass:MyClass\n',
+                    'wrong_line\ta.py\t3;"\tf\n',
+                ]
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    #
+    # Test functions
+    #
+
+    def test_verify_file(self):
+        with open(self.tag_file, encoding="utf-8") as f:
+            lines = [line for line in f if "\ta.py\t" in line]
+
+        tested, failures = verify.verify_file(os.path.join(self.tmp_dir, "a.py"), lines)
+
+        self.assertEqual(tested, 4)
+        self.assertEqual(
+            [(symbol, reason) for symbol, _, reason in failures],
+            [("gone", "pattern not found"), ("wrong_line", "no match at line")],
+        )
+
+    def test_verify_tags(self):
+        tested, failures = verify.verify_tags(self.tag_file, max_workers=2)
+
+        self.assertEqual(tested, 5)
+        self.assertEqual(
+            sorted((filename, symbol) for filename, symbol, _, _ in failures),
+            [("a.py", "gone"), ("a.py", "wrong_line"), ("b.py", "missing")],
+        )
+
+    def test_main(self):
+        # the directory the package of the plugin can be imported from
+        root = os.path.abspath(verify.__file__)
+        for _ in verify.__name__.split("."):
+            root = os.path.dirname(root)
+
+        result = subprocess.run(
+            [sys.executable, "-m", verify.__name__, self.tag_file, "--workers", "2"],
+            cwd=root,
+            stdout=subprocess.PIPE,
+        )
+
+        self.assertEqual(result.returncode, 1)
+        self.assertTrue(
+            result.stdout.startswith(b"2 Tags Tested OK\n3 Tags Failed\n"),
+            result.stdout,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
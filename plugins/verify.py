@@ -0,0 +1,151 @@
+"""
+A headless verifier of the accuracy of tag files.
+
+Run by a Python interpreter, source files are verified by worker processes
+in parallel, e.g. from the ``Packages`` directory of Sublime Text::
+
+    python -m CTags.plugins.verify path/to/tags
+"""
+
+import argparse
+import os
+import sys
+
+from concurrent.futures import as_completed
+
+from .ctags import group_tag_lines, iter_tags
+from .pool import create_pool
+
+
+def match_line(source_line, text, by_pattern):
+    """
+    Check if a source line matches a tag's pattern or contains its symbol.
+    """
+    if by_pattern:
+        return source_line.startswith(text)
+    return text in source_line
+
+
+def verify_file(path, lines):
+    """
+    Verify the tags of a single source file.
+
+    The file is read once. Tags located by line number must name a symbol on
+    that line, tags located by a pattern must match the start of a line (the
+    line given by the ``line`` field, if any).
+
+    :param path: path to the source file
+    :param lines: tag lines of the source file
+
+    :returns: tuple of the number of verified tags and a list of failures,
+        each a tuple of symbol, ex_command and reason
+    """
+    failures = []
+    tags = list(iter_tags(lines, fields=("symbol", "ex_command", "line")))
+
+    try:
+        with open(path, encoding="utf-8", errors="replace", newline="") as file_:
+            content = file_.read()
+    except OSError as e:
+        return len(tags), [(t["symbol"], t["ex_command"], str(e)) for t in tags]
+
+    source_lines = content.splitlines()
+    content = "\n" + "\n".join(source_lines)
+
+    for tag in tags:
+        ex_command = tag["ex_command"]
+        line = tag.get("line")
+
+        if ex_command.isdigit():  # line number, so look for the symbol
+            line, text, by_pattern = ex_command, tag["symbol"], False
+        else:
+            text, by_pattern = ex_command, True
+
+        if line and line.isdigit():
+            index = int(line) - 1
+            if not 0 <= index < len(source_lines):
+                failures.append((tag["symbol"], ex_command, "line out of range"))
+            elif not match_line(source_lines[index], text, by_pattern):
+                failures.append((tag["symbol"], ex_command, "no match at line"))
+        elif ("\n" + text) not in content:
+            failures.append((tag["symbol"], ex_command, "pattern not found"))
+
+    return len(tags), failures
+
+
+def verify_tags(tag_file, max_workers=None, on_progress=None):
+    """
+    Verify all tags of a tag file.
+
+    Source files are verified by a pool of workers, see ``create_pool``. In
+    Sublime Text these are threads sharing the GIL, so files are verified
+    one at a time, in the background.
+
+    :param tag_file: path to a tag file
+    :param max_workers: maximum number of workers
+    :param on_progress: callback receiving the number of verified and total
+        source files whenever a source file has been verified
+
+    :returns: tuple of the number of verified tags and a list of failures,
+        each a tuple of filename, symbol, ex_command and reason
+    """
+    root_dir = os.path.dirname(tag_file)
+    groups = group_tag_lines(tag_file)
+
+    tested = 0
+    failures = []
+
+    with create_pool(max_workers) as pool:
+        futures = {
+            pool.submit(verify_file, os.path.join(root_dir, filename), lines): filename
+            for filename, lines in groups.items()
+        }
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            filename = futures[future]
+            count, file_failures = future.result()
+            tested += count
+            failures.extend((filename,) + failure for failure in file_failures)
+
+            if on_progress:
+                on_progress(done, len(futures))
+
+    return tested, failures
+
+
+def format_report(tested, failures):
+    """
+    Format the results of ``verify_tags`` for humans.
+    """
+    report = "%s Tags Tested OK\n%s Tags Failed\n" % (
+        tested - len(failures),
+        len(failures),
+    )
+    report += "".join(
+        "\n%s: %s (%s)\n    %s" % (filename, symbol, reason, ex_command.strip())
+        for filename, symbol, ex_command, reason in failures
+    )
+    return report
+
+
+def main(args=None):
+    """
+    Verify a tag file from the command line.
+
+    :param args: list of command line arguments, defaults to ``sys.argv``
+
+    :returns: exit status, 1 if any tag failed
+    """
+    parser = argparse.ArgumentParser(description="Verify the tags of a tag file.")
+    parser.add_argument("tag_file", help="path to the tag file")
+    parser.add_argument("-j", "--workers", type=int, help="number of workers")
+    args = parser.parse_args(args)
+
+    tested, failures = verify_tags(args.tag_file, args.workers)
+    sys.stdout.write(format_report(tested, failures) + "\n")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())